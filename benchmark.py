@@ -0,0 +1,351 @@
+import argparse
+import json
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import quaternion
+from sensor_processing import Extended_Kalman_Filter, Fast_Extended_Kalman_Filter, Steady_State_Kalman_Filter, gyro_to_delta_rot_batch, acc_mag_to_euler_batch, quaternion_angle_batch
+from recording import load_recording, records_to_arrays
+from stream_fusion import Stream_Fusion
+from payload_imu_class import Payload_IMU, Payload_IMU_Slots, unpack_batch, pack_batch, STRUCT_DTYPE
+from payload_imu_v2 import Payload_IMU_V2
+
+def time_per_item(func, n_items, repeats=5):
+    """
+    Time a function and return the best cost per item over a few repeats.
+
+    Args:
+        func: Function to time, called with no arguments.
+        n_items: Number of items the function processes per call.
+        repeats: Number of times to call the function.
+
+    Returns:
+        float: Best time per item in nanoseconds.
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best / n_items * 1e9
+
+def report(results):
+    """Print benchmark results as a table of per-item costs."""
+    baseline = results[0][1]
+    for name, ns in results:
+        print(f"{name:<40} {ns:>10.1f} ns/item  {baseline / ns:>7.1f}x")
+
+def random_records(n):
+    """Generate n structured IMU records with realistic ranges."""
+    rng = np.random.default_rng(0)
+    records = np.zeros(n, dtype=STRUCT_DTYPE)
+    for name in ("xAcc", "yAcc", "zAcc"):
+        records[name] = rng.uniform(-1000, 1000, n)
+    for name in ("xGyro", "yGyro", "zGyro"):
+        records[name] = rng.integers(-135000, 135000, n)
+    for name in ("xMag", "yMag", "zMag"):
+        records[name] = rng.uniform(-450, 250, n)
+    for name in ("timestampAcc", "timestampGyro", "timestampMag"):
+        records[name] = np.arange(n) * 2
+    return records
+
+def bench_codec(args):
+    """Compare per-record Payload_IMU pack/unpack against the slotted record, the batch codec and the v2 wire format."""
+    records = random_records(args.n)
+    data = pack_batch(records)
+    codec = Payload_IMU_V2(samples_per_frame=args.frame_samples)
+    data_v2 = codec.encode(records)
+    frames = [data[i:i + STRUCT_DTYPE.itemsize] for i in range(0, len(data), STRUCT_DTYPE.itemsize)]
+    objects = [Payload_IMU.unpack(frame) for frame in frames]
+    slotted = [Payload_IMU_Slots.unpack(frame) for frame in frames]
+
+    print(f"pack, {args.n} records")
+    report([
+        ("Payload_IMU.pack", time_per_item(lambda: [imu.pack() for imu in objects], args.n)),
+        ("Payload_IMU_Slots.pack", time_per_item(lambda: [imu.pack() for imu in slotted], args.n)),
+        ("pack_batch", time_per_item(lambda: pack_batch(records), args.n)),
+        ("Payload_IMU_V2.encode", time_per_item(lambda: codec.encode(records), args.n)),
+    ])
+    print(f"\nunpack, {args.n} records")
+    report([
+        ("Payload_IMU.unpack", time_per_item(lambda: [Payload_IMU.unpack(frame) for frame in frames], args.n)),
+        ("Payload_IMU_Slots.unpack", time_per_item(lambda: [Payload_IMU_Slots.unpack(frame) for frame in frames], args.n)),
+        ("unpack_batch", time_per_item(lambda: unpack_batch(data), args.n)),
+        ("unpack_batch + copy", time_per_item(lambda: unpack_batch(data).copy(), args.n)),
+        ("Payload_IMU_V2.decode", time_per_item(lambda: codec.decode(data_v2), args.n)),
+    ])
+    print(f"\nbytes per record: v1 {len(data) / args.n:.1f}, v2 {len(data_v2) / args.n:.1f} ({len(data) / len(data_v2):.2f}x smaller, {args.frame_samples} samples per frame)")
+
+def bench_ekf(args):
+    """Compare the per-step cost and output of Extended_Kalman_Filter and Fast_Extended_Kalman_Filter."""
+    rng = np.random.default_rng(0)
+    delta_gyros = rng.normal(0, 0.01, (args.n, 3)).tolist()
+    measurements = rng.normal(0, 0.5, (args.n, 3)).tolist()
+    q0 = quaternion.from_euler_angles(measurements[0])
+
+    def run(ekf):
+        for delta_gyro, measurement in zip(delta_gyros, measurements):
+            ekf.predict(delta_gyro)
+            ekf.update(measurement)
+        return ekf
+
+    # Diagonal but non-scalar R exercises the matrix path of the fast filter
+    def anisotropic(ekf_class):
+        ekf = ekf_class(q0)
+        ekf.R = np.diag([0.1, 0.15, 0.2, 0.25])
+        return ekf
+
+    print(f"predict + update, {args.n} steps")
+    report([
+        ("Extended_Kalman_Filter", time_per_item(lambda: run(Extended_Kalman_Filter(q0)), args.n, repeats=1)),
+        ("Fast_Extended_Kalman_Filter (scalar)", time_per_item(lambda: run(Fast_Extended_Kalman_Filter(q0)), args.n, repeats=1)),
+        ("Fast_Extended_Kalman_Filter (matrix)", time_per_item(lambda: run(anisotropic(Fast_Extended_Kalman_Filter)), args.n, repeats=1)),
+    ])
+
+    # Largest difference in the fused quaternion after the whole run
+    for name, fast, reference in [("scalar", run(Fast_Extended_Kalman_Filter(q0)), run(Extended_Kalman_Filter(q0))),
+                                  ("matrix", run(anisotropic(Fast_Extended_Kalman_Filter)), run(anisotropic(Extended_Kalman_Filter)))]:
+        error = np.abs(quaternion.as_float_array(fast.q) - quaternion.as_float_array(reference.q)).max()
+        print(f"max |q_fast - q| ({name}): {error:.2e}")
+
+def bench_steady(args):
+    """Report the accuracy against speed of Steady_State_Kalman_Filter over a recording, for several tolerances."""
+    accel, gyro, mag, dt = records_to_arrays(load_recording(args.input_path))
+    delta_gyros = gyro_to_delta_rot_batch(gyro, dt)
+    measurements = acc_mag_to_euler_batch(accel, mag)
+    q0 = quaternion.from_euler_angles(measurements[0])
+    n = len(dt)
+
+    # Diagonal R puts the filters on the matrix path, with scalar covariances the steady-state filter is Fast_Extended_Kalman_Filter
+    def make(ekf_class, **kwargs):
+        ekf = ekf_class(q0, **kwargs)
+        ekf.R = np.diag([0.1, 0.15, 0.2, 0.25])
+        return ekf
+
+    reference = make(Extended_Kalman_Filter).filter_batch(delta_gyros, measurements)
+    baseline = time_per_item(lambda: make(Fast_Extended_Kalman_Filter).filter_batch(delta_gyros, measurements), n, repeats=3)
+
+    print(f"matrix path, {n} samples from {args.input_path}, errors against Extended_Kalman_Filter")
+    print(f"{'filter':<40} {'ns/sample':>10} {'speedup':>8} {'frozen':>7} {'fallbacks':>9} {'max err':>10} {'mean err':>10}")
+    fast = make(Fast_Extended_Kalman_Filter).filter_batch(delta_gyros, measurements)
+    error = quaternion_angle_batch(fast, reference)
+    print(f"{'Fast_Extended_Kalman_Filter':<40} {baseline:>10.1f} {1:>7.2f}x {'-':>7} {'-':>9} {error.max():>9.2e}° {error.mean():>9.2e}°")
+
+    for tolerance in args.tolerances:
+        ns = time_per_item(lambda: make(Steady_State_Kalman_Filter, tolerance=tolerance).filter_batch(delta_gyros, measurements), n, repeats=3)
+        ekf = make(Steady_State_Kalman_Filter, tolerance=tolerance)
+        error = quaternion_angle_batch(ekf.filter_batch(delta_gyros, measurements), reference)
+        name = f"Steady_State_Kalman_Filter tol={tolerance:g}"
+        print(f"{name:<40} {ns:>10.1f} {baseline / ns:>7.2f}x {ekf.frozen_steps / n:>7.1%} {ekf.fallbacks:>9} {error.max():>9.2e}° {error.mean():>9.2e}°")
+
+def bench_updates(args):
+    """Report the cost and accuracy of scheduling measurement updates on fresh readings, for several decimations."""
+    full_rate = np.array(load_recording(args.input_path))
+    n = len(full_rate)
+
+    # Hold each reading for a few samples, like an accelerometer or magnetometer running slower than the gyro
+    records = full_rate.copy()
+    for sensor, hold in (("Acc", args.acc_hold), ("Mag", args.mag_hold)):
+        held = np.arange(n) // hold * hold
+        for name in (f"x{sensor}", f"y{sensor}", f"z{sensor}", f"timestamp{sensor}"):
+            records[name] = records[name][held]
+
+    def fuse(records, decimation=1, is_scheduled=True):
+        """Fuse the records, updating on every sample (stale readings included) unless scheduled."""
+        fusion = Stream_Fusion(update_decimation=decimation)
+        accel, gyro, mag, dt = records_to_arrays(records)
+        timestamps = np.column_stack((records["timestampAcc"], records["timestampMag"])) if is_scheduled else None
+        return fusion, fusion.process_samples(accel, gyro, mag, dt, timestamps)[2]
+
+    # Errors are against every sensor at the full rate, updating on every sample
+    _, reference = fuse(full_rate, is_scheduled=False)
+    runs = [("every sample, stale readings included", 1, False)] + [(f"fresh readings, decimation {decimation}", decimation, True) for decimation in args.decimations]
+
+    print(f"{n} samples from {args.input_path}, accelerometer held for {args.acc_hold} and magnetometer for {args.mag_hold} samples")
+    print(f"errors against fusing every sensor at the full rate")
+    print(f"{'updates on':<40} {'ns/sample':>10} {'speedup':>8} {'updates':>8} {'mean err':>10} {'p99 err':>10}")
+    baseline = None
+    for name, decimation, is_scheduled in runs:
+        ns = time_per_item(lambda: fuse(records, decimation, is_scheduled), n, repeats=3)
+        baseline = baseline or ns
+        fusion, fused = fuse(records, decimation, is_scheduled)
+        error = quaternion_angle_batch(fused, reference)
+        print(f"{name:<40} {ns:>10.1f} {baseline / ns:>7.2f}x {fusion.updates / n:>8.1%} {error.mean():>9.2e}° {np.percentile(error, 99):>9.2e}°")
+
+def wait_with_usage(process, timeout=None, poll_interval=0.01):
+    """
+    Wait for a child process and return its resource usage, interrupting it (like Ctrl+C) if it outlives the timeout.
+    The child is only ever reaped here with os.wait4, which is the only wait that returns its usage.
+
+    Args:
+        process: subprocess.Popen of the child.
+        timeout: Seconds to wait before sending SIGINT, None waits for the child to exit on its own.
+        poll_interval: Sleep between checks while waiting for the timeout.
+
+    Returns:
+        resource.struct_rusage: CPU times and peak RSS of the child.
+    """
+    if timeout is not None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid == process.pid:
+                process.returncode = os.waitstatus_to_exitcode(status)
+                return usage
+            time.sleep(poll_interval)
+        os.kill(process.pid, signal.SIGINT) # not Popen.send_signal, which polls and could reap the child first
+
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return usage
+
+def run_pipeline(data_mode, freq_hz, args, workdir):
+    """
+    Run publisher.py and consumer.py over a temporary socket path and measure the run.
+    Latency pairs the i-th send with the i-th fused sample, so it assumes the consumer does not drop samples.
+
+    Args:
+        data_mode: Publisher data mode.
+        freq_hz: Publisher frequency.
+        args: Parsed benchmark arguments.
+        workdir: Directory for the socket and the time logs.
+
+    Returns:
+        dict: Throughput, drops, latency percentiles and per-process CPU and RSS.
+    """
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    socket_path = os.path.join(workdir, f"imu_{data_mode}_{freq_hz}.sock")
+    send_log = os.path.join(workdir, f"send_{data_mode}_{freq_hz}.npy")
+    fused_log = os.path.join(workdir, f"fused_{data_mode}_{freq_hz}.npy")
+
+    # Start the consumer, and wait for it to bind the socket
+    consumer = subprocess.Popen(
+        [sys.executable, "consumer.py", "--socket-path", socket_path, "--fused-log", fused_log, "--log-level", "CRITICAL",
+         "--no-visualize", "--max-timeouts", "1000000", *shlex.split(args.consumer_args)],
+        cwd=repo_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while not os.path.exists(socket_path) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    publisher = None
+    try:
+        # Run the publisher for the duration, or until a recording runs out
+        start = time.monotonic()
+        publisher = subprocess.Popen(
+            [sys.executable, "publisher.py", "--socket-path", socket_path, "--send-log", send_log, "--log-level", "CRITICAL",
+             "--frequency-hz", str(freq_hz), "--data-mode", data_mode, *shlex.split(args.publisher_args)],
+            cwd=repo_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        publisher_usage = wait_with_usage(publisher, timeout=args.duration)
+        wall = time.monotonic() - start
+
+        # Give the consumer time to work through its queue, then stop it
+        consumer_usage = wait_with_usage(consumer, timeout=args.grace)
+        wall_consumer = time.monotonic() - start
+    finally:
+        # Never leave either process running if the run failed
+        for process in (publisher, consumer):
+            if process is not None and process.returncode is None:
+                process.kill()
+                process.wait()
+
+    send_times = np.load(send_log) if os.path.exists(send_log) else np.empty(0, dtype=np.int64)
+    fused_times = np.load(fused_log) if os.path.exists(fused_log) else np.empty(0, dtype=np.int64)
+    n = min(len(send_times), len(fused_times))
+    latency_ms = (fused_times[:n] - send_times[:n]) / 1e6
+
+    def rate(times):
+        return (len(times) - 1) / ((times[-1] - times[0]) / 1e9) if len(times) > 1 and times[-1] > times[0] else 0.0
+
+    def percentile(q):
+        return float(np.percentile(latency_ms, q)) if n else None
+
+    return {
+        "data_mode": data_mode,
+        "target_hz": freq_hz,
+        "sent": int(len(send_times)),
+        "fused": int(len(fused_times)),
+        "publish_hz": rate(send_times),
+        "fused_hz": rate(fused_times),
+        "dropped": int(len(send_times) - len(fused_times)),
+        "late": int(np.count_nonzero(latency_ms > args.late_ms)),
+        "latency_p50_ms": percentile(50),
+        "latency_p99_ms": percentile(99),
+        "latency_p999_ms": percentile(99.9),
+        "publisher_cpu_percent": (publisher_usage.ru_utime + publisher_usage.ru_stime) / wall * 100,
+        "publisher_rss_mb": publisher_usage.ru_maxrss / 1024,
+        "consumer_cpu_percent": (consumer_usage.ru_utime + consumer_usage.ru_stime) / wall_consumer * 100,
+        "consumer_rss_mb": consumer_usage.ru_maxrss / 1024,
+    }
+
+def bench_pipeline(args):
+    """Sweep the publisher frequency in each data mode until the pipeline saturates, and report every run."""
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for data_mode in args.data_modes:
+            freq_hz = args.start_hz
+            while freq_hz <= args.max_hz:
+                result = run_pipeline(data_mode, freq_hz, args, workdir)
+                results.append(result)
+                print(f"{data_mode:<7} {freq_hz:>7} Hz  published {result['publish_hz']:>9.1f} Hz  fused {result['fused_hz']:>9.1f} Hz  "
+                      f"dropped {result['dropped']:>6}  late {result['late']:>6}  p50/p99/p99.9 "
+                      f"{result['latency_p50_ms'] or 0:.2f}/{result['latency_p99_ms'] or 0:.2f}/{result['latency_p999_ms'] or 0:.2f} ms  "
+                      f"cpu {result['publisher_cpu_percent']:.0f}%/{result['consumer_cpu_percent']:.0f}%  "
+                      f"rss {result['publisher_rss_mb']:.0f}/{result['consumer_rss_mb']:.0f} MB", flush=True)
+
+                # Saturated once either side falls short of the target rate
+                if min(result["publish_hz"], result["fused_hz"]) < args.saturation * freq_hz:
+                    break
+                freq_hz *= 2
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    # Initalize argument parser and define a subcommand per benchmark
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    codec_parser = subparsers.add_parser("codec", help="Payload_IMU pack/unpack against the batch codec")
+    codec_parser.add_argument("-n", dest="n", type=int, default=100000, help="number of records")
+    codec_parser.add_argument("--frame-samples", dest="frame_samples", type=int, default=16, help="samples per v2 frame")
+    codec_parser.set_defaults(func=bench_codec)
+
+    ekf_parser = subparsers.add_parser("ekf", help="Extended_Kalman_Filter against the allocation-free fast path")
+    ekf_parser.add_argument("-n", dest="n", type=int, default=20000, help="number of predict/update steps")
+    ekf_parser.set_defaults(func=bench_ekf)
+
+    steady_parser = subparsers.add_parser("steady", help="accuracy against speed of the steady-state gain filter on a recording")
+    steady_parser.add_argument("--input", dest="input_path", type=str, default="sensor_data.csv", help="recording to filter, binary or CSV")
+    steady_parser.add_argument("--tolerances", dest="tolerances", type=float, nargs="+", default=[1e-12, 1e-9, 1e-6, 1e-3], help="relative P tolerances to compare")
+    steady_parser.set_defaults(func=bench_steady)
+
+    updates_parser = subparsers.add_parser("updates", help="cost and accuracy of multi-rate measurement update scheduling on a recording")
+    updates_parser.add_argument("--input", dest="input_path", type=str, default="sensor_data.csv", help="recording to fuse, binary or CSV")
+    updates_parser.add_argument("--acc-hold", dest="acc_hold", type=int, default=1, help="hold each accelerometer reading for this many samples, to simulate a slower accelerometer")
+    updates_parser.add_argument("--mag-hold", dest="mag_hold", type=int, default=1, help="hold each magnetometer reading for this many samples, to simulate a slower magnetometer")
+    updates_parser.add_argument("--decimations", dest="decimations", type=int, nargs="+", default=[1, 2, 4, 8], help="update decimations to compare")
+    updates_parser.set_defaults(func=bench_updates)
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="end-to-end publisher to consumer throughput and latency sweep")
+    pipeline_parser.add_argument("--data-modes", dest="data_modes", nargs="+", default=["random", "csv"], choices=["random", "csv", "binary"], help="publisher data modes to sweep")
+    pipeline_parser.add_argument("--start-hz", dest="start_hz", type=int, default=100, help="first publisher frequency, doubled each run")
+    pipeline_parser.add_argument("--max-hz", dest="max_hz", type=int, default=51200, help="highest publisher frequency")
+    pipeline_parser.add_argument("--duration", dest="duration", type=float, default=5, help="seconds to publish for at each frequency")
+    pipeline_parser.add_argument("--grace", dest="grace", type=float, default=2, help="seconds the consumer gets to finish its queue after the publisher stops")
+    pipeline_parser.add_argument("--late-ms", dest="late_ms", type=float, default=10, help="publish to fused latency above which a sample counts as late")
+    pipeline_parser.add_argument("--saturation", dest="saturation", type=float, default=0.9, help="stop the sweep when the published or fused rate falls below this fraction of the target")
+    pipeline_parser.add_argument("--consumer-args", dest="consumer_args", type=str, default="", help="extra consumer arguments, e.g. \"--recv-mode batch\"")
+    pipeline_parser.add_argument("--publisher-args", dest="publisher_args", type=str, default="", help="extra publisher arguments")
+    pipeline_parser.add_argument("--output", dest="output", type=str, default=None, help="write the results as JSON to this file")
+    pipeline_parser.set_defaults(func=bench_pipeline)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -1,73 +1,156 @@
+import time
+STARTED = time.perf_counter() # Before every other import, for the startup timings
 import argparse
 import logging
 import socket
 import os
-import time
-from payload_imu_class import Payload_IMU as IMU, STRUCT_SIZE
+import signal
+import multiprocessing
+from payload_imu_class import Payload_IMU_Slots as IMU, STRUCT_SIZE
 import threading
-from queue import Queue, Empty as QueueEmpty
-import quaternion
+from queue import Empty as QueueEmpty, Full as QueueFull
 import numpy as np
-from sensor_processing import Extended_Kalman_Filter as EKF, gyro_to_delta_rot, acc_mag_to_euler
-from visualizer import Visualizer
+from sensor_processing import Extended_Kalman_Filter, Fast_Extended_Kalman_Filter, Steady_State_Kalman_Filter, acc_mag_to_euler, euler_to_quaternion_array, euler_to_quaternion_batch
+from frame_reader import Frame_Reader, negotiate_wire_format
+from sample_queue import Sample_Queue, QUEUE_POLICIES
+from shm_ring import Shm_Ring, shm_name, WRITER_DISCONNECTED
+from instrumentation import Metrics, Stats_Exporter
+from stream_recorder import Stream_Recorder
+from stream_fusion import Stream_Fusion
+from fused_stream import Fused_Server, Fused_Ring, make_records
+IMPORTED = time.perf_counter()
+
+# Filter implementations selectable with --ekf, all share the same API, "steady" trades a bounded error for speed with non-scalar covariances
+EKF_CLASSES = {"standard": Extended_Kalman_Filter, "fast": Fast_Extended_Kalman_Filter, "steady": Steady_State_Kalman_Filter}
+
+def log_fusion(gyro_state, euler_rotation, fused_q, queue):
+    """
+    Log the gyro, accel/mag and fused orientations of a sample, and the queue counters.
 
-def processing_thread(event, queue):
+    Args:
+        gyro_state: Integrated gyroscope Euler angles.
+        euler_rotation: Accelerometer and magnetometer Euler angles.
+        fused_q: Fused quaternion components (w, x, y, z) from the EKF.
+        queue: Sample_Queue object to report on.
+    """
+    gyro_w, gyro_x, gyro_y, gyro_z = euler_to_quaternion_array(gyro_state)
+    acc_mag_w, acc_mag_x, acc_mag_y, acc_mag_z = euler_to_quaternion_array(euler_rotation)
+    fused_w, fused_x, fused_y, fused_z = np.asarray(fused_q, dtype=np.float64) / np.linalg.norm(fused_q)
+    logging.info(f"Gyro:          W:{gyro_w:.3} X:{gyro_x:.3} Y:{gyro_y:.3} Z:{gyro_z:.3}")
+    logging.info(f"Accel & Mag:   W:{acc_mag_w:.3} X:{acc_mag_x:.3} Y:{acc_mag_y:.3} Z:{acc_mag_z:.3}")
+    logging.info(f"Fused Result:  W:{fused_w:.3} X:{fused_x:.3} Y:{fused_y:.3} Z:{fused_z:.3}")
+    stats = queue.stats()
+    logging.info(f"Queue:         Depth:{stats['depth']} Max Depth:{stats['max_depth']} Dropped:{stats['dropped']} Coalesced:{stats['coalesced']} Max Staleness:{stats['max_staleness_ms']:.1f}ms")
+
+def processing_thread(event, queue, args, metrics):
     """
     Thread to handle conversion of raw data to euler angles and quaternions.
     This thread will run in parallel to the main thread and will process data from the queue.
 
     Args:
         event: Event object to signal when to stop the thread.
-        queue: Queue object to get data from the main thread.
+        queue: Sample_Queue object to get data from the main thread.
+        args: Parsed consumer arguments.
+        metrics: Metrics object to record the dequeue, predict, update (or fuse_block), fanout and visualize stages.
     """
 
-    # Initialize Visualizer if enabled
+    # Initialize Visualizer if enabled, matplotlib and numpy-quaternion are only imported for it
     if args.visualize:
-        plotter = Visualizer()
+        import quaternion
+        from visualizer import Visualizer
+        plotter = Visualizer(fps=args.fps)
         logging.info("Visualizer Enabled")
 
+    # Start streaming the fused samples to subscribers if enabled
+    fanout = start_fanout(args, metrics)
+
     # Define Flags and Initial State
-    is_first_data = True
+    started = time.perf_counter() # the processing stage starts once a publisher has connected
+    is_first_fused = True
     is_first_queue_empty = True
     counter = 0
-    gyro_state = np.array([0, 0, 0])
+    fused_times = []
+    fusion = Stream_Fusion(EKF_CLASSES[args.ekf], args.update_decimation, filter_options(args)) # Fusion state shared by both paths
 
     while not event.is_set():
         try:
-            result = queue.get(timeout=1) # wait for data to be available in the q
-            accel, gyro, mag, dt = result
-
-            if is_first_data:
-                # Initialize the Extended Kalman Filter with the first data
-                gyro_state = acc_mag_to_euler(accel, mag)
-                ekf = EKF(quaternion.from_euler_angles(gyro_state))
-                is_first_data = False
-
-            # Convert gyro data to delta rotation in radians
-            delta_gyro = gyro_to_delta_rot(gyro, dt)
-            gyro_state = gyro_state + np.array(delta_gyro)
-
-            # Convert accelerometer and magnetometer data to euler angles in radians
-            euler_rotation = acc_mag_to_euler(accel, mag)
-            
-            # Do Prediction and Update with the Extended Kalman Filter
-            ekf.predict(delta_gyro) # Predict the next state using the gyroscope data
-            ekf.update(euler_rotation) # Update the state with the accelerometer and magnetometer data
-
-            # Print the quaternions at the specified verbosity rate
-            if counter % args.verbosity_rate == 0:
-                gyro_norm = quaternion.from_euler_angles(gyro_state).normalized()
-                acc_mag_norm = quaternion.from_euler_angles(euler_rotation).normalized() 
-                fusion_norm = ekf.q.normalized() 
-                logging.info(f"Gyro:          W:{gyro_norm.w:.3} X:{gyro_norm.x:.3} Y:{gyro_norm.y:.3} Z:{gyro_norm.z:.3}")
-                logging.info(f"Accel & Mag:   W:{acc_mag_norm.w:.3} X:{acc_mag_norm.x:.3} Y:{acc_mag_norm.y:.3} Z:{acc_mag_norm.z:.3}")
-                logging.info(f"Fused Result:  W:{fusion_norm.w:.3} X:{fusion_norm.x:.3} Y:{fusion_norm.y:.3} Z:{fusion_norm.z:.3}")
-                counter = 0
-            counter += 1
-
-            # Update plot with the new data if visualization is enabled
-            if args.visualize:
-                plotter.update_plot(gyro_state, euler_rotation, ekf.q) # Update the plot with the new data
+            # Drain every queued sample, up to --max-block, which is a single sample under light load
+            block = queue.get_batch(args.max_block, timeout=1)
+            metrics.observe("dequeue", int(queue.last_staleness * 1e9)) # time the oldest sample spent in the queue
+
+            if len(block) >= args.min_block:
+                accel, gyro, mag, dt, timestamps = (np.array(column, dtype=np.float64) for column in zip(*block))
+
+                # Vectorized conversions for the whole block, then the EKF recursion over it
+                start = time.perf_counter_ns()
+                updates = fusion.updates
+                gyro_states, euler_rotations, fused = fusion.process_samples(accel, gyro, mag, dt, timestamps[:, 1:])
+                metrics.observe("fuse_block", time.perf_counter_ns() - start)
+                metrics.increment("samples_fused", len(block))
+                metrics.increment("updates", fusion.updates - updates)
+                metrics.increment("blocks")
+                if is_first_fused:
+                    log_first_fused(metrics, started)
+                    is_first_fused = False
+                if args.fused_log:
+                    fused_times.extend([time.monotonic_ns()] * len(block))
+
+                # Stream every fused sample of the block to the subscribers
+                if fanout is not None and fanout.is_active:
+                    start = time.perf_counter_ns()
+                    estimates = (euler_to_quaternion_batch(gyro_states), euler_to_quaternion_batch(euler_rotations)) if args.fanout_estimates else ()
+                    fanout.publish(make_records(timestamps[:, 0], fused, *estimates))
+                    metrics.observe("fanout", time.perf_counter_ns() - start)
+
+                # Print the same samples as the per-sample path, at the specified verbosity rate
+                for i in range(-counter % args.verbosity_rate, len(block), args.verbosity_rate):
+                    log_fusion(gyro_states[i], euler_rotations[i], fused[i], queue)
+                counter += len(block)
+
+                # Only the newest sample is plotted, the visualizer renders the latest data anyway
+                if args.visualize:
+                    start = time.perf_counter_ns()
+                    plotter.update_plot(gyro_states[-1], euler_rotations[-1], quaternion.from_float_array(fused[-1]))
+                    metrics.observe("visualize", time.perf_counter_ns() - start)
+                continue
+
+            # Small blocks cost less one sample at a time than building arrays for them
+            for accel, gyro, mag, dt, timestamps in block:
+                # Do Prediction with the Extended Kalman Filter, at the gyro rate (the first sample initializes it)
+                start = time.perf_counter_ns()
+                gyro_state = fusion.predict_sample(accel, gyro, mag, dt)
+                predicted = time.perf_counter_ns()
+                metrics.observe("predict", predicted - start)
+
+                # Update only when a fresh accelerometer or magnetometer reading is due
+                if fusion.update_sample(accel, mag, timestamps[1:]):
+                    metrics.observe("update", time.perf_counter_ns() - predicted)
+                    metrics.increment("updates")
+                euler_rotation = fusion.euler_rotation
+                metrics.increment("samples_fused")
+                if is_first_fused:
+                    log_first_fused(metrics, started)
+                    is_first_fused = False
+                if args.fused_log:
+                    fused_times.append(time.monotonic_ns())
+
+                # Stream the fused sample to the subscribers
+                if fanout is not None and fanout.is_active:
+                    start = time.perf_counter_ns()
+                    estimates = ([euler_to_quaternion_array(gyro_state)], [euler_to_quaternion_array(euler_rotation)]) if args.fanout_estimates else ()
+                    fanout.publish(make_records([timestamps[0]], [fusion.ekf.q_array], *estimates))
+                    metrics.observe("fanout", time.perf_counter_ns() - start)
+
+                # Print the quaternions at the specified verbosity rate
+                if counter % args.verbosity_rate == 0:
+                    log_fusion(gyro_state, euler_rotation, fusion.ekf.q_array, queue)
+                counter += 1
+
+                # Update plot with the new data if visualization is enabled
+                if args.visualize:
+                    start = time.perf_counter_ns()
+                    plotter.update_plot(gyro_state, euler_rotation, fusion.ekf.q) # Update the plot with the new data
+                    metrics.observe("visualize", time.perf_counter_ns() - start)
 
         # If Queue is empty, wait for data to be available
         except QueueEmpty:
@@ -78,6 +161,223 @@ def processing_thread(event, queue):
     # If visualization is enabled, close the plot when the thread is stopped
     if args.visualize:
         plotter.close() # Close the plot when the thread is stopped
+    if fanout is not None:
+        fanout.close()
+
+    # Save the fused times for latency measurements
+    if args.fused_log:
+        np.save(args.fused_log, np.array(fused_times, dtype=np.int64))
+
+def enqueue_frames(frames, queue, prev_timestamp, metrics):
+    """
+    Convert a batch of decoded frames to samples and hand them to the processing thread.
+
+    Args:
+        frames: Structured array of frames decoded with STRUCT_DTYPE.
+        queue: Sample_Queue object to put the samples on.
+        prev_timestamp: Gyro timestamp of the last sample before this batch.
+        metrics: Metrics object to record the unpack and enqueue stages, per batch.
+
+    Returns:
+        The gyro timestamp of the last frame in the batch.
+    """
+    start = time.perf_counter_ns()
+
+    # Compute every dt in one pass, in seconds
+    timestamps = frames["timestampGyro"].astype(np.int64)
+    dts = np.diff(timestamps, prepend=prev_timestamp) / 1000
+
+    # Columns to per-sample lists, matching the single frame path
+    accel = np.column_stack((frames["xAcc"], frames["yAcc"], frames["zAcc"])).tolist()
+    gyro = np.column_stack((frames["xGyro"], frames["yGyro"], frames["zGyro"])).tolist()
+    mag = np.column_stack((frames["xMag"], frames["yMag"], frames["zMag"])).tolist()
+    sample_timestamps = zip(timestamps.tolist(), frames["timestampAcc"].tolist(), frames["timestampMag"].tolist())
+
+    samples = [list(sample) for sample in zip(accel, gyro, mag, dts.tolist(), sample_timestamps)]
+    unpacked = time.perf_counter_ns()
+
+    queue.put_many(samples)
+    metrics.observe("unpack", unpacked - start)
+    metrics.observe("enqueue", time.perf_counter_ns() - unpacked)
+    metrics.increment("samples_received", len(samples))
+    return int(timestamps[-1])
+
+class Process_Channel:
+    """
+    A class to hand samples from the receive loop to a processing process.
+    Samples are put on a local Sample_Queue, so the queue size and policy apply in the receiving process as in
+    thread mode, and a sender thread moves every queued sample, up to max_batch, across the process boundary
+    as one message. The channel holds at most max_messages batches, so when processing falls behind the sender
+    waits, the local queue fills up and the policy drops (or blocks on) samples before they are sent.
+    Supports the Sample_Queue calls used by the receive loop.
+    """
+
+    def __init__(self, maxsize=0, policy="block", max_batch=256, max_messages=2):
+        self.queue = Sample_Queue(maxsize, policy)
+        self.channel = multiprocessing.Queue(max_messages)
+        self.max_batch = max_batch
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._send_loop, daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        """Queue a single sample, applying the policy if the queue is full."""
+        return self.queue.put(item)
+
+    def put_many(self, items):
+        """Queue several samples in order, applying the policy to each."""
+        self.queue.put_many(items)
+
+    def qsize(self):
+        """Return the number of samples waiting to be sent."""
+        return self.queue.qsize()
+
+    def stats(self):
+        """Take a snapshot of the local queue counters, see Sample_Queue.stats."""
+        return self.queue.stats()
+
+    def _send_loop(self):
+        """Send the queued samples in batches, until closed."""
+        batch = None
+        while not self.stop_event.is_set():
+            try:
+                if batch is None:
+                    batch = self.queue.get_batch(self.max_batch, timeout=0.1)
+                self.channel.put(batch, timeout=0.1) # wait for the processing process to take a batch
+                batch = None
+            except (QueueEmpty, QueueFull):
+                pass
+
+    def close(self):
+        """Stop sending and tell the processing process no more samples will come."""
+        self.stop_event.set()
+        self.thread.join()
+        self.channel.cancel_join_thread() # samples still in the pipe are not waited for once processing stops
+        try:
+            self.channel.put_nowait(None)
+        except QueueFull:
+            pass # the processing process is stopped by the event anyway
+
+def processing_process(event, channel, args):
+    """
+    Process to run the processing stage (EKF and optional visualizer) on its own core.
+    A feeder thread moves batches from the channel into a local Sample_Queue, and processing_thread runs on the main
+    thread of this process. The local queue blocks the feeder when full, so the channel backs up and the queue policy
+    applies in the receiving process (see Process_Channel).
+
+    Args:
+        event: multiprocessing Event object to signal when to stop the process.
+        channel: multiprocessing Queue of sample batches from the receive loop, None ends the stream.
+        args: Parsed consumer arguments.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # the receiving process handles the interrupt and sets the event
+    logging.basicConfig(level=args.log_level.upper())
+    queue = Sample_Queue(args.queue_size, "block")
+
+    # The processing stages are exported separately, next to the receiving process's stats
+    metrics = Metrics()
+    metrics.gauge("queue_depth", queue.qsize)
+    exporter = start_exporter(metrics, args, suffix=".processing")
+
+    def feed():
+        while True:
+            batch = channel.get()
+            if batch is None:
+                break
+            queue.put_many(batch)
+
+    threading.Thread(target=feed, daemon=True).start()
+    processing_thread(event, queue, args, metrics)
+    if exporter is not None:
+        exporter.stop()
+
+def filter_options(args):
+    """Keyword arguments for the selected filter, from the --ekf-p0, --ekf-q and --ekf-r arguments."""
+    return {"p0": args.ekf_p0, "process_noise": args.ekf_q, "measurement_noise": args.ekf_r}
+
+def warm_up(args):
+    """
+    Run both fusion paths once on synthetic samples, so the first samples from a publisher do not pay one-time costs
+    (lazy imports such as numpy-quaternion for --ekf standard, and the first call of each NumPy operation).
+    The filters are thrown away, so the fused output does not change.
+
+    Args:
+        args: Parsed consumer arguments.
+    """
+    ekf_class, ekf_options = EKF_CLASSES[args.ekf], filter_options(args)
+    accel, gyro, mag = [0.0, 0.0, 1000.0], [100.0, -50.0, 25.0], [200.0, 0.0, -400.0]
+
+    # Block path, as in processing_thread for blocks of at least --min-block samples
+    n = 4
+    timestamps = np.arange(n, dtype=np.float64)
+    fusion = Stream_Fusion(ekf_class, args.update_decimation, ekf_options)
+    gyro_states, euler_rotations, fused = fusion.process_samples([accel] * n, [gyro] * n, [mag] * n, np.full(n, 0.01), np.column_stack((timestamps, timestamps)))
+    make_records(timestamps, fused, euler_to_quaternion_batch(gyro_states), euler_to_quaternion_batch(euler_rotations))
+
+    # Per-sample path, for smaller blocks
+    fusion = Stream_Fusion(ekf_class, args.update_decimation, ekf_options)
+    gyro_state = fusion.predict_sample(accel, gyro, mag, 0.01)
+    fusion.update_sample(accel, mag, (0.0, 0.0))
+    make_records([0], [fusion.ekf.q_array], [euler_to_quaternion_array(gyro_state)], [euler_to_quaternion_array(fusion.euler_rotation)])
+
+def log_first_fused(metrics, started):
+    """
+    Log and export the time to the first fused sample.
+
+    Args:
+        metrics: Metrics object to register the first_fused_ms gauge with.
+        started: perf_counter time the processing stage started, right after the publisher connected.
+    """
+    now = time.perf_counter()
+    metrics.gauge("first_fused_ms", lambda: (now - STARTED) * 1000)
+    logging.info(f"First sample fused {(now - STARTED) * 1000:.1f} ms after startup, {(now - started) * 1000:.1f} ms after the publisher connected")
+
+def start_fanout(args, metrics):
+    """
+    Start streaming fused samples to subscribers if a fan-out path was requested.
+
+    Args:
+        args: Parsed consumer arguments.
+        metrics: Metrics object to register the subscriber gauges with.
+
+    Returns:
+        The started Fused_Server or the created Fused_Ring, None if the fan-out is disabled.
+    """
+    if not args.fanout_path:
+        return None
+    if args.fanout_transport == "shm":
+        fanout = Fused_Ring.create(shm_name(args.fanout_path), args.fanout_estimates, args.fanout_buffer)
+        metrics.gauge("fanout_published", lambda: fanout.stats()["published"])
+    else:
+        fanout = Fused_Server(args.fanout_path, args.fanout_estimates, args.fanout_buffer).start()
+        metrics.gauge("fanout_subscribers", lambda: fanout.stats()["subscribers"])
+        metrics.gauge("fanout_dropped", lambda: fanout.stats()["dropped"])
+    logging.info(f"Streaming fused samples to subscribers on {args.fanout_path} ({args.fanout_transport})")
+    return fanout
+
+def start_exporter(metrics, args, suffix=""):
+    """
+    Start exporting metrics snapshots if a stats file or stats socket was requested.
+
+    Args:
+        metrics: Metrics object to export.
+        args: Parsed consumer arguments.
+        suffix: Appended to the stats paths, so several processes can export side by side.
+
+    Returns:
+        The started Stats_Exporter, None if stats are disabled.
+    """
+    if not args.stats_file and not args.stats_socket:
+        return None
+    exporter = Stats_Exporter(
+        metrics,
+        interval=args.stats_interval,
+        prometheus_path=args.stats_file and args.stats_file + suffix,
+        socket_path=args.stats_socket and args.stats_socket + suffix,
+    )
+    exporter.start()
+    logging.info(f"Stats exporter started, every {args.stats_interval} seconds")
+    return exporter
 
 
 
@@ -91,7 +391,34 @@ if __name__ == "__main__":
     parser.add_argument("--max-timeouts", dest="max_timeouts", type=int, default=10, help="number of timeouts before exiting")
     parser.add_argument("--visualize", dest="visualize", action="store_true", help="enable visualization of the data")
     parser.add_argument("--no-visualize", dest="visualize", action="store_false", help="disable visualization of the data")
+    parser.add_argument("--fps", dest="fps", type=float, default=30, help="maximum frame rate of the visualizer, independent of the sample rate")
     parser.add_argument("--verbosity-rate", dest="verbosity_rate", type=int, default=500, help="rate of verbosity for the logger")
+    parser.add_argument("--recv-mode", dest="recv_mode", type=str, default="single", choices=["single", "batch"], help="receive one frame per call, or many frames per call with recv_into")
+    parser.add_argument("--recv-batch", dest="recv_batch", type=int, default=256, help="maximum number of frames read per call in batch receive mode")
+    parser.add_argument("--ekf", dest="ekf", type=str, default="fast", choices=list(EKF_CLASSES), help="Extended Kalman Filter implementation to use")
+    parser.add_argument("--ekf-p0", dest="ekf_p0", type=float, default=0.1, help="initial state covariance of the EKF, times identity, tune with tune_ekf.py")
+    parser.add_argument("--ekf-q", dest="ekf_q", type=float, default=0.01, help="process noise covariance of the EKF, times identity")
+    parser.add_argument("--ekf-r", dest="ekf_r", type=float, default=0.1, help="measurement noise covariance of the EKF, times identity")
+    parser.add_argument("--fanout-path", dest="fanout_path", type=str, default=None, help="stream every fused sample to local subscribers on this socket path (or shared memory named after it), disabled by default")
+    parser.add_argument("--fanout-transport", dest="fanout_transport", type=str, default="socket", choices=["socket", "shm"], help="serve subscribers over a Unix socket, or a shared memory ring they read from")
+    parser.add_argument("--fanout-estimates", dest="fanout_estimates", action="store_true", help="include the gyro and accel/mag orientations in each fused record")
+    parser.add_argument("--fanout-buffer", dest="fanout_buffer", type=int, default=65536, help="fused records each subscriber may fall behind before losing the oldest")
+    parser.add_argument("--update-decimation", dest="update_decimation", type=int, default=1, help="apply a measurement update on every Nth fresh accelerometer or magnetometer reading, predict still runs for every sample")
+    parser.add_argument("--max-block", dest="max_block", type=int, default=256, help="maximum number of queued samples fused together as one vectorized block, 1 fuses one sample at a time")
+    parser.add_argument("--min-block", dest="min_block", type=int, default=16, help="smallest drained block fused as a vectorized block, smaller ones are fused one sample at a time")
+    parser.add_argument("--queue-size", dest="queue_size", type=int, default=0, help="maximum number of samples waiting for the processing thread, 0 is unbounded")
+    parser.add_argument("--queue-policy", dest="queue_policy", type=str, default="block", choices=QUEUE_POLICIES, help="what to do when the queue is full")
+    parser.add_argument("--transport", dest="transport", type=str, default="socket", choices=["socket", "shm"], help="receive over the Unix socket, or from a shared memory ring named after the socket path")
+    parser.add_argument("--shm-slots", dest="shm_slots", type=int, default=4096, help="number of frame slots in the shared memory ring")
+    parser.add_argument("--processing", dest="processing", type=str, default="thread", choices=["thread", "process"], help="run the EKF and visualizer in a thread, or in a separate process so receiving keeps its own core")
+    parser.add_argument("--fused-log", dest="fused_log", type=str, default=None, help="save the monotonic time [ns] each sample is fused to this .npy file, used by benchmark.py")
+    parser.add_argument("--wire-format", dest="wire_format", type=str, default="auto", choices=["auto", "v1"], help="accept the compact v2 wire format when a publisher offers it, or always ask for v1 frames")
+    parser.add_argument("--record-dir", dest="record_dir", type=str, default=None, help="append every received frame to a rotating log in this directory, replay it with replay.py")
+    parser.add_argument("--record-segment-mb", dest="record_segment_mb", type=int, default=64, help="size of each log segment in MB")
+    parser.add_argument("--record-keep", dest="record_keep", type=int, default=0, help="number of newest log segments to keep, 0 keeps all")
+    parser.add_argument("--stats-file", dest="stats_file", type=str, default=None, help="periodically write stage latency histograms and counters to this Prometheus text file")
+    parser.add_argument("--stats-socket", dest="stats_socket", type=str, default=None, help="serve the latest stats snapshot as JSON on this Unix socket, read it with instrumentation.py")
+    parser.add_argument("--stats-interval", dest="stats_interval", type=float, default=1.0, help="seconds between stats snapshots")
     parser.set_defaults(visualize=True)
 
     args = parser.parse_args()
@@ -100,49 +427,172 @@ if __name__ == "__main__":
     logging.basicConfig(level=args.log_level.upper())
     logging.info("Logger successfully initialized")
 
-    # Create the Unix Compatible Socket
-    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-
-    # Check socket path and link to socket
-    if os.path.exists(args.socket_path):
-        os.remove(args.socket_path)
-        logging.info("Socket Path already existed. It has been removed")
-    
-    sock.bind(args.socket_path)
-    sock.listen(1) # listen for 1 incoming connection
-    logging.info("Socket path successfully created and binded")
-
-    # Create thread to handle printing of data
-    event = threading.Event()
-    queue = Queue()
+    if args.transport == "shm":
+        # Create the shared memory ring, the publisher attaches to it by the same name
+        ring = Shm_Ring.create(shm_name(args.socket_path), args.shm_slots)
+        logging.info(f"Shared memory ring {shm_name(args.socket_path)} successfully created")
+    else:
+        # Create the Unix Compatible Socket
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        # Check socket path and link to socket
+        if os.path.exists(args.socket_path):
+            os.remove(args.socket_path)
+            logging.info("Socket Path already existed. It has been removed")
+        
+        sock.bind(args.socket_path)
+        sock.listen(1) # listen for 1 incoming connection
+        logging.info("Socket path successfully created and binded")
+
+    # Create thread (or process) to handle printing of data
+    if args.processing == "process":
+        event = multiprocessing.Event()
+        queue = Process_Channel(args.queue_size, args.queue_policy, max_batch=args.max_block)
+    else:
+        event = threading.Event()
+        queue = Sample_Queue(args.queue_size, args.queue_policy)
+
+    # Record the received frames from a writer thread, so the receive loop never waits on the disk
+    recorder = None
+    if args.record_dir:
+        recorder = Stream_Recorder(args.record_dir, segment_bytes=args.record_segment_mb << 20, keep_segments=args.record_keep)
+        logging.info(f"Recording received frames to {args.record_dir}")
+
+    # Instrument the receive loop, and the processing thread when it shares this process
+    metrics = Metrics()
+    metrics.gauge("queue_depth", queue.qsize) # samples waiting to be sent in process mode
+    if recorder is not None:
+        metrics.gauge("recorder_dropped", lambda: recorder.dropped)
+    exporter = start_exporter(metrics, args)
+
+    # Pay the one-time costs of the fusion path before a publisher connects
+    warmed = time.perf_counter()
+    warm_up(args)
+    ready = time.perf_counter()
+    metrics.gauge("import_ms", lambda: (IMPORTED - STARTED) * 1000)
+    metrics.gauge("ready_ms", lambda: (ready - STARTED) * 1000)
+    logging.info(f"Ready {(ready - STARTED) * 1000:.1f} ms after startup (imports {(IMPORTED - STARTED) * 1000:.1f} ms, warm-up {(ready - warmed) * 1000:.1f} ms)")
 
     try:
         logging.info("Waiting for incoming connection...")
-        conn, _ = sock.accept() # accept incoming connection
-        logging.info("Socket connection successfully accepted")
-
-        # Set the socket and connection timeouts
-        sock.settimeout(60)
-        conn.settimeout(float(args.timeout_ms / 1000))
-
-        # Start the processing thread
-        process_thread = threading.Thread(target=processing_thread, args=(event,queue,))
-        process_thread.start()
-        logging.info("Processing thread started")
+        if args.transport == "shm":
+            ring.wait_for_writer() # wait for the publisher to attach
+            logging.info("Shared memory writer successfully attached")
+        else:
+            conn, _ = sock.accept() # accept incoming connection
+            logging.info("Socket connection successfully accepted")
+
+            # Set the socket and connection timeouts
+            sock.settimeout(60)
+            conn.settimeout(float(args.timeout_ms / 1000))
+
+        # Start the processing thread, or process which gets the samples through the channel
+        if args.processing == "process":
+            process_thread = multiprocessing.Process(target=processing_process, args=(event, queue.channel, args))
+            process_thread.start()
+            logging.info("Processing process started")
+        else:
+            process_thread = threading.Thread(target=processing_thread, args=(event, queue, args, metrics))
+            process_thread.start()
+            logging.info("Processing thread started")
 
         # Initialize variables for last state and current state
         timeouts = 0
         prev_timestamp = 0
         euler_state = [0, 0, 0]
         is_first_data = True
+        reader = Frame_Reader(max_frames=args.recv_batch)
+        partial = b"" # start of a frame split across reads in single receive mode
+        reader_v2 = None
+        is_negotiated = args.transport == "shm" # the shared memory ring always holds v1 frames
         
         while timeouts < args.max_timeouts:
             try:
-                data, _ = conn.recvfrom(STRUCT_SIZE) # receive data from the socket
+                if args.transport == "shm":
+                    # Frames written before a disconnect are visible by the time the disconnect is, so check it first
+                    writer_state = ring.writer_state
+                    start = time.perf_counter_ns()
+                    frames = ring.read(args.recv_batch, timeout=float(args.timeout_ms / 1000)) # zero-copy view of the frames
+                    metrics.observe("recv", time.perf_counter_ns() - start)
+
+                    # If frames are available, hand them all to the processing thread, then free their slots
+                    if len(frames) > 0:
+                        if is_first_data:
+                            prev_timestamp = int(frames["timestampGyro"][0])
+                            is_first_data = False
+                        prev_timestamp = enqueue_frames(frames, queue, prev_timestamp, metrics)
+                        if recorder is not None:
+                            recorder.write(frames.copy()) # copy out before the slots are handed back
+                        ring.release(len(frames))
+                        continue
+
+                    # The ring is drained and the publisher has detached, so wait for it to attach again
+                    if writer_state == WRITER_DISCONNECTED:
+                        logging.info("Publisher disconnected, attempting reconnect")
+                        if not ring.wait_for_writer(timeout=60):
+                            logging.critical("Publisher disconnected for over a minute, unable to reconnect")
+                            break
+                        metrics.increment("reconnects")
+                        continue
+
+                    # Otherwise count it as a timeout, as with the socket
+                    timeouts += 1
+                    metrics.increment("socket_timeouts")
+                    logging.warning(f"Shared memory ring timed out, total timeouts: {timeouts}")
+                    time.sleep(1)
+                    continue
+
+                # Agree on the wire format at the start of each connection
+                if not is_negotiated:
+                    reader_v2 = negotiate_wire_format(conn, args.wire_format == "auto", max_bytes=args.recv_batch * STRUCT_SIZE)
+                    is_negotiated = True
+
+                # v2 frames are variable-size, so they are always received in batches
+                if args.recv_mode == "batch" or reader_v2 is not None:
+                    start = time.perf_counter_ns()
+                    frames = (reader_v2 or reader).recv(conn) # receive every complete frame available
+                    metrics.observe("recv", time.perf_counter_ns() - start)
+
+                    # If frames are received, hand them all to the processing thread
+                    if frames is not None:
+                        if len(frames) > 0:
+                            if is_first_data:
+                                prev_timestamp = int(frames["timestampGyro"][0])
+                                is_first_data = False
+                            prev_timestamp = enqueue_frames(frames, queue, prev_timestamp, metrics)
+                            if recorder is not None:
+                                recorder.write(frames) # v2 frames are recorded as the decoded STRUCT_DTYPE records that were fused
+                        continue
+
+                    # No data means the publisher has disconnected, so only need to accept a new connection
+                    try:
+                        logging.info("Publisher disconnected, attempting reconnect")
+                        conn, _ = sock.accept() # accept incoming connection
+                        conn.settimeout(float(args.timeout_ms / 1000))
+                        reader.reset() # drop any partial frame from the old connection
+                        is_negotiated = False
+                        metrics.increment("reconnects")
+                    except socket.timeout:
+                        logging.critical("Publisher disconnected for over a minute, unable to reconnect")
+                        break
+                    continue
+
+                start = time.perf_counter_ns()
+                data, _ = conn.recvfrom(STRUCT_SIZE - len(partial)) # receive data from the socket
+                if data:
+                    # Burst sends can split a frame across reads, so keep the start until the rest arrives
+                    data, partial = partial + data, b""
+                    if len(data) < STRUCT_SIZE:
+                        partial = data
+                        continue
+                received = time.perf_counter_ns()
+                metrics.observe("recv", received - start)
 
                 # If data is received, unpack it and process it
                 if data:
                     result = IMU.unpack(data) # unpack the data and print it
+                    if recorder is not None:
+                        recorder.write(data)
 
                     if is_first_data:
                         prev_timestamp = result.timestampGyro
@@ -155,9 +605,14 @@ if __name__ == "__main__":
                     mag = [result.xMag, result.yMag, result.zMag]
                     dt = float(result.timestampGyro - prev_timestamp) / 1000 # convert to seconds
                     prev_timestamp = result.timestampGyro
+                    timestamps = (result.timestampGyro, result.timestampAcc, result.timestampMag) # tell fresh accel/mag readings apart
+                    unpacked = time.perf_counter_ns()
                     
                     # Perform Processing in a thread to preserve real-time data capture
-                    queue.put([accel, gyro, mag, dt])
+                    queue.put([accel, gyro, mag, dt, timestamps])
+                    metrics.observe("unpack", unpacked - received)
+                    metrics.observe("enqueue", time.perf_counter_ns() - unpacked)
+                    metrics.increment("samples_received")
 
                 else:
                     # No data means the publisher has disconnected, so only need to accept a new connection
@@ -165,6 +620,9 @@ if __name__ == "__main__":
                         logging.info("Publisher disconnected, attempting reconnect")
                         conn, _ = sock.accept() # accept incoming connection
                         conn.settimeout(float(args.timeout_ms / 1000))
+                        partial = b"" # drop any partial frame from the old connection
+                        is_negotiated = False
+                        metrics.increment("reconnects")
                     except socket.timeout:
                         logging.critical("Publisher disconnected for over a minute, unable to reconnect")
                         break
@@ -172,9 +630,28 @@ if __name__ == "__main__":
             except socket.timeout:
                 # Publisher may still be connected, so kill the connection and try again
                 timeouts += 1
+                metrics.increment("socket_timeouts")
                 logging.warning(f"Socket timed out, total timeouts: {timeouts}")
                 time.sleep(1)
 
+            except ValueError as e:
+                # An invalid frame header means the stream is misaligned, so drop the publisher and wait for a new one
+                if args.transport == "shm":
+                    logging.critical(f"Invalid data in the shared memory ring, exiting: {e}") # the ring has no connection to drop
+                    break
+                logging.error(f"Invalid data from the publisher, closing the connection: {e}")
+                conn.close()
+                try:
+                    conn, _ = sock.accept() # accept incoming connection
+                    conn.settimeout(float(args.timeout_ms / 1000))
+                    reader.reset() # drop any partial frame from the old connection
+                    partial = b""
+                    is_negotiated = False
+                    metrics.increment("reconnects")
+                except socket.timeout:
+                    logging.critical("Publisher disconnected for over a minute, unable to reconnect")
+                    break
+
     # Force exit with keyboard interrupt
     except KeyboardInterrupt:
         print()
@@ -188,17 +665,34 @@ if __name__ == "__main__":
     # Close everything and log it
     
     event.set() # set the event to stop the printing thread
+    if args.processing == "process":
+        queue.close() # stop the feeder in the processing process
     process_thread.join() # wait for the printing thread to finish
     logging.info("Process thread successfully stopped")
-
-    conn.close() # close the connection
-    logging.info("Socket connection successfully closed")
-
-    sock.close() # close the socket
-    logging.info("Socket successfully closed")
-
-    os.remove(args.socket_path) # remove the socket path
-    logging.info("Socket path successfully removed")
+    if args.processing == "process":
+        stats = queue.stats() # drops happen in this process, the processing process only logs its own queue
+        logging.info(f"Channel:       Max Depth:{stats['max_depth']} Dropped:{stats['dropped']} Coalesced:{stats['coalesced']}")
+
+    if recorder is not None:
+        recorder.close() # write the queued frames and close the last segment
+        logging.info(f"Recorder successfully closed, {recorder.dropped} frames dropped")
+
+    if exporter is not None:
+        exporter.stop() # write the final snapshot
+        logging.info("Stats exporter successfully stopped")
+
+    if args.transport == "shm":
+        ring.close() # close and remove the shared memory ring
+        logging.info("Shared memory ring successfully closed")
+    else:
+        conn.close() # close the connection
+        logging.info("Socket connection successfully closed")
+
+        sock.close() # close the socket
+        logging.info("Socket successfully closed")
+
+        os.remove(args.socket_path) # remove the socket path
+        logging.info("Socket path successfully removed")
         
 
     
\ No newline at end of file
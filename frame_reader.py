@@ -0,0 +1,130 @@
+import logging
+import socket
+import time
+import numpy as np
+from payload_imu_class import STRUCT_SIZE, STRUCT_DTYPE
+from payload_imu_v2 import Payload_IMU_V2, HELLO_MAGIC, HELLO_SIZE, WIRE_VERSION, recv_exact, pack_accept
+
+class Frame_Reader:
+    """
+    A class to receive fixed-size IMU frames from a stream socket in batches.
+    Data is read with recv_into into a preallocated buffer, and any partial frame
+    at the end of a read is carried over to the next read so frames never split.
+    """
+
+    def __init__(self, max_frames=256, frame_size=STRUCT_SIZE, dtype=STRUCT_DTYPE):
+        self.frame_size = frame_size
+        self.dtype = dtype
+
+        self.buffer = bytearray(frame_size * max_frames)    # Preallocated receive buffer
+        self.view = memoryview(self.buffer)                 # View to read into without copying
+        self.pending = 0                                    # Bytes of an incomplete frame at the start of the buffer
+
+    def reset(self):
+        """Discard any partial frame, used when a new connection is accepted."""
+        self.pending = 0
+
+    def recv(self, conn):
+        """
+        Receive as many complete frames as are available in one call.
+
+        Args:
+            conn: Connected stream socket to read from.
+
+        Returns:
+            numpy.ndarray: Structured array of decoded frames (may be empty if only a partial frame arrived),
+            or None if the peer has disconnected.
+        """
+        n_bytes = conn.recv_into(self.view[self.pending:])
+        if n_bytes == 0:
+            return None
+
+        # Decode every complete frame, copying out so the buffer can be reused
+        total = self.pending + n_bytes
+        n_frames = total // self.frame_size
+        used = n_frames * self.frame_size
+        frames = np.frombuffer(self.buffer, dtype=self.dtype, count=n_frames).copy()
+
+        # Carry the partial frame over to the start of the buffer
+        self.pending = total - used
+        if self.pending:
+            self.view[:self.pending] = self.view[used:total]
+        return frames
+
+class Frame_Reader_V2:
+    """
+    A class to receive variable-size v2 frames (see payload_imu_v2.py) from a stream socket in batches.
+    Works like Frame_Reader, carrying any partial frame over to the next read, and returns the same
+    STRUCT_DTYPE records so the rest of the consumer does not depend on the wire format.
+    """
+
+    def __init__(self, codec, max_bytes=65536):
+        self.codec = codec
+
+        self.buffer = bytearray(max(max_bytes, codec.max_frame_size))  # Preallocated receive buffer, holds at least one frame
+        self.view = memoryview(self.buffer)                             # View to read into without copying
+        self.pending = 0                                                # Bytes of an incomplete frame at the start of the buffer
+
+    def reset(self):
+        """Discard any partial frame, used when a new connection is accepted."""
+        self.pending = 0
+
+    def recv(self, conn):
+        """
+        Receive as many complete frames as are available in one call.
+
+        Args:
+            conn: Connected stream socket to read from.
+
+        Returns:
+            numpy.ndarray: Structured array of decoded records (may be empty if only a partial frame arrived),
+            or None if the peer has disconnected.
+        """
+        n_bytes = conn.recv_into(self.view[self.pending:])
+        if n_bytes == 0:
+            return None
+
+        # Decode every complete frame, the records do not reference the buffer
+        total = self.pending + n_bytes
+        records, used = self.codec.decode(self.buffer, total)
+
+        # Carry the partial frame over to the start of the buffer
+        self.pending = total - used
+        if self.pending:
+            self.view[:self.pending] = self.view[used:total]
+        return records
+
+def negotiate_wire_format(conn, is_v2_accepted=True, max_bytes=65536):
+    """
+    Check whether a new publisher opens with a v2 hello, and answer it.
+    A v1 publisher sends frames straight away, and a v1 frame never starts with the hello magic.
+
+    Args:
+        conn: Newly accepted connection, blocking or with a timeout.
+        is_v2_accepted (bool): Accept the v2 wire format if offered, otherwise ask the publisher for v1 frames.
+        max_bytes (int): Receive buffer size of the returned Frame_Reader_V2.
+
+    Returns:
+        Frame_Reader_V2 for the connection if v2 was negotiated, None to read STRUCT_FORMAT frames.
+    """
+    # Peek until the first bytes can be told apart, without consuming a v1 frame
+    head = conn.recv(len(HELLO_MAGIC), socket.MSG_PEEK)
+    while head and len(head) < len(HELLO_MAGIC) and HELLO_MAGIC.startswith(head):
+        time.sleep(0.001)
+        head = conn.recv(len(HELLO_MAGIC), socket.MSG_PEEK)
+    if head != HELLO_MAGIC:
+        return None # v1 frames, or a disconnect which the receive loop handles
+
+    try:
+        codec = Payload_IMU_V2.from_hello(recv_exact(conn, HELLO_SIZE))
+    except (ConnectionError, ValueError) as e:
+        logging.error(f"Wire format handshake failed: {e}")
+        return None
+
+    # Answer with the version the frames will be read as, the publisher falls back to v1 if declined
+    conn.sendall(pack_accept(WIRE_VERSION if is_v2_accepted else 1))
+    if not is_v2_accepted:
+        logging.info("Publisher offered the v2 wire format, declined")
+        return None
+    logging.info(f"Wire format v2 negotiated, {codec.samples_per_frame} samples per frame")
+    return Frame_Reader_V2(codec, max_bytes=max_bytes)
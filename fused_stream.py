@@ -0,0 +1,494 @@
+import argparse
+import logging
+import os
+import select
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from multiprocessing import shared_memory
+import numpy as np
+from shm_ring import shm_name, _attach, check_store_order
+
+# Fused records, one per sample: the sample's gyro timestamp and quaternions as (w, x, y, z)
+FUSED_DTYPE = np.dtype([("timestamp", "<u8"), ("fused", "<f4", (4,))])
+# With estimates, the integrated gyroscope and the accelerometer and magnetometer orientations are included
+FUSED_ESTIMATES_DTYPE = np.dtype([("timestamp", "<u8"), ("fused", "<f4", (4,)), ("gyro", "<f4", (4,)), ("accel_mag", "<f4", (4,))])
+
+# Sent by the server to each new subscriber, declaring the record format
+FUSED_MAGIC = b"IMUFUSED"
+FUSED_HELLO = struct.Struct("<8sHH")    # magic, version, flags
+FUSED_VERSION = 1
+HAS_ESTIMATES = 0x1
+
+# Shared memory ring header, one uint64 per field, followed by the record slots
+SEQUENCE, RESERVED, CAPACITY, FLAGS, CLOSED = range(5)
+RING_HEADER_SIZE = 64
+
+def fused_dtype(flags):
+    """Record dtype for the flags of a stream."""
+    return FUSED_ESTIMATES_DTYPE if flags & HAS_ESTIMATES else FUSED_DTYPE
+
+def make_records(timestamps, fused, gyro=None, accel_mag=None):
+    """
+    Pack fused samples into records.
+
+    Args:
+        timestamps: Gyro timestamps [ms], shape (N,).
+        fused: Fused quaternions (w, x, y, z), shape (N, 4).
+        gyro: Integrated gyroscope quaternions, shape (N, 4), None leaves the estimates out.
+        accel_mag: Accelerometer and magnetometer quaternions, shape (N, 4).
+
+    Returns:
+        numpy.ndarray: Structured array of FUSED_DTYPE, or FUSED_ESTIMATES_DTYPE records if gyro is given.
+    """
+    records = np.empty(len(timestamps), dtype=FUSED_DTYPE if gyro is None else FUSED_ESTIMATES_DTYPE)
+    records["timestamp"] = timestamps
+    records["fused"] = fused
+    if gyro is not None:
+        records["gyro"] = gyro
+        records["accel_mag"] = accel_mag
+    return records
+
+class _Subscriber:
+    """A connected subscriber and its bounded buffer of chunks waiting to be sent."""
+
+    def __init__(self, conn, max_bytes):
+        self.conn = conn
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.chunks = deque()
+        self.offset = 0         # Bytes of the first chunk already sent
+        self.pending = 0        # Bytes queued, including the sent part of the first chunk
+        self.dropped = 0        # Records dropped because the subscriber fell behind
+
+    def push(self, data, record_size):
+        """
+        Queue a chunk, dropping the oldest unsent chunks if the buffer would overflow.
+
+        Returns:
+            bool: True if the buffer was empty, so the sender needs waking.
+        """
+        with self.lock:
+            was_empty = not self.chunks
+            first = 1 if self.offset else 0 # a partly sent chunk has to finish to keep records aligned
+            while self.pending + len(data) > self.max_bytes and len(self.chunks) > first:
+                dropped = self.chunks[first]
+                del self.chunks[first]
+                self.pending -= len(dropped)
+                self.dropped += len(dropped) // record_size
+            if self.pending + len(data) > self.max_bytes:
+                self.dropped += len(data) // record_size
+                return False
+            self.chunks.append(data)
+            self.pending += len(data)
+            return was_empty
+
+    def send(self):
+        """Send as much as the socket takes without blocking."""
+        with self.lock:
+            while self.chunks:
+                chunk = self.chunks[0]
+                sent = self.conn.send(memoryview(chunk)[self.offset:])
+                self.offset += sent
+                if self.offset < len(chunk):
+                    return
+                self.chunks.popleft()
+                self.pending -= len(chunk)
+                self.offset = 0
+
+class Fused_Server:
+    """
+    A class to fan the fused samples out to any number of local subscribers over a Unix socket.
+    publish() only copies the records into each subscriber's bounded buffer, and one sender thread
+    writes the buffers to the sockets as they drain, so a slow subscriber never stalls fusion.
+    - A subscriber more than buffer_records behind loses its oldest records, counted in its dropped total
+    - Each subscriber first receives a hello declaring the record format
+    """
+
+    def __init__(self, socket_path, include_estimates=False, buffer_records=65536):
+        self.socket_path = socket_path
+        self.flags = HAS_ESTIMATES if include_estimates else 0
+        self.dtype = fused_dtype(self.flags)
+        self.max_bytes = buffer_records * self.dtype.itemsize
+        self.subscribers = []
+        self.dropped = 0                # Records dropped by subscribers that have disconnected
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(socket_path)
+        self.server.listen(16)
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_writer.setblocking(False)
+
+    def start(self):
+        """Start accepting subscribers and sending."""
+        self.thread = threading.Thread(target=self._send_loop, daemon=True)
+        self.thread.start()
+        return self
+
+    @property
+    def is_active(self):
+        """Whether anyone is subscribed, so records are only built when they will be sent."""
+        return bool(self.subscribers)
+
+    def publish(self, records):
+        """
+        Queue records for every subscriber, without blocking.
+
+        Args:
+            records (numpy.ndarray): Structured array of the server's record dtype.
+        """
+        subscribers = self.subscribers
+        if not subscribers:
+            return
+        data = records.tobytes()
+        if any([subscriber.push(data, self.dtype.itemsize) for subscriber in subscribers]):
+            try:
+                self.wake_writer.send(b"\x00")
+            except BlockingIOError:
+                pass # a wake-up is already pending
+
+    def stats(self):
+        """
+        Report on the subscribers.
+
+        Returns:
+            dict: Number of subscribers and records dropped over all subscribers.
+        """
+        subscribers = self.subscribers
+        return {"subscribers": len(subscribers), "dropped": self.dropped + sum(subscriber.dropped for subscriber in subscribers)}
+
+    def _send_loop(self):
+        """Accept subscribers, drop disconnected ones and send their buffers as the sockets drain."""
+        while not self.stop_event.is_set():
+            subscribers = self.subscribers
+            writable = [subscriber.conn for subscriber in subscribers if subscriber.chunks]
+            readable, writable, _ = select.select([self.server, self.wake_reader] + [subscriber.conn for subscriber in subscribers], writable, [], 1.0)
+
+            if self.wake_reader in readable:
+                self.wake_reader.recv(4096)
+            if self.server in readable:
+                self._accept()
+
+            for subscriber in subscribers:
+                try:
+                    # Subscribers never send, so a readable subscriber has disconnected
+                    if subscriber.conn in readable and not subscriber.conn.recv(4096):
+                        raise ConnectionResetError("Subscriber disconnected")
+                    if subscriber.conn in writable:
+                        subscriber.send()
+                except BlockingIOError:
+                    pass
+                except OSError:
+                    self._remove(subscriber)
+
+    def _accept(self):
+        """Accept a subscriber and send it the hello."""
+        conn, _ = self.server.accept()
+        conn.sendall(FUSED_HELLO.pack(FUSED_MAGIC, FUSED_VERSION, self.flags))
+        conn.setblocking(False)
+        self.subscribers = self.subscribers + [_Subscriber(conn, self.max_bytes)] # replaced, not mutated, for publish()
+        logging.info(f"Fused stream subscriber connected, {len(self.subscribers)} subscribed")
+
+    def _remove(self, subscriber):
+        """Drop a disconnected subscriber."""
+        self.subscribers = [other for other in self.subscribers if other is not subscriber]
+        self.dropped += subscriber.dropped
+        subscriber.conn.close()
+        logging.info(f"Fused stream subscriber disconnected after {subscriber.dropped} dropped records, {len(self.subscribers)} subscribed")
+
+    def close(self):
+        """Stop sending and disconnect every subscriber."""
+        self.stop_event.set()
+        try:
+            self.wake_writer.send(b"\x00")
+        except BlockingIOError:
+            pass
+        if self.thread is not None:
+            self.thread.join()
+        for subscriber in self.subscribers:
+            subscriber.conn.close()
+        self.subscribers = []
+        self.server.close()
+        self.wake_reader.close()
+        self.wake_writer.close()
+        os.remove(self.socket_path)
+
+class Fused_Ring:
+    """
+    A single-writer, many-reader broadcast ring of fused records in shared memory.
+    The writer never waits: it overwrites the oldest records, and each reader keeps its own position,
+    so every reader has its own window of capacity records and a slow reader only loses its own oldest records.
+    - The writer reserves the slots it is about to write before copying, then publishes the new sequence,
+      so a reader can tell which of the records it copied may have been overwritten meanwhile.
+    - The consumer creates the ring and subscribers attach to it by name.
+    """
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((RING_HEADER_SIZE // 8,), dtype=np.uint64, buffer=shm.buf)
+        self.capacity = int(self.header[CAPACITY])
+        self.flags = int(self.header[FLAGS])
+        self.dtype = fused_dtype(self.flags)
+        self.slots = np.ndarray((self.capacity,), dtype=self.dtype, buffer=shm.buf, offset=RING_HEADER_SIZE)
+        self.position = int(self.header[SEQUENCE])  # Next record to read, readers start at the newest record
+        self.dropped = 0
+
+    @classmethod
+    def create(cls, name, include_estimates=False, capacity=65536):
+        """
+        Create a ring, replacing any ring left behind under the same name.
+
+        Args:
+            name (str): Shared memory name.
+            include_estimates (bool): Whether records include the gyro and accel/mag estimates.
+            capacity (int): Number of record slots, the window each reader has to keep up within.
+
+        Returns:
+            Fused_Ring: The ring, owned by the caller.
+
+        Raises:
+            RuntimeError: If the CPU can reorder stores, see check_store_order() in shm_ring.py.
+        """
+        check_store_order()
+        try:
+            stale = _attach(name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        flags = HAS_ESTIMATES if include_estimates else 0
+        shm = shared_memory.SharedMemory(name=name, create=True, size=RING_HEADER_SIZE + capacity * fused_dtype(flags).itemsize)
+        header = np.ndarray((RING_HEADER_SIZE // 8,), dtype=np.uint64, buffer=shm.buf)
+        header[:] = 0
+        header[CAPACITY] = capacity
+        header[FLAGS] = flags
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Attach to a ring created by the consumer, as a reader.
+
+        Raises:
+            FileNotFoundError: If no ring exists under the name.
+            ConnectionRefusedError: If the ring is closed.
+        """
+        ring = cls(_attach(name), owner=False)
+        if ring.header[CLOSED]:
+            ring.close()
+            raise ConnectionRefusedError(f"Fused ring {name} is closed")
+        return ring
+
+    @property
+    def is_active(self):
+        """Readers are not tracked, so records are always written."""
+        return True
+
+    def stats(self):
+        """
+        Report on the ring.
+
+        Returns:
+            dict: Records published, readers track their own drops.
+        """
+        return {"published": int(self.header[SEQUENCE])}
+
+    def publish(self, records):
+        """
+        Write records, overwriting the oldest ones.
+
+        Args:
+            records (numpy.ndarray): Structured array of the ring's record dtype.
+        """
+        sequence = int(self.header[SEQUENCE])
+        total = len(records)
+        records = records[-self.capacity:] # only the newest capacity records can be kept
+        start = sequence + total - len(records)
+        self.header[RESERVED] = sequence + total
+
+        # Copy up to the end of the slots and wrap around, then publish the new sequence
+        slot = start % self.capacity
+        count = min(len(records), self.capacity - slot)
+        self.slots[slot:slot + count] = records[:count]
+        self.slots[:len(records) - count] = records[count:]
+        self.header[SEQUENCE] = sequence + total
+
+    @property
+    def is_closed(self):
+        return bool(self.header[CLOSED])
+
+    def read(self, max_records=None):
+        """
+        Copy the records published since the last read, skipping any this reader fell too far behind to keep.
+
+        Args:
+            max_records (int): Maximum number of records to return, None returns all available.
+
+        Returns:
+            numpy.ndarray: Structured array of records, empty if none are available.
+        """
+        sequence = int(self.header[SEQUENCE])
+        if sequence - self.position > self.capacity:
+            self.dropped += sequence - self.position - self.capacity
+            self.position = sequence - self.capacity
+        end = sequence if max_records is None else min(sequence, self.position + max_records)
+        if end <= self.position:
+            return self.slots[:0].copy()
+
+        slot = self.position % self.capacity
+        count = min(end - self.position, self.capacity - slot)
+        records = np.concatenate((self.slots[slot:slot + count], self.slots[:end - self.position - count]))
+
+        # Records in slots the writer has reserved since may have been overwritten during the copy
+        overwritten = min(max(int(self.header[RESERVED]) - self.capacity - self.position, 0), len(records))
+        self.dropped += overwritten
+        self.position = end
+        return records[overwritten:]
+
+    def close(self):
+        """Close the ring, the owner also marks it closed for the readers and removes it."""
+        if self.owner:
+            self.header[CLOSED] = 1
+        self.header = self.slots = None # release the views before closing the memory
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+class Fused_Subscriber:
+    """
+    A class to receive the fused stream of a consumer, over its Unix socket or its shared memory ring.
+    """
+
+    def __init__(self, path, transport="socket"):
+        self.transport = transport
+        self.ring = None
+        self.sock = None
+        if transport == "shm":
+            self.ring = Fused_Ring.attach(shm_name(path))
+            self.dtype = self.ring.dtype
+            return
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        hello = b""
+        while len(hello) < FUSED_HELLO.size:
+            chunk = self.sock.recv(FUSED_HELLO.size - len(hello))
+            if not chunk:
+                raise ConnectionError("Fused stream closed during the hello")
+            hello += chunk
+        magic, version, flags = FUSED_HELLO.unpack(hello)
+        if magic != FUSED_MAGIC or version != FUSED_VERSION:
+            raise ConnectionRefusedError(f"Unsupported fused stream: version {version}")
+        self.dtype = fused_dtype(flags)
+        self.buffer = bytearray()
+
+    @property
+    def dropped(self):
+        """Records this subscriber lost to falling behind, only known to the reader with shared memory."""
+        return self.ring.dropped if self.ring is not None else None
+
+    def read(self, timeout=1.0, poll_interval=0.001):
+        """
+        Wait for records.
+
+        Args:
+            timeout (float): Maximum time in seconds to wait.
+            poll_interval (float): Sleep between checks of the shared memory ring.
+
+        Returns:
+            numpy.ndarray: Structured array of records, empty if none arrived within the timeout.
+
+        Raises:
+            ConnectionError: If the consumer closed the stream.
+        """
+        if self.ring is not None:
+            deadline = time.monotonic() + timeout
+            while True:
+                records = self.ring.read()
+                if len(records) or time.monotonic() > deadline:
+                    return records
+                if self.ring.is_closed:
+                    raise ConnectionError("Fused ring closed by the consumer")
+                time.sleep(poll_interval)
+
+        self.sock.settimeout(timeout)
+        try:
+            data = self.sock.recv(1 << 20)
+        except socket.timeout:
+            return np.empty(0, dtype=self.dtype)
+        if not data:
+            raise ConnectionError("Fused stream closed by the consumer")
+
+        # Return the complete records and keep a partial one for the next read
+        self.buffer += data
+        used = len(self.buffer) - len(self.buffer) % self.dtype.itemsize
+        records = np.frombuffer(bytes(self.buffer[:used]), dtype=self.dtype)
+        del self.buffer[:used]
+        return records
+
+    def close(self):
+        """Disconnect from the stream."""
+        if self.ring is not None:
+            self.ring.close()
+        else:
+            self.sock.close()
+
+
+if __name__ == "__main__":
+    # Initalize argument parser and define the arguments
+    parser = argparse.ArgumentParser(description="Subscribe to a consumer's fused orientation stream")
+    parser.add_argument("--fanout-path", dest="fanout_path", type=str, default="/tmp/imu_fused_socket", help="fused stream path, match with the consumer's --fanout-path")
+    parser.add_argument("--transport", dest="transport", type=str, default="socket", choices=["socket", "shm"], help="match with the consumer's --fanout-transport")
+    parser.add_argument("--print-every", dest="print_every", type=int, default=1000, help="print every Nth record, 0 prints none")
+    parser.add_argument("--output", dest="output", type=str, default=None, help="save every received record to this .npy file on exit")
+    parser.add_argument("--log-level", dest="log_level", type=str, default="INFO", choices=["INFO", "WARNING", "ERROR", "CRITICAL"])
+    args = parser.parse_args()
+
+    # Set up logger, defining minimum logging level
+    logging.basicConfig(level=args.log_level.upper())
+
+    # The consumer starts the stream once its publisher connects, so wait for it to appear
+    subscriber = None
+    while subscriber is None:
+        try:
+            subscriber = Fused_Subscriber(args.fanout_path, args.transport)
+        except (FileNotFoundError, ConnectionRefusedError):
+            logging.info("Waiting for the fused stream...")
+            time.sleep(1)
+        except KeyboardInterrupt:
+            raise SystemExit
+    logging.info(f"Subscribed to {args.fanout_path}, {subscriber.dtype.itemsize} byte records{' with estimates' if subscriber.dtype.names[-1] == 'accel_mag' else ''}")
+
+    received = []
+    count = 0
+    start = time.monotonic()
+    try:
+        while True:
+            records = subscriber.read()
+            if args.output:
+                received.append(records)
+
+            # Print the records at the specified rate
+            if args.print_every > 0:
+                for i in range(-count % args.print_every, len(records), args.print_every):
+                    w, x, y, z = records["fused"][i]
+                    logging.info(f"{records['timestamp'][i]} ms  Fused: W:{w:.3} X:{x:.3} Y:{y:.3} Z:{z:.3}")
+            count += len(records)
+    except KeyboardInterrupt:
+        print()
+    except ConnectionError as e:
+        logging.info(e)
+
+    elapsed = time.monotonic() - start
+    logging.info(f"Received {count} records in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f}/s){'' if subscriber.dropped is None else f', dropped {subscriber.dropped}'}")
+    if args.output:
+        np.save(args.output, np.concatenate(received) if received else np.empty(0, dtype=subscriber.dtype))
+        logging.info(f"Records written to {args.output}")
+    subscriber.close()
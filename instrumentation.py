@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+
+# Histogram bucket upper bounds [ns], 1-2-5 steps from 1 us to 1 s
+BUCKET_BOUNDS_NS = [int(m * 10**e) for e in range(3, 9) for m in (1, 2, 5)] + [10**9]
+
+class Histogram:
+    """
+    A fixed-bucket histogram of durations in nanoseconds.
+    Observing a value is a bisect and two additions, so it is cheap enough for every sample.
+    """
+
+    def __init__(self, bounds=BUCKET_BOUNDS_NS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # Last bucket is +Inf
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        """Add a duration in nanoseconds."""
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Estimate a quantile as the upper bound of the bucket that holds it.
+
+        Args:
+            q (float): Quantile between 0 and 1.
+
+        Returns:
+            Upper bound in nanoseconds, None if nothing was observed or it is above the largest bound.
+        """
+        if self.count == 0:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return None
+
+class Metrics:
+    """
+    A class to hold the hot path instrumentation of one process: per-stage latency histograms,
+    counters and gauges. Each metric should be updated by a single thread, snapshots can be taken from any thread.
+    """
+
+    def __init__(self):
+        self.stages = {}        # Stage name to Histogram
+        self.counters = {}      # Counter name to total
+        self.gauges = {}        # Gauge name to a function returning its current value
+        self._last_snapshot = (time.monotonic(), {})
+
+    def observe(self, stage, duration_ns):
+        """Record the duration of a stage in nanoseconds."""
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.observe(duration_ns)
+
+    def increment(self, counter, amount=1):
+        """Add to a counter."""
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def gauge(self, name, function):
+        """Register a function that returns the current value of a gauge, read at every snapshot."""
+        self.gauges[name] = function
+
+    def snapshot(self):
+        """
+        Take a snapshot of every metric, with counter rates since the previous snapshot.
+
+        Returns:
+            dict: Stages (count, mean and p50/p99/p99.9 estimates in microseconds, and bucket counts), counters, rates and gauges.
+        """
+        now = time.monotonic()
+        counters = dict(self.counters)
+        last_time, last_counters = self._last_snapshot
+        self._last_snapshot = (now, counters)
+        elapsed = now - last_time
+
+        def to_us(value):
+            return None if value is None else value / 1000
+
+        return {
+            "time": time.time(),
+            "stages": {
+                name: {
+                    "count": histogram.count,
+                    "mean_us": histogram.sum / histogram.count / 1000 if histogram.count else None,
+                    "p50_us": to_us(histogram.quantile(0.5)),
+                    "p99_us": to_us(histogram.quantile(0.99)),
+                    "p999_us": to_us(histogram.quantile(0.999)),
+                    "bucket_bounds_us": [bound / 1000 for bound in histogram.bounds],
+                    "bucket_counts": list(histogram.counts),
+                }
+                for name, histogram in list(self.stages.items())
+            },
+            "counters": counters,
+            "rates_per_second": {name: (value - last_counters.get(name, 0)) / elapsed if elapsed > 0 else 0.0 for name, value in counters.items()},
+            "gauges": {name: function() for name, function in list(self.gauges.items())},
+        }
+
+def to_prometheus(snapshot, prefix="imu"):
+    """
+    Format a snapshot in the Prometheus text exposition format.
+
+    Args:
+        snapshot (dict): Snapshot from Metrics.snapshot.
+        prefix (str): Metric name prefix.
+
+    Returns:
+        str: The metrics, one sample per line.
+    """
+    lines = [f"# TYPE {prefix}_stage_seconds histogram"]
+    for stage, histogram in snapshot["stages"].items():
+        cumulative = 0
+        for bound, count in zip(histogram["bucket_bounds_us"], histogram["bucket_counts"]):
+            cumulative += count
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound / 1e6:g}"}} {cumulative}')
+        lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {(histogram["mean_us"] or 0) * histogram["count"] / 1e6:g}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+    for name, value in snapshot["counters"].items():
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total {value}")
+    for name, value in snapshot["rates_per_second"].items():
+        lines.append(f"# TYPE {prefix}_{name}_per_second gauge")
+        lines.append(f"{prefix}_{name}_per_second {value:g}")
+    for name, value in snapshot["gauges"].items():
+        lines.append(f"# TYPE {prefix}_{name} gauge")
+        lines.append(f"{prefix}_{name} {value:g}")
+    return "\n".join(lines) + "\n"
+
+class Stats_Exporter:
+    """
+    A class to export periodic Metrics snapshots from a background thread, as a Prometheus text file
+    (replaced atomically) and/or over a Unix socket that sends the latest snapshot as JSON to each client.
+    """
+
+    def __init__(self, metrics, interval=1.0, prometheus_path=None, socket_path=None):
+        self.metrics = metrics
+        self.interval = interval
+        self.prometheus_path = prometheus_path
+        self.socket_path = socket_path
+        self.latest = None
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.server = None
+
+    def start(self):
+        """Start exporting."""
+        self.threads.append(threading.Thread(target=self._snapshot_loop, daemon=True))
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.server.bind(self.socket_path)
+            self.server.listen(8)
+            self.server.settimeout(self.interval)
+            self.threads.append(threading.Thread(target=self._serve_loop, daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def _snapshot_loop(self):
+        """Take a snapshot every interval and write the Prometheus file."""
+        while not self.stop_event.wait(self.interval):
+            self.export()
+
+    def export(self):
+        """Take a snapshot now and write the Prometheus file."""
+        self.latest = self.metrics.snapshot()
+        if self.prometheus_path:
+            temp_path = self.prometheus_path + ".tmp"
+            with open(temp_path, "w") as f:
+                f.write(to_prometheus(self.latest))
+            os.replace(temp_path, self.prometheus_path)
+
+    def _serve_loop(self):
+        """Send the latest snapshot to every client that connects."""
+        while not self.stop_event.is_set():
+            try:
+                conn, _ = self.server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            with conn:
+                try:
+                    conn.sendall((json.dumps(self.latest) + "\n").encode())
+                except OSError:
+                    pass
+
+    def stop(self):
+        """Write a final snapshot and stop exporting."""
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+        self.export()
+        if self.server is not None:
+            self.server.close()
+            os.remove(self.socket_path)
+
+def read_stats(socket_path):
+    """
+    Read the latest snapshot from a stats endpoint.
+
+    Args:
+        socket_path (str): Path of the stats Unix socket.
+
+    Returns:
+        dict: The snapshot, None if the consumer has not taken one yet.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        data = b""
+        while chunk := sock.recv(65536):
+            data += chunk
+    return json.loads(data)
+
+
+if __name__ == "__main__":
+    # Initalize argument parser and define the arguments
+    parser = argparse.ArgumentParser(description="Print the latest snapshot from a consumer's stats endpoint")
+    parser.add_argument("--stats-socket", dest="stats_socket", type=str, default="/tmp/imu_stats_socket", help="stats endpoint, match with the consumer's --stats-socket")
+    args = parser.parse_args()
+
+    print(json.dumps(read_stats(args.stats_socket), indent=2))
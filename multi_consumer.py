@@ -0,0 +1,294 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import selectors
+import signal
+import socket
+import threading
+import time
+from collections import deque
+from queue import Empty as QueueEmpty, Full as QueueFull
+import numpy as np
+from frame_reader import Frame_Reader, negotiate_wire_format
+from payload_imu_class import unpack_batch
+from sample_queue import Sample_Queue, QUEUE_POLICIES
+from stream_fusion import Stream_Fusion
+
+# Coalescing merges the gyro steps of single samples, the worker queues hold batches of frames
+WORKER_QUEUE_POLICIES = tuple(policy for policy in QUEUE_POLICIES if policy != "coalesce")
+
+def log_stream(stream_id, fusion, fused, verbosity_rate):
+    """
+    Log the fused quaternion of a stream every verbosity_rate samples.
+
+    Args:
+        stream_id: Id of the stream.
+        fusion: Stream_Fusion of the stream, after processing the batch.
+        fused: Fused quaternions of the batch, shape (N, 4).
+        verbosity_rate: Number of samples between log lines.
+    """
+    first = fusion.count - len(fused)
+    for i in range(-first % verbosity_rate, len(fused), verbosity_rate):
+        w, x, y, z = fused[i] / np.linalg.norm(fused[i])
+        logging.info(f"Stream {stream_id} Fused Result:  W:{w:.3} X:{x:.3} Y:{y:.3} Z:{z:.3}")
+
+def fusion_worker(channel, verbosity_rate, log_level):
+    """
+    Process to fuse the streams sharded to it, keeping an independent Stream_Fusion per stream.
+
+    Args:
+        channel: multiprocessing Queue of lists of (stream_id, frame bytes) messages, frame bytes of None closes the stream, None stops the worker.
+        verbosity_rate: Number of samples between log lines per stream.
+        log_level: Minimum logging level.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # the main process handles the interrupt and stops the worker
+    logging.basicConfig(level=log_level)
+    streams = {}
+    while True:
+        messages = channel.get()
+        if messages is None:
+            break
+
+        for stream_id, data in messages:
+            if data is None:
+                fusion = streams.pop(stream_id, None)
+                if fusion is not None:
+                    logging.info(f"Stream {stream_id} closed after {fusion.count} samples (worker {os.getpid()})")
+                continue
+
+            fusion = streams.setdefault(stream_id, Stream_Fusion())
+            _, _, fused = fusion.process(unpack_batch(data))
+            log_stream(stream_id, fusion, fused, verbosity_rate)
+
+class Worker_Channel:
+    """
+    A class to hand batches of frames from the receive loop to a fusion worker, like consumer.py's Process_Channel.
+    Batches are put on a local Sample_Queue, so the queue size and policy bound the backlog in the receiving process,
+    and a sender thread moves every queued batch, up to max_batch, to the worker as one message. The channel holds
+    at most max_messages messages, so when the worker falls behind the local queue fills up and the policy applies.
+    Stream closes bypass the policy, and are only sent once the local queue has emptied, after every batch put before them.
+    """
+
+    def __init__(self, maxsize=0, policy="block", max_batch=64, max_messages=2):
+        self.queue = Sample_Queue(maxsize, policy)
+        self.channel = multiprocessing.Queue(max_messages)
+        self.max_batch = max_batch
+        self.closing = deque()      # Stream ids closed since the last closes were sent
+        self.batch = None           # Batch taken from the local queue and not yet sent
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._send_loop, daemon=True)
+        self.thread.start()
+
+    def put(self, stream_id, data):
+        """Queue a batch of frames of a stream, applying the policy if the queue is full."""
+        return self.queue.put((stream_id, data))
+
+    def close_stream(self, stream_id):
+        """Tell the worker a stream is done, once its queued batches have been sent."""
+        self.closing.append(stream_id)
+
+    def stats(self):
+        """Take a snapshot of the local queue counters, see Sample_Queue.stats."""
+        return self.queue.stats()
+
+    def _send(self, timeout=None):
+        """
+        Send the next batch, or the pending closes once every batch put before them has been sent.
+
+        Raises:
+            queue.Empty: If there was nothing to send within the timeout.
+            queue.Full: If the worker did not take the message within the timeout.
+        """
+        closing = list(self.closing) # closed after their last batch was put
+        if self.batch is None and closing and self.queue.qsize() == 0:
+            self.channel.put([(stream_id, None) for stream_id in closing], timeout=timeout)
+            for _ in closing:
+                self.closing.popleft()
+            return
+
+        if self.batch is None:
+            self.batch = self.queue.get_batch(self.max_batch, timeout=timeout)
+        self.channel.put(self.batch, timeout=timeout) # wait for the worker to take a message
+        self.batch = None
+
+    def _send_loop(self):
+        """Send the queued batches and closes, until closed."""
+        while not self.stop_event.is_set():
+            try:
+                self._send(timeout=0.1)
+            except (QueueEmpty, QueueFull):
+                pass
+
+    def close(self):
+        """Send every queued batch and pending close, then stop the worker once it has fused them."""
+        self.stop_event.set()
+        self.thread.join()
+        while self.batch is not None or self.closing or self.queue.qsize() > 0:
+            self._send()
+        self.channel.put(None)
+
+class Stream:
+    """
+    A class to hold one publisher connection and its receive state.
+    """
+
+    def __init__(self, stream_id, conn, recv_batch):
+        self.stream_id = stream_id
+        self.conn = conn
+        self.reader = Frame_Reader(max_frames=recv_batch)
+        self.fusion = Stream_Fusion()   # Used when fusing in the main process
+        self.is_negotiated = False      # Whether the wire format has been agreed on
+
+
+if __name__ == "__main__":
+    # Initalize argument parser and define the arguments
+    parser = argparse.ArgumentParser(description="Consumer serving many publishers on one socket path")
+    parser.add_argument("--socket-path", dest="socket_path", type=str, default="/tmp/imu_sensor_socket", help="set socket path, match with publisher socket path")
+    parser.add_argument("--log-level", dest="log_level", type=str, default="INFO", choices=["INFO", "WARNING", "ERROR", "CRITICAL"])
+    parser.add_argument("--timeout-ms", dest="timeout_ms", type=int, default=100)
+    parser.add_argument("--max-timeouts", dest="max_timeouts", type=int, default=10, help="number of successive timeouts with publishers connected before exiting, each after the first waits 1 more second")
+    parser.add_argument("--idle-timeout", dest="idle_timeout", type=float, default=60, help="seconds to wait with no publishers connected before exiting")
+    parser.add_argument("--verbosity-rate", dest="verbosity_rate", type=int, default=500, help="rate of verbosity for the logger, per stream")
+    parser.add_argument("--recv-batch", dest="recv_batch", type=int, default=256, help="maximum number of frames read per call")
+    parser.add_argument("--max-streams", dest="max_streams", type=int, default=64, help="listen backlog for incoming publishers")
+    parser.add_argument("--workers", dest="workers", type=int, default=0, help="number of fusion processes to shard streams across, 0 fuses in the receiving process")
+    parser.add_argument("--queue-size", dest="queue_size", type=int, default=256, help="maximum number of frame batches waiting for each worker, 0 is unbounded")
+    parser.add_argument("--queue-policy", dest="queue_policy", type=str, default="block", choices=WORKER_QUEUE_POLICIES, help="what to do when a worker queue is full")
+    args = parser.parse_args()
+
+    # Set up logger, defining minimum logging level
+    logging.basicConfig(level=args.log_level.upper())
+    logging.info("Logger successfully initialized")
+
+    # Create the Unix Compatible Socket
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    # Check socket path and link to socket
+    if os.path.exists(args.socket_path):
+        os.remove(args.socket_path)
+        logging.info("Socket Path already existed. It has been removed")
+
+    sock.bind(args.socket_path)
+    sock.listen(args.max_streams)
+    sock.setblocking(False)
+    logging.info("Socket path successfully created and binded")
+
+    # Start the fusion workers, each stream is always sent to the same worker
+    worker_channels = []
+    workers = []
+    for _ in range(args.workers):
+        worker_channel = Worker_Channel(args.queue_size, args.queue_policy)
+        worker = multiprocessing.Process(target=fusion_worker, args=(worker_channel.channel, args.verbosity_rate, args.log_level.upper()))
+        worker.start()
+        worker_channels.append(worker_channel)
+        workers.append(worker)
+    if workers:
+        logging.info(f"{len(workers)} fusion workers started")
+
+    # Multiplex the listening socket and every publisher connection
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ, data=None)
+    streams = {}
+    next_stream_id = 0
+    timeouts = 0
+    idle_since = time.monotonic()
+
+    def close_stream(stream):
+        """Unregister and close a publisher connection, telling its worker the stream is done."""
+        selector.unregister(stream.conn)
+        stream.conn.close()
+        del streams[stream.stream_id]
+        if worker_channels:
+            worker_channels[stream.stream_id % len(worker_channels)].close_stream(stream.stream_id)
+        else:
+            logging.info(f"Stream {stream.stream_id} closed after {stream.fusion.count} samples")
+
+    try:
+        logging.info("Waiting for incoming connections...")
+        while timeouts < args.max_timeouts:
+            # After a timeout, back off for a second before counting the next one, as the consumer does
+            events = selector.select(timeout=args.timeout_ms / 1000 + (1 if timeouts else 0))
+
+            if not events:
+                # With no publishers connected, wait for new ones up to the idle timeout
+                if not streams:
+                    if time.monotonic() - idle_since > args.idle_timeout:
+                        logging.critical(f"No publishers connected for over {args.idle_timeout} seconds, exiting")
+                        break
+                    continue
+                timeouts += 1
+                logging.warning(f"Socket timed out, total timeouts: {timeouts}")
+                continue
+            timeouts = 0
+
+            for key, _ in events:
+                # Accept a new publisher
+                if key.data is None:
+                    conn, _ = sock.accept()
+                    conn.setblocking(False)
+                    stream = Stream(next_stream_id, conn, args.recv_batch)
+                    streams[stream.stream_id] = stream
+                    selector.register(conn, selectors.EVENT_READ, data=stream)
+                    logging.info(f"Stream {stream.stream_id} connected, {len(streams)} streams connected")
+                    next_stream_id += 1
+                    continue
+
+                # Receive every complete frame available from a publisher
+                stream = key.data
+                try:
+                    # Streams are fused as v1 frames, so a v2 hello is declined and the publisher falls back to v1
+                    if not stream.is_negotiated:
+                        stream.conn.settimeout(args.timeout_ms / 1000)
+                        negotiate_wire_format(stream.conn, is_v2_accepted=False)
+                        stream.conn.setblocking(False)
+                        stream.is_negotiated = True
+                    frames = stream.reader.recv(stream.conn)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                except OSError as e:
+                    logging.error(f"Stream {stream.stream_id} error: {e}")
+                    frames = None
+
+                if frames is None:
+                    close_stream(stream)
+                    logging.info(f"Publisher disconnected, {len(streams)} streams connected")
+                    if not streams:
+                        idle_since = time.monotonic()
+                elif len(frames) > 0:
+                    if worker_channels:
+                        worker_channels[stream.stream_id % len(worker_channels)].put(stream.stream_id, frames.tobytes())
+                    else:
+                        _, _, fused = stream.fusion.process(frames)
+                        log_stream(stream.stream_id, stream.fusion, fused, args.verbosity_rate)
+
+    # Force exit with keyboard interrupt
+    except KeyboardInterrupt:
+        print()
+        logging.critical("Keyboard interrupt detected, forcing exiting")
+
+    # Log exit based on timeout if max timeouts is reached
+    if timeouts >= args.max_timeouts:
+        logging.critical("Max timeouts reached, consider checcking the connection or changing the (1) publisher frequency or (2) timeout-ms. Now exiting...")
+
+    # Close everything and log it
+    for stream in list(streams.values()):
+        close_stream(stream)
+    logging.info("Socket connections successfully closed")
+
+    for worker_channel in worker_channels:
+        worker_channel.close() # stop the worker once its queue is drained
+    for worker in workers:
+        worker.join()
+    for i, worker_channel in enumerate(worker_channels):
+        stats = worker_channel.stats()
+        logging.info(f"Worker {i} queue:  Max Depth:{stats['max_depth']} Dropped:{stats['dropped']} Max Staleness:{stats['max_staleness_ms']:.1f}ms")
+    if workers:
+        logging.info("Fusion workers successfully stopped")
+
+    selector.close()
+    sock.close() # close the socket
+    logging.info("Socket successfully closed")
+
+    os.remove(args.socket_path) # remove the socket path
+    logging.info("Socket path successfully removed")
@@ -0,0 +1,62 @@
+import argparse
+import logging
+import time
+import numpy as np
+from recording import load_recording
+from sensor_processing import euler_to_quaternion_batch
+from stream_fusion import Stream_Fusion
+
+def fuse_records(records, update_decimation=1, ekf_options=None):
+    """
+    Run the consumer's fusion over a whole recording at once.
+    - Euler conversions and gyro deltas are computed for every row in one vectorized pass.
+    - The EKF recursion then runs in a tight loop over the precomputed arrays.
+
+    Args:
+        records (numpy.ndarray): Structured array of STRUCT_DTYPE records.
+        update_decimation (int): Apply a measurement update on every Nth fresh accelerometer or magnetometer reading.
+        ekf_options (dict): Keyword arguments for the filter, e.g. p0, process_noise, measurement_noise.
+
+    Returns:
+        dict: Arrays keyed by name, each quaternion series is (w, x, y, z) with shape (N, 4).
+            timestamp: gyro timestamps [ms]
+            gyro: integrated gyroscope orientation
+            accel_mag: accelerometer and magnetometer orientation
+            fused: EKF result
+    """
+    gyro_states, euler_rotation, fused = Stream_Fusion(update_decimation=update_decimation, ekf_options=ekf_options).process(records)
+
+    return {
+        "timestamp": records["timestampGyro"].copy(),
+        "gyro": euler_to_quaternion_batch(gyro_states),
+        "accel_mag": euler_to_quaternion_batch(euler_rotation),
+        "fused": fused,
+    }
+
+
+if __name__ == "__main__":
+    # Initalize argument parser and define the arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", dest="input_path", type=str, default="sensor_data.csv", help="recording to fuse, binary or CSV")
+    parser.add_argument("--output", dest="output_path", type=str, default="fused.npz", help="binary output with the gyro, accel/mag and fused quaternion series")
+    parser.add_argument("--update-decimation", dest="update_decimation", type=int, default=1, help="apply a measurement update on every Nth fresh accelerometer or magnetometer reading")
+    parser.add_argument("--ekf-p0", dest="ekf_p0", type=float, default=0.1, help="initial state covariance of the EKF, times identity")
+    parser.add_argument("--ekf-q", dest="ekf_q", type=float, default=0.01, help="process noise covariance of the EKF, times identity")
+    parser.add_argument("--ekf-r", dest="ekf_r", type=float, default=0.1, help="measurement noise covariance of the EKF, times identity")
+    parser.add_argument("--log-level", dest="log_level", type=str, default="INFO", choices=["INFO", "WARNING", "ERROR", "CRITICAL"])
+    args = parser.parse_args()
+
+    # Set up logger, defining minimum logging level
+    logging.basicConfig(level=args.log_level.upper())
+
+    start = time.perf_counter()
+    records = load_recording(args.input_path)
+    loaded = time.perf_counter()
+    logging.info(f"Loaded {len(records)} samples from {args.input_path} in {loaded - start:.3f} s")
+
+    result = fuse_records(records, args.update_decimation, {"p0": args.ekf_p0, "process_noise": args.ekf_q, "measurement_noise": args.ekf_r})
+    fused = time.perf_counter()
+    logging.info(f"Fused {len(records)} samples in {fused - loaded:.3f} s ({(fused - loaded) / max(len(records), 1) * 1e6:.2f} us/sample)")
+
+    np.savez(args.output_path, **result)
+    logging.info(f"Results written to {args.output_path}")
@@ -0,0 +1,81 @@
+import time
+
+class Pacer:
+    """
+    A deadline-based scheduler for sending samples at a fixed rate.
+    Sample n is due at start + n / rate, so sleep overshoot and per-sample work do not pile up into drift:
+    a late wake-up only means more samples are due, and they are all sent on that tick.
+    - Below 1 / min_tick the pacer sleeps until each sample's deadline and usually releases one sample.
+    - Above it the pacer sleeps at least min_tick between wake-ups, releasing a burst of due samples
+      to send in one call, so the rate does not depend on the sleep granularity.
+    """
+
+    def __init__(self, rate_hz, min_tick=0.001, max_burst=1024):
+        self.rate_hz = rate_hz
+        self.interval = 1.0 / rate_hz
+        self.min_tick = min_tick        # [s] minimum time between wake-ups
+        self.max_burst = max_burst      # Maximum number of samples released per tick
+
+        self.start = None               # Start of the current schedule, set on the first wait
+        self.last_tick = 0.0
+        self.scheduled = 0              # Samples released since the start of the current schedule
+
+        # Totals over every schedule, for the report
+        self.sent = 0
+        self.elapsed_before = 0.0
+        self.max_lag = 0.0              # [s] worst delay of a sample behind its deadline
+
+    def wait(self):
+        """
+        Sleep until at least one sample is due.
+
+        Returns:
+            int: Number of samples due now, at most max_burst.
+        """
+        now = time.monotonic()
+        if self.start is None:
+            self.start = self.last_tick = now
+
+        # Sleep to the next deadline, but batch high rates into ticks, and do not sleep at all when behind
+        deadline = self.start + self.scheduled * self.interval
+        if deadline > now:
+            time.sleep(max(deadline, self.last_tick + self.min_tick) - now)
+            now = time.monotonic()
+        self.last_tick = now
+        self.max_lag = max(self.max_lag, now - deadline)
+
+        due = int((now - self.start) / self.interval) + 1 - self.scheduled
+        return max(1, min(due, self.max_burst))
+
+    def record(self, count):
+        """Count samples as sent, once they have been."""
+        self.scheduled += count
+        self.sent += count
+
+    def restart(self):
+        """
+        Start a new schedule from the next wait, e.g. after a reconnect,
+        so the time spent disconnected is not sent as one catch-up burst.
+        """
+        if self.start is not None:
+            self.elapsed_before += time.monotonic() - self.start
+        self.start = None
+        self.scheduled = 0
+
+    def stats(self):
+        """
+        Compare the achieved rate with the target.
+
+        Returns:
+            dict: Samples sent, elapsed seconds, achieved and target rate [Hz], achieved percentage of the target and maximum lag [ms].
+        """
+        elapsed = self.elapsed_before + (time.monotonic() - self.start if self.start is not None else 0.0)
+        achieved = self.sent / elapsed if elapsed > 0 else 0.0
+        return {
+            "sent": self.sent,
+            "elapsed": elapsed,
+            "achieved_hz": achieved,
+            "target_hz": self.rate_hz,
+            "achieved_percent": achieved / self.rate_hz * 100,
+            "max_lag_ms": self.max_lag * 1000,
+        }
@@ -1,9 +1,19 @@
 import struct
 from dataclasses import dataclass
+from operator import attrgetter
+import numpy as np
 
 STRUCT_FORMAT = "<fffQiiiQfffQ"
 STRUCT_SIZE = struct.calcsize(STRUCT_FORMAT)
 
+# NumPy equivalent of STRUCT_FORMAT, used to decode many frames in a single call
+STRUCT_DTYPE = np.dtype([
+    ("xAcc", "<f4"), ("yAcc", "<f4"), ("zAcc", "<f4"), ("timestampAcc", "<u8"),
+    ("xGyro", "<i4"), ("yGyro", "<i4"), ("zGyro", "<i4"), ("timestampGyro", "<u8"),
+    ("xMag", "<f4"), ("yMag", "<f4"), ("zMag", "<f4"), ("timestampMag", "<u8"),
+])
+assert STRUCT_DTYPE.itemsize == STRUCT_SIZE, "STRUCT_DTYPE does not match STRUCT_FORMAT"
+
 # Define the IMU class
 @dataclass
 class Payload_IMU:
@@ -53,4 +63,123 @@ class Payload_IMU:
             packed_data = struct.pack(STRUCT_FORMAT, *self.__dict__.values())
         except struct.error as e:
             raise ValueError(f"Packing error: {e}")
-        return packed_data
\ No newline at end of file
+        return packed_data
+
+# Precompiled struct and field order for the slotted record
+STRUCT = struct.Struct(STRUCT_FORMAT)
+FIELD_NAMES = STRUCT_DTYPE.names
+_get_fields = attrgetter(*FIELD_NAMES)
+
+@dataclass(slots=True)
+class Payload_IMU_Slots:
+    """
+    A __slots__ variant of Payload_IMU, with the same fields and wire format.
+    Attributes are not stored in a __dict__, so each record takes less memory.
+    """
+
+    xAcc: float
+    yAcc: float
+    zAcc: float
+    timestampAcc: int
+
+    xGyro: int
+    yGyro: int
+    zGyro: int
+    timestampGyro: int
+
+    xMag: float
+    yMag: float
+    zMag: float
+    timestampMag: int
+
+    @classmethod
+    def unpack(cls, data: bytes):
+        """
+        Create an IMU object from a byte array.
+
+        Args:
+            data (bytes): The byte array containing IMU data.
+
+        Returns:
+            Payload_IMU_Slots: An instance with populated attributes.
+        """
+        if len(data) != STRUCT_SIZE:
+            raise ValueError(f"Data size mismatch: expected {STRUCT_SIZE}, got {len(data)}")
+        return cls(*STRUCT.unpack(data))
+
+    def pack(self) -> bytes:
+        """
+        Convert the IMU object to a byte array.
+
+        Returns:
+            bytes: The byte array representation of the IMU data.
+        """
+        try:
+            return STRUCT.pack(*_get_fields(self))
+        except struct.error as e:
+            raise ValueError(f"Packing error: {e}")
+
+def unpack_batch(data) -> np.ndarray:
+    """
+    Decode a contiguous buffer of IMU frames into a structured array without per-frame objects.
+    The result is a read-only view of the buffer, call .copy() if the buffer will be reused.
+
+    Args:
+        data (bytes | bytearray | memoryview): Buffer holding a whole number of frames.
+
+    Returns:
+        numpy.ndarray: Structured array of STRUCT_DTYPE records, one per frame.
+    """
+    if len(data) % STRUCT_SIZE != 0:
+        raise ValueError(f"Data size mismatch: {len(data)} is not a multiple of {STRUCT_SIZE}")
+    return np.frombuffer(data, dtype=STRUCT_DTYPE)
+
+def pack_batch(records) -> bytes:
+    """
+    Encode many IMU records into one contiguous buffer.
+
+    Args:
+        records: Structured array with the STRUCT_DTYPE fields, or a dict of equal-length columns keyed by field name.
+
+    Returns:
+        bytes: The frames back to back, identical to packing each record on its own.
+    """
+    try:
+        # Copy field by field (by name) unless the records already match the wire layout
+        if isinstance(records, dict) or records.dtype != STRUCT_DTYPE:
+            records = columns_to_records(records)
+        return records.tobytes()
+    except (ValueError, TypeError, OverflowError) as e:
+        raise ValueError(f"Packing error: {e}")
+
+def columns_to_records(columns) -> np.ndarray:
+    """
+    Convert a struct-of-arrays to a structured array of records.
+
+    Args:
+        columns (dict | numpy.ndarray): Equal-length arrays keyed by field name (or a structured array),
+            every field in STRUCT_DTYPE is required.
+
+    Returns:
+        numpy.ndarray: Structured array of STRUCT_DTYPE records.
+    """
+    names = columns.dtype.names if isinstance(columns, np.ndarray) else columns
+    missing = [name for name in FIELD_NAMES if name not in names]
+    if missing:
+        raise ValueError(f"Missing columns: {missing}")
+    records = np.empty(len(columns[FIELD_NAMES[0]]), dtype=STRUCT_DTYPE)
+    for name in FIELD_NAMES:
+        records[name] = columns[name]
+    return records
+
+def records_to_columns(records) -> dict:
+    """
+    Convert a structured array of records to a struct-of-arrays.
+
+    Args:
+        records (numpy.ndarray): Structured array of STRUCT_DTYPE records.
+
+    Returns:
+        dict: Contiguous arrays keyed by field name.
+    """
+    return {name: np.ascontiguousarray(records[name]) for name in FIELD_NAMES}
@@ -0,0 +1,235 @@
+import struct
+import numpy as np
+from payload_imu_class import STRUCT_DTYPE, STRUCT_SIZE
+
+WIRE_VERSION = 2
+
+# Handshake sent by a v2 publisher right after connecting, padded to the size of one v1 frame.
+# The first four bytes of the magic read as a NaN xAcc, which a v1 frame never holds, so the consumer can tell the formats apart.
+HELLO_MAGIC = b"\xff\xff\xff\xffIMU2"
+HELLO_FORMAT = "<8sHHfff"   # magic, version, samples per frame, accel, gyro and mag scales
+HELLO_SIZE = STRUCT_SIZE
+ACCEPT = struct.Struct("<8sH")  # magic, version accepted by the consumer (1 falls back to STRUCT_FORMAT frames)
+
+# A v2 frame is a header followed by up to 65535 fixed-size samples
+FRAME_SYNC = 0x3256                     # "V2", checked on every frame to catch a misaligned stream
+FRAME_HEADER = struct.Struct("<HHQ")    # sync, sample count, base timestamp [ms], for reading one header
+FRAME_HEADER_DTYPE = np.dtype([("sync", "<u2"), ("count", "<u2"), ("base", "<u8")])
+
+# Each sample holds its gyro timestamp as an offset from the frame's base timestamp, the accelerometer
+# and magnetometer timestamps as offsets from the gyro timestamp (a reading held for up to 32 s), and every channel as int16 fixed point
+SAMPLE_DTYPE = np.dtype([
+    ("dtGyro", "<u2"), ("dtAcc", "<i2"), ("dtMag", "<i2"),
+    ("xAcc", "<i2"), ("yAcc", "<i2"), ("zAcc", "<i2"),
+    ("xGyro", "<i2"), ("yGyro", "<i2"), ("zGyro", "<i2"),
+    ("xMag", "<i2"), ("yMag", "<i2"), ("zMag", "<i2"),
+])
+INT16_MIN, INT16_MAX = np.iinfo(np.int16).min, np.iinfo(np.int16).max
+
+def recv_exact(conn, size):
+    """
+    Receive exactly size bytes from a stream socket.
+
+    Args:
+        conn: Connected stream socket.
+        size (int): Number of bytes to receive.
+
+    Returns:
+        bytes: The data.
+
+    Raises:
+        ConnectionError: If the peer disconnects first.
+    """
+    data = b""
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Peer disconnected during the handshake")
+        data += chunk
+    return data
+
+def pack_accept(version):
+    """Pack the consumer's answer to a hello, the wire format version it will read."""
+    return ACCEPT.pack(HELLO_MAGIC, version)
+
+def unpack_accept(data):
+    """
+    Unpack the consumer's answer to a hello.
+
+    Returns:
+        int: The accepted version.
+    """
+    magic, version = ACCEPT.unpack(data)
+    if magic != HELLO_MAGIC:
+        raise ValueError("Invalid handshake answer")
+    return version
+
+class Payload_IMU_V2:
+    """
+    A class to encode and decode compact v2 IMU frames, about 2-3x smaller than STRUCT_FORMAT frames.
+    - The three timestamps become one base timestamp per frame and small per-sample offsets
+    - Accelerometer, gyroscope and magnetometer channels become int16 fixed point, value = raw * scale
+    - Several samples share one frame header
+    Frames decode to STRUCT_DTYPE records, so everything downstream of the reader is unchanged.
+    """
+
+    def __init__(self, acc_scale=0.5, gyro_scale=20.0, mag_scale=0.1, samples_per_frame=16):
+        self.acc_scale = acc_scale              # [mg per LSB], default covers +-16 g
+        self.gyro_scale = gyro_scale            # [mDeg/s per LSB], default covers +-655 deg/s
+        self.mag_scale = mag_scale              # [mGauss per LSB], default covers +-3.2 Gauss
+        self.samples_per_frame = samples_per_frame
+        self.max_frame_size = FRAME_HEADER.size + samples_per_frame * SAMPLE_DTYPE.itemsize
+
+    def hello(self) -> bytes:
+        """
+        Pack the handshake declaring the version, frame size and scales.
+
+        Returns:
+            bytes: The hello, HELLO_SIZE bytes long.
+        """
+        hello = struct.pack(HELLO_FORMAT, HELLO_MAGIC, WIRE_VERSION, self.samples_per_frame, self.acc_scale, self.gyro_scale, self.mag_scale)
+        return hello.ljust(HELLO_SIZE, b"\x00")
+
+    @classmethod
+    def from_hello(cls, data: bytes):
+        """
+        Create the codec declared by a publisher's hello.
+
+        Args:
+            data (bytes): The hello, HELLO_SIZE bytes long.
+
+        Returns:
+            Payload_IMU_V2: Codec with the declared frame size and scales.
+        """
+        magic, version, samples_per_frame, acc_scale, gyro_scale, mag_scale = struct.unpack_from(HELLO_FORMAT, data)
+        if magic != HELLO_MAGIC or version != WIRE_VERSION:
+            raise ValueError(f"Unsupported hello: version {version}")
+        return cls(acc_scale, gyro_scale, mag_scale, samples_per_frame)
+
+    def _quantize(self, values, scale, name):
+        """Convert a channel to int16 fixed point, refusing values outside the declared range."""
+        quantized = np.rint(values / scale)
+        if len(quantized) and (quantized.min() < INT16_MIN or quantized.max() > INT16_MAX):
+            raise ValueError(f"Packing error: {name} is out of range for a scale of {scale}")
+        return quantized
+
+    def _offsets(self, values, low, high, name):
+        """Check that timestamp offsets fit their field."""
+        if len(values) and (values.min() < low or values.max() > high):
+            raise ValueError(f"Packing error: {name} offset is out of range")
+        return values
+
+    def encode(self, records) -> bytes:
+        """
+        Encode IMU records into v2 frames of up to samples_per_frame samples each.
+
+        Args:
+            records (numpy.ndarray): Structured array of STRUCT_DTYPE records.
+
+        Returns:
+            bytes: The frames back to back.
+        """
+        n = len(records)
+        if n == 0:
+            return b""
+        n_frames = -(-n // self.samples_per_frame)
+        counts = np.full(n_frames, self.samples_per_frame, dtype=np.uint16)
+        if n % self.samples_per_frame:
+            counts[-1] = n % self.samples_per_frame
+        starts = np.arange(n_frames) * self.samples_per_frame
+
+        # Each frame's base timestamp is its earliest gyro timestamp
+        timestamps = records["timestampGyro"].astype(np.int64)
+        bases = np.minimum.reduceat(timestamps, starts)
+        frame_of_sample = np.repeat(np.arange(n_frames), counts)
+
+        samples = np.empty(n, dtype=SAMPLE_DTYPE)
+        samples["dtGyro"] = self._offsets(timestamps - bases[frame_of_sample], 0, np.iinfo(np.uint16).max, "gyro timestamp")
+        samples["dtAcc"] = self._offsets(records["timestampAcc"].astype(np.int64) - timestamps, INT16_MIN, INT16_MAX, "accelerometer timestamp")
+        samples["dtMag"] = self._offsets(records["timestampMag"].astype(np.int64) - timestamps, INT16_MIN, INT16_MAX, "magnetometer timestamp")
+        for axis in "xyz":
+            samples[f"{axis}Acc"] = self._quantize(records[f"{axis}Acc"], self.acc_scale, f"{axis}Acc")
+            samples[f"{axis}Gyro"] = self._quantize(records[f"{axis}Gyro"], self.gyro_scale, f"{axis}Gyro")
+            samples[f"{axis}Mag"] = self._quantize(records[f"{axis}Mag"], self.mag_scale, f"{axis}Mag")
+
+        headers = np.empty(n_frames, dtype=FRAME_HEADER_DTYPE)
+        headers["sync"] = FRAME_SYNC
+        headers["count"] = counts
+        headers["base"] = bases
+        header_bytes = headers.view(np.uint8).reshape(n_frames, FRAME_HEADER.size)
+        sample_bytes = samples.view(np.uint8)
+
+        # Full frames have the same layout, so interleave their headers and samples as 2D byte views
+        n_full = n // self.samples_per_frame
+        split = n_full * self.samples_per_frame * SAMPLE_DTYPE.itemsize
+        out = np.empty(n_frames * FRAME_HEADER.size + n * SAMPLE_DTYPE.itemsize, dtype=np.uint8)
+        full = out[:n_full * self.max_frame_size].reshape(n_full, self.max_frame_size)
+        full[:, :FRAME_HEADER.size] = header_bytes[:n_full]
+        full[:, FRAME_HEADER.size:] = sample_bytes[:split].reshape(n_full, self.samples_per_frame * SAMPLE_DTYPE.itemsize)
+
+        # The last frame may be partial
+        if n_full < n_frames:
+            tail = n_full * self.max_frame_size
+            out[tail:tail + FRAME_HEADER.size] = header_bytes[-1]
+            out[tail + FRAME_HEADER.size:] = sample_bytes[split:]
+        return out.tobytes()
+
+    def decode(self, data, length=None):
+        """
+        Decode every complete v2 frame at the start of a buffer.
+
+        Args:
+            data (bytes | bytearray | memoryview): Buffer starting at a frame boundary.
+            length (int): Number of valid bytes in the buffer, None uses all of it.
+
+        Returns:
+            tuple: (Structured array of STRUCT_DTYPE records, number of bytes consumed).
+
+        Raises:
+            ValueError: If a frame header is invalid, meaning the stream is misaligned.
+        """
+        length = len(data) if length is None else length
+        offset = 0
+        starts, bases, counts = [], [], []
+
+        # Walk the frame headers, each sample count gives the start of the next frame
+        while offset + FRAME_HEADER.size <= length:
+            sync, count, base = FRAME_HEADER.unpack_from(data, offset)
+            if sync != FRAME_SYNC or count > self.samples_per_frame:
+                raise ValueError(f"Invalid v2 frame header at byte {offset}")
+            end = offset + FRAME_HEADER.size + count * SAMPLE_DTYPE.itemsize
+            if end > length:
+                break
+            starts.append(offset + FRAME_HEADER.size)
+            bases.append(base)
+            counts.append(count)
+            offset = end
+
+        # Gather the samples of every frame in one pass by masking out the header bytes in between
+        is_sample = np.ones(offset, dtype=bool)
+        header_starts = np.array(starts, dtype=np.int64) - FRAME_HEADER.size
+        is_sample[(header_starts[:, None] + np.arange(FRAME_HEADER.size)).reshape(-1)] = False
+        samples = np.frombuffer(data, dtype=np.uint8, count=offset)[is_sample].view(SAMPLE_DTYPE)
+        return self.samples_to_records(samples, np.repeat(np.array(bases, dtype=np.uint64), counts)), offset
+
+    def samples_to_records(self, samples, bases):
+        """
+        Expand v2 samples to STRUCT_DTYPE records.
+
+        Args:
+            samples (numpy.ndarray): Structured array of SAMPLE_DTYPE samples.
+            bases (numpy.ndarray): Base timestamp of each sample's frame.
+
+        Returns:
+            numpy.ndarray: Structured array of STRUCT_DTYPE records.
+        """
+        records = np.empty(len(samples), dtype=STRUCT_DTYPE)
+        timestamps = bases.astype(np.int64) + samples["dtGyro"]
+        records["timestampGyro"] = timestamps
+        records["timestampAcc"] = timestamps + samples["dtAcc"]
+        records["timestampMag"] = timestamps + samples["dtMag"]
+        for axis in "xyz":
+            records[f"{axis}Acc"] = samples[f"{axis}Acc"] * self.acc_scale
+            records[f"{axis}Gyro"] = np.rint(samples[f"{axis}Gyro"] * self.gyro_scale)
+            records[f"{axis}Mag"] = samples[f"{axis}Mag"] * self.mag_scale
+        return records
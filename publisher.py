@@ -2,8 +2,16 @@ import argparse
 import logging
 import socket
 import time
-import random
-from payload_imu_class import Payload_IMU as IMU, STRUCT_SIZE
+import numpy as np
+from payload_imu_class import Payload_IMU_Slots as IMU, STRUCT_SIZE, unpack_batch
+from payload_imu_v2 import Payload_IMU_V2, ACCEPT, WIRE_VERSION, recv_exact, unpack_accept
+from recording import open_recording
+from shm_ring import Shm_Ring, shm_name
+from pacer import Pacer
+from synthetic_imu import Synthetic_IMU
+
+# Default recording for each data mode that reads from a file
+DEFAULT_DATA_PATHS = {"csv": "sensor_data.csv", "binary": "sensor_data.imu"}
 
 def dataloader(csv_path):
     """
@@ -26,6 +34,60 @@ def dataloader(csv_path):
             data.append(tuple(map(float, values)))
     return data
 
+def pack_csv_rows(data):
+    """
+    Pack CSV rows into wire format frames up front, so the send loop only slices bytes.
+    Rows that fail to pack are logged and skipped.
+
+    Args:
+        data (list): Tuples from dataloader.
+    Returns:
+        numpy.ndarray: The frames back to back, as bytes.
+    """
+    frames = []
+    for t, xG, yG, zG, xA, yA, zA, xM, yM, zM in data:
+        try:
+            # Pack the data into the IMU class, converting units from the CSV to match the struct format provided
+            imu = IMU(
+                xAcc=xA*1000, yAcc=yA*1000, zAcc=zA*1000, timestampAcc=int(t*1000),
+                xGyro=int(xG*1000), yGyro=int(yG*1000), zGyro=int(zG*1000), timestampGyro=int(t*1000),
+                xMag=xM*10, yMag=yM*10, zMag=zM*10, timestampMag=int(t*1000)
+            )
+            frames.append(imu.pack())
+        except ValueError as e:
+            logging.error(f"IMU Error: {e}")
+    return np.frombuffer(b"".join(frames), dtype=np.uint8)
+
+def offer_wire_format(sock, args):
+    """
+    Offer the compact v2 wire format to the consumer, right after connecting.
+
+    Args:
+        sock: Connected socket.
+        args: Parsed publisher arguments.
+    Returns:
+        Payload_IMU_V2: Codec to encode frames with, None to send STRUCT_FORMAT frames.
+    """
+    codec = Payload_IMU_V2(samples_per_frame=args.frame_samples)
+    sock.sendall(codec.hello())
+
+    # Wait for the consumer to accept or decline
+    sock.settimeout(5)
+    try:
+        version = unpack_accept(recv_exact(sock, ACCEPT.size))
+    finally:
+        sock.settimeout(None)
+    if version != WIRE_VERSION:
+        logging.warning("Consumer declined the v2 wire format, sending v1 frames")
+        return None
+    logging.info(f"Wire format v2 negotiated, up to {args.frame_samples} samples per frame")
+    return codec
+
+def log_rate(pacer):
+    """Log the achieved send rate against the target."""
+    stats = pacer.stats()
+    logging.info(f"Sent {stats['sent']} samples in {stats['elapsed']:.2f}s: {stats['achieved_hz']:.1f} Hz of {stats['target_hz']} Hz target ({stats['achieved_percent']:.1f}%), max lag {stats['max_lag_ms']:.2f}ms")
+
 
 if __name__ == "__main__":
     # Initalize argument parser and define the arguments
@@ -34,82 +96,121 @@ if __name__ == "__main__":
     parser.add_argument("--log-level", dest="log_level", type=str, default="INFO", choices=["INFO", "WARNING", "ERROR", "CRITICAL"])
     parser.add_argument("--frequency-hz", dest="freq_hz", type=int, default=500)
     parser.add_argument("--retries", dest="max_retries", type=int, default=5, help="number of successive retries before exiting")
-    parser.add_argument("--data-mode", dest="data_mode", type=str, default="random", choices=["csv", "random"], help="data mode to use")
+    parser.add_argument("--data-mode", dest="data_mode", type=str, default="random", choices=["csv", "binary", "random"], help="data mode to use")
+    parser.add_argument("--seed", dest="seed", type=int, default=None, help="seed of the synthetic motion in random data mode")
+    parser.add_argument("--transport", dest="transport", type=str, default="socket", choices=["socket", "shm"], help="send over the Unix socket, or through the consumer's shared memory ring")
+    parser.add_argument("--send-log", dest="send_log", type=str, default=None, help="save the monotonic send time [ns] of every sample to this .npy file, used by benchmark.py")
+    parser.add_argument("--data-path", dest="data_path", type=str, default=None, help="recording to send in csv or binary data mode, see recording.py to convert a CSV")
+    parser.add_argument("--wire-format", dest="wire_format", type=str, default="v1", choices=["v1", "v2"], help="send STRUCT_FORMAT frames, or offer the compact v2 format to the consumer (socket transport only)")
+    parser.add_argument("--frame-samples", dest="frame_samples", type=int, default=16, help="maximum number of samples per v2 frame")
+    parser.add_argument("--max-burst", dest="max_burst", type=int, default=1024, help="maximum number of frames sent in one call when samples are due together")
+    parser.add_argument("--tick-us", dest="tick_us", type=int, default=1000, help="minimum time between sends [us], rates above 1 / tick are sent in bursts")
+    parser.add_argument("--report-interval", dest="report_interval", type=float, default=5, help="seconds between achieved rate reports, 0 only reports at exit")
     args = parser.parse_args()
 
     # Set up logger, defining minimum logging level
     logging.basicConfig(level=args.log_level.upper())
     logging.info("Logger has been initialized")
 
-    # Determine sending frequency
-    sleep_interval = 1.0 / args.freq_hz
+    # Schedule sends against absolute deadlines at the sending frequency
+    pacer = Pacer(args.freq_hz, min_tick=args.tick_us / 1e6, max_burst=args.max_burst)
+    next_report = time.monotonic() + args.report_interval
 
     # Create the Unix Compatible Socket
     is_first_reconnect = True
     retries = 0
     count = 0
+    send_times = []
+    sock = None
 
     try:
-        # Load data from CSV file for faster processing
+        # Load data from CSV file and pack it for faster processing
+        data_path = args.data_path or DEFAULT_DATA_PATHS.get(args.data_mode)
         if args.data_mode == "csv":
-            data = dataloader("sensor_data.csv")
+            frames = pack_csv_rows(dataloader(data_path))
+
+        # Memory-map a binary recording, records are already packed so nothing is parsed up front
+        elif args.data_mode == "binary":
+            frames = open_recording(data_path).view(np.uint8).reshape(-1)
+
+        # Either way, bursts of frames are sent as slices of the packed bytes
+        if args.data_mode in ("csv", "binary"):
+            n_frames = len(frames) // STRUCT_SIZE
+
+        # Simulate one sensor moving smoothly, generated ahead in blocks so each burst is a slice of records
+        elif args.data_mode == "random":
+            synthetic = Synthetic_IMU(rate_hz=args.freq_hz, seed=args.seed)
 
     # Retry loop for socket connection
         while retries <= args.max_retries:
+            sock = None # nothing to close if connecting fails
             try:
 
-                # Connect to the socket
-                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-                sock.connect(args.socket_path)
+                # Connect to the socket, or attach to the shared memory ring which is sent to the same way
+                if args.transport == "shm":
+                    sock = Shm_Ring.attach(shm_name(args.socket_path))
+                else:
+                    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    sock.connect(args.socket_path)
+
+                # Negotiate the compact wire format if asked, the shared memory ring only holds v1 frames
+                codec = None
+                if args.wire_format == "v2":
+                    if args.transport == "shm":
+                        logging.warning("The v2 wire format is only used over the socket, sending v1 frames")
+                    else:
+                        codec = offer_wire_format(sock, args)
                 is_first_reconnect = True
                 retries = 0
+                pacer.restart() # do not try to catch up on the time spent disconnected
                 logging.info("Socket connected successfully")
 
                 # Main loop to send data to the consumer
                 while True:
                     try:
-                        if args.data_mode == "csv":
-                            # Simulate data from the CSV file
-                            if count < len(data):
-                                t, xG, yG, zG, xA, yA, zA, xM, yM, zM = data[count]
-
-                                # Pack the data into the IMU class, converting units from the CSV to match the struct format provided
-                                imu = IMU(
-                                    xAcc=xA*1000, yAcc=yA*1000, zAcc=zA*1000, timestampAcc=int(t*1000),
-                                    xGyro=int(xG*1000), yGyro=int(yG*1000), zGyro=int(zG*1000), timestampGyro=int(t*1000),
-                                    xMag=xM*10, yMag=yM*10, zMag=zM*10, timestampMag=int(t*1000)
-                                )
-                                count += 1
+                        # Wait for the next deadline, then send every sample that is due in one call
+                        due = pacer.wait()
+
+                        if args.data_mode in ("csv", "binary"):
+                            # Simulate data from the recording, frames are already in the wire format so send them as-is
+                            if count < n_frames:
+                                due = min(due, n_frames - count)
+                                packed = frames[count * STRUCT_SIZE:(count + due) * STRUCT_SIZE]
+                                count += due
                             else:
                                 logging.info("End of data")
                                 break # End of data, break the loop
 
                         elif args.data_mode == "random":
-                            curr_time = int(time.time() * 1000) # Current time in milliseconds
-
-                            # Generate random data for the IMU class, with somewhat realistic ranges based on the CSV file
-                            imu = IMU(
-                                xAcc=random.uniform(-1000,1000), yAcc=random.uniform(-1000,1000), zAcc=random.uniform(-1000,1000), timestampAcc=curr_time,
-                                xGyro=random.randint(-135000, 135000), yGyro=random.randint(-135000, 135000), zGyro=random.randint(-135000, 135000), timestampGyro=curr_time,
-                                xMag=random.uniform(-250, 250), yMag=random.uniform(-250, 250), zMag=random.uniform(-450, -320), timestampMag=curr_time
-                            )
-                        sock.sendall(imu.pack())
-                        time.sleep(sleep_interval)
+                            packed = synthetic.frames(due)[0].tobytes()
+                        if codec is not None:
+                            packed = codec.encode(unpack_batch(packed)) # re-encode the burst as v2 frames
+                        sent = time.monotonic_ns() # taken before the send, the consumer can receive the frames before sendall returns
+                        sock.sendall(packed)
+                        pacer.record(due)
+                        if args.send_log:
+                            send_times.extend([sent] * due) # only recorded once the send succeeded
+
+                        # Report the achieved rate periodically
+                        if args.report_interval > 0 and time.monotonic() >= next_report:
+                            log_rate(pacer)
+                            next_report += args.report_interval
 
                     # If there is an issue with recieved data, log the error and continue
                     except ValueError as e:
                         logging.error(f"IMU Error: {e}")
                 
-                # If the data mode is CSV, check if all data has been sent and if so, exit
-                if args.data_mode == "csv":
-                    if count >= len(data):
+                # If the data mode reads a recording, check if all data has been sent and if so, exit
+                if args.data_mode in ("csv", "binary"):
+                    if count >= n_frames:
                         logging.info("All data sent, exiting...")
                         break
             
             # If communication breaks, log the error and attempt to reconnect
             except socket.error as e:
                 logging.error(f"Socket error: {e}")
-                sock.close()
+                if sock is not None:
+                    sock.close()
                 if retries < args.max_retries:
                     if is_first_reconnect:
                         logging.info("Attempting to reconnect to socket...")
@@ -123,17 +224,26 @@ if __name__ == "__main__":
             logging.critical("Max retries reached. Exiting...")
 
         # Close the socket
-        sock.close() 
-        logging.info("Socket successfully closed")
+        if sock is not None:
+            sock.close() 
+            logging.info("Socket successfully closed")
 
     except KeyboardInterrupt:
         print()
         logging.critical("Keyboard interrupt detected, forcing exiting")
         
         # Close the socket
-        sock.close() 
-        logging.info("Socket successfully closed")
+        if sock is not None:
+            sock.close() 
+            logging.info("Socket successfully closed")
 
     except Exception as e:
         logging.critical(f"An unexpected error occurred: {e}")
-    
\ No newline at end of file
+    
+
+    # Report the achieved rate against the target
+    log_rate(pacer)
+
+    # Save the send times for latency measurements
+    if args.send_log:
+        np.save(args.send_log, np.array(send_times, dtype=np.int64))
@@ -0,0 +1,187 @@
+import argparse
+import itertools
+import logging
+import struct
+import numpy as np
+from payload_imu_class import STRUCT_DTYPE, STRUCT_FORMAT, STRUCT_SIZE
+
+# Binary recording: a fixed header followed by packed Payload_IMU records (STRUCT_FORMAT, back to back)
+RECORDING_MAGIC = b"IMUREC\x00\x00"
+RECORDING_VERSION = 1
+HEADER_FORMAT = "<8sIIQ32s8x"   # magic, version, record size, record count, record format
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+def csv_rows_to_records(data):
+    """
+    Convert rows of CSV values to IMU records.
+    Units are converted the same way the publisher converts them before sending,
+    so the records match what the consumer receives over the socket.
+
+    Args:
+        data (numpy.ndarray): Rows of (time [s], gyro [deg/s], accel [g], mag [uT]), shape (N, 10).
+
+    Returns:
+        numpy.ndarray: Structured array of STRUCT_DTYPE records, one per row.
+    """
+    t, gyro, accel, mag = data[:, 0], data[:, 1:4], data[:, 4:7], data[:, 7:10]
+
+    records = np.empty(len(data), dtype=STRUCT_DTYPE)
+    timestamp = (t * 1000).astype(np.uint64)                            # [s] to [ms], truncated like int()
+    for i, axis in enumerate("xyz"):
+        records[f"{axis}Acc"] = accel[:, i] * 1000                      # [g] to [mg]
+        records[f"{axis}Gyro"] = (gyro[:, i] * 1000).astype(np.int32)   # [deg/s] to [mDeg/s], truncated like int()
+        records[f"{axis}Mag"] = mag[:, i] * 10                          # [uT] to [mGauss]
+    records["timestampAcc"] = timestamp
+    records["timestampGyro"] = timestamp
+    records["timestampMag"] = timestamp
+    return records
+
+def load_csv(csv_path):
+    """
+    Load a CSV recording as a structured array of IMU records, in one vectorized pass.
+
+    Args:
+        csv_path (str): Path to the CSV file (time [s], gyro [deg/s], accel [g], mag [uT]).
+
+    Returns:
+        numpy.ndarray: Structured array of STRUCT_DTYPE records, one per row.
+    """
+    return csv_rows_to_records(np.loadtxt(csv_path, delimiter=",", skiprows=1, ndmin=2))
+
+def convert_csv(csv_path, recording_path, chunk_rows=1_000_000):
+    """
+    Convert a CSV recording to a binary recording, a chunk at a time so memory stays flat.
+
+    Args:
+        csv_path (str): Path to the CSV file.
+        recording_path (str): Path of the binary recording to write.
+        chunk_rows (int): Number of CSV rows parsed per chunk.
+
+    Returns:
+        int: Number of records written.
+    """
+    count = 0
+    with open(csv_path, "r") as f_in, open(recording_path, "wb") as f_out:
+        f_out.write(pack_header(0)) # placeholder, the count is written once all records are in
+        next(f_in) # Skip the header line
+        while True:
+            lines = list(itertools.islice(f_in, chunk_rows))
+            if not lines:
+                break
+            records = csv_rows_to_records(np.loadtxt(lines, delimiter=",", ndmin=2))
+            f_out.write(records.tobytes())
+            count += len(records)
+        f_out.seek(0)
+        f_out.write(pack_header(count))
+    return count
+
+def write_recording(recording_path, records):
+    """
+    Write IMU records to a binary recording.
+
+    Args:
+        recording_path (str): Path of the binary recording to write.
+        records (numpy.ndarray): Structured array of STRUCT_DTYPE records.
+    """
+    with open(recording_path, "wb") as f:
+        f.write(pack_header(len(records)))
+        f.write(np.ascontiguousarray(records, dtype=STRUCT_DTYPE).tobytes())
+
+def pack_header(count):
+    """Pack the binary recording header for a given number of records."""
+    return struct.pack(HEADER_FORMAT, RECORDING_MAGIC, RECORDING_VERSION, STRUCT_SIZE, count, STRUCT_FORMAT.encode())
+
+def is_recording(path):
+    """Check whether a file is a binary recording by its magic bytes."""
+    with open(path, "rb") as f:
+        return f.read(len(RECORDING_MAGIC)) == RECORDING_MAGIC
+
+def read_header(recording_path):
+    """
+    Read and check the header of a binary recording.
+
+    Args:
+        recording_path (str): Path to the binary recording.
+
+    Returns:
+        int: Number of records declared in the header.
+    """
+    with open(recording_path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) != HEADER_SIZE:
+        raise ValueError(f"Recording header is truncated: {recording_path}")
+
+    magic, version, record_size, count, record_format = struct.unpack(HEADER_FORMAT, header)
+    record_format = record_format.rstrip(b"\x00").decode()
+    if magic != RECORDING_MAGIC:
+        raise ValueError(f"Not a binary recording: {recording_path}")
+    if version != RECORDING_VERSION or record_size != STRUCT_SIZE or record_format != STRUCT_FORMAT:
+        raise ValueError(f"Unsupported recording: version {version}, record size {record_size}, format {record_format}")
+    return count
+
+def open_recording(recording_path, count=None):
+    """
+    Open a binary recording as a read-only memory map of IMU records.
+    Nothing is parsed up front, so startup cost is constant and pages are only loaded as records are read.
+
+    Args:
+        recording_path (str): Path to the binary recording.
+        count (int): Number of records to map, None uses the count in the header.
+
+    Returns:
+        numpy.memmap: Structured array of STRUCT_DTYPE records backed by the file.
+    """
+    if count is None:
+        count = read_header(recording_path)
+    else:
+        read_header(recording_path) # still check the header
+    if count == 0:
+        return np.empty(0, dtype=STRUCT_DTYPE)
+    return np.memmap(recording_path, dtype=STRUCT_DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,))
+
+def load_recording(path):
+    """
+    Load a recording as IMU records, memory-mapping binary recordings and parsing anything else as CSV.
+
+    Args:
+        path (str): Path to a binary or CSV recording.
+
+    Returns:
+        numpy.ndarray: Structured array of STRUCT_DTYPE records.
+    """
+    return open_recording(path) if is_recording(path) else load_csv(path)
+
+def records_to_arrays(records, prev_timestamp=None):
+    """
+    Split IMU records into the arrays used for fusion, with the same dt rule as the consumer.
+
+    Args:
+        records (numpy.ndarray): Structured array of STRUCT_DTYPE records.
+        prev_timestamp (int): Gyro timestamp of the sample before these records [ms], None if they start the stream.
+
+    Returns:
+        Tuple of (accel (N, 3), gyro (N, 3), mag (N, 3), dt (N,)), dt in seconds with the first dt of a stream being 0.
+    """
+    accel = np.column_stack((records["xAcc"], records["yAcc"], records["zAcc"])).astype(np.float64)
+    gyro = np.column_stack((records["xGyro"], records["yGyro"], records["zGyro"])).astype(np.float64)
+    mag = np.column_stack((records["xMag"], records["yMag"], records["zMag"])).astype(np.float64)
+    timestamps = records["timestampGyro"].astype(np.int64)
+    prepend = timestamps[:1] if prev_timestamp is None else [prev_timestamp]
+    dt = np.diff(timestamps, prepend=prepend) / 1000
+    return accel, gyro, mag, dt
+
+
+if __name__ == "__main__":
+    # Initalize argument parser and define the arguments
+    parser = argparse.ArgumentParser(description="Convert a CSV recording to a binary recording")
+    parser.add_argument("--input", dest="input_path", type=str, default="sensor_data.csv", help="CSV recording to convert")
+    parser.add_argument("--output", dest="output_path", type=str, default="sensor_data.imu", help="binary recording to write")
+    parser.add_argument("--chunk-rows", dest="chunk_rows", type=int, default=1_000_000, help="number of CSV rows parsed at a time")
+    parser.add_argument("--log-level", dest="log_level", type=str, default="INFO", choices=["INFO", "WARNING", "ERROR", "CRITICAL"])
+    args = parser.parse_args()
+
+    # Set up logger, defining minimum logging level
+    logging.basicConfig(level=args.log_level.upper())
+
+    count = convert_csv(args.input_path, args.output_path, args.chunk_rows)
+    logging.info(f"Wrote {count} records to {args.output_path}")
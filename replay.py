@@ -0,0 +1,114 @@
+import argparse
+import logging
+import socket
+import time
+import numpy as np
+from stream_recorder import Stream_Log
+from shm_ring import Shm_Ring, shm_name
+
+def replay(log, sock, start_ms=None, end_ms=None, speed=1.0, chunk=4096):
+    """
+    Send recorded frames back into the pipeline, paced by their gyro timestamps.
+    Backward timestamp jumps (a publisher reconnecting mid-recording) are replayed without a pause.
+
+    Args:
+        log (Stream_Log): Log to replay.
+        sock: Connected socket or Shm_Ring to send the frames to.
+        start_ms (int): Gyro timestamp to seek to [ms], None starts at the beginning.
+        end_ms (int): Gyro timestamp to stop before [ms], None replays to the end.
+        speed (float): Replay speed, 1 is real time, 0 sends as fast as the consumer takes the frames.
+        chunk (int): Number of records read from the log at a time.
+
+    Returns:
+        int: Number of frames sent.
+    """
+    position = (0, 0) if start_ms is None else log.seek(start_ms)
+    sent = 0
+    wall_start = time.monotonic()
+    elapsed_ms = 0          # Recorded time replayed so far
+    prev_timestamp = None
+
+    for records in log.read(position, chunk):
+        timestamps = records["timestampGyro"].astype(np.int64)
+
+        # Stop before the first frame at or after the end timestamp
+        is_end = False
+        if end_ms is not None:
+            after_end = np.flatnonzero(timestamps >= end_ms)
+            if len(after_end):
+                records, timestamps = records[:after_end[0]], timestamps[:after_end[0]]
+                is_end = True
+                if len(records) == 0:
+                    break
+
+        if speed <= 0:
+            sock.sendall(records.tobytes())
+            sent += len(records)
+            if is_end:
+                break
+            continue
+
+        # Due time of each frame, in seconds since the start of the replay
+        steps = np.maximum(np.diff(timestamps, prepend=timestamps[0] if prev_timestamp is None else prev_timestamp), 0)
+        due_times = (elapsed_ms + np.cumsum(steps)) / 1000 / speed
+        elapsed_ms += int(steps.sum())
+        prev_timestamp = int(timestamps[-1])
+
+        # Send every frame that is due in one call, sleeping until the next one is
+        i = 0
+        while i < len(records):
+            now = time.monotonic() - wall_start
+            due = int(np.searchsorted(due_times, now, side="right"))
+            if due <= i:
+                time.sleep(due_times[i] - now)
+                continue
+            sock.sendall(records[i:due].tobytes())
+            sent += due - i
+            i = due
+        if is_end:
+            break
+    return sent
+
+
+if __name__ == "__main__":
+    # Initalize argument parser and define the arguments
+    parser = argparse.ArgumentParser(description="Replay a log recorded by the consumer's --record-dir into a consumer")
+    parser.add_argument("--log-dir", dest="log_dir", type=str, default="recordings", help="log directory written by the consumer")
+    parser.add_argument("--socket-path", dest="socket_path", type=str, default="/tmp/imu_sensor_socket", help="set socket path, match with consumer socket path")
+    parser.add_argument("--transport", dest="transport", type=str, default="socket", choices=["socket", "shm"], help="send over the Unix socket, or through the consumer's shared memory ring")
+    parser.add_argument("--start-ms", dest="start_ms", type=int, default=None, help="gyro timestamp to seek to [ms], default is the beginning of the log")
+    parser.add_argument("--end-ms", dest="end_ms", type=int, default=None, help="gyro timestamp to stop before [ms], default is the end of the log")
+    parser.add_argument("--speed", dest="speed", type=float, default=1.0, help="replay speed, 1 is real time, N is N times faster, 0 is as fast as possible")
+    parser.add_argument("--info", dest="info", action="store_true", help="print the segments of the log and exit")
+    parser.add_argument("--log-level", dest="log_level", type=str, default="INFO", choices=["INFO", "WARNING", "ERROR", "CRITICAL"])
+    args = parser.parse_args()
+
+    # Set up logger, defining minimum logging level
+    logging.basicConfig(level=args.log_level.upper())
+
+    log = Stream_Log(args.log_dir)
+    if args.info:
+        for segment in log.summary():
+            print(f"{segment['path']}: {segment['records']} records, {segment['first_ms']} to {segment['last_ms']} ms")
+        raise SystemExit
+
+    # Connect to the consumer like the publisher does
+    if args.transport == "shm":
+        sock = Shm_Ring.attach(shm_name(args.socket_path))
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(args.socket_path)
+    logging.info(f"Connected, replaying {len(log)} recorded frames at {'max' if args.speed <= 0 else args.speed}x speed")
+
+    start = time.monotonic()
+    try:
+        sent = replay(log, sock, args.start_ms, args.end_ms, args.speed)
+        logging.info(f"Replayed {sent} frames in {time.monotonic() - start:.2f}s")
+    except KeyboardInterrupt:
+        print()
+        logging.critical("Keyboard interrupt detected, forcing exiting")
+    except socket.error as e:
+        logging.error(f"Socket error: {e}")
+
+    sock.close()
+    logging.info("Socket successfully closed")
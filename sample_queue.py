@@ -0,0 +1,178 @@
+import threading
+import time
+from collections import deque
+from queue import Empty, Full
+
+# Policies applied by Sample_Queue.put when the queue is full
+QUEUE_POLICIES = ("block", "drop-oldest", "drop-newest", "coalesce")
+
+def coalesce_samples(older, newer):
+    """
+    Merge two [accel, gyro, mag, dt, timestamps] samples into one integrated gyro step.
+    - The gyro rate becomes the time-weighted mean, so the delta rotation (gyro * dt) is the sum of both steps.
+    - Accelerometer and magnetometer take the newest reading, with its timestamps.
+
+    Args:
+        older: The sample already in the queue.
+        newer: The sample being put.
+
+    Returns:
+        The merged sample.
+    """
+    accel, gyro, mag, dt, timestamps = newer
+    _, old_gyro, _, old_dt, _ = older
+    total_dt = old_dt + dt
+    if total_dt > 0:
+        gyro = [(old * old_dt + new * dt) / total_dt for old, new in zip(old_gyro, gyro)]
+    return [accel, gyro, mag, total_dt, timestamps]
+
+class Sample_Queue:
+    """
+    A bounded handoff between the receive loop and the processing thread.
+    When full, put() follows the policy:
+    - block: wait for space, pushing back on the receiver (and through the socket, the publisher)
+    - drop-oldest: discard the oldest queued sample to keep the freshest data
+    - drop-newest: discard the sample being put to keep the queued data
+    - coalesce: merge the sample being put into the newest queued one (see coalesce_samples)
+    Supports the queue.Queue calls used by the consumer, and counts depth, drops and staleness.
+    """
+
+    def __init__(self, maxsize=0, policy="block", coalesce=coalesce_samples):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown queue policy: {policy}, options: {QUEUE_POLICIES}")
+        self.maxsize = maxsize      # 0 means unbounded
+        self.policy = policy
+        self.coalesce = coalesce
+
+        self._items = deque()       # (enqueue time, sample) pairs
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+        # Counters
+        self.put_count = 0
+        self.get_count = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.last_staleness = 0.0   # [s] time the last sample spent in the queue
+        self.max_staleness = 0.0    # [s] worst time a sample spent in the queue
+
+    def qsize(self):
+        """Return the number of queued samples."""
+        with self._lock:
+            return len(self._items)
+
+    def put(self, item, timeout=None):
+        """
+        Put a sample, applying the policy if the queue is full.
+
+        Args:
+            item: The sample to queue.
+            timeout: Maximum time in seconds to wait for space with the block policy, None waits forever.
+
+        Returns:
+            bool: False if the sample was dropped, True otherwise.
+        """
+        with self._lock:
+            if self.maxsize > 0 and len(self._items) >= self.maxsize:
+                if self.policy == "block":
+                    if not self._not_full.wait_for(lambda: len(self._items) < self.maxsize, timeout):
+                        raise Full
+                elif self.policy == "drop-oldest":
+                    self._items.popleft()
+                    self.dropped += 1
+                elif self.policy == "drop-newest":
+                    self.dropped += 1
+                    return False
+                elif self.policy == "coalesce":
+                    # Keep the older enqueue time so staleness covers every merged sample
+                    enqueue_time, newest = self._items[-1]
+                    self._items[-1] = (enqueue_time, self.coalesce(newest, item))
+                    self.coalesced += 1
+                    return True
+
+            self._items.append((time.monotonic(), item))
+            self.put_count += 1
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._not_empty.notify()
+            return True
+
+    def put_many(self, items):
+        """
+        Put several samples in order, applying the policy to each.
+
+        Args:
+            items: The samples to queue.
+        """
+        for item in items:
+            self.put(item)
+
+    def get(self, timeout=None):
+        """
+        Get the oldest sample.
+
+        Args:
+            timeout: Maximum time in seconds to wait for a sample, None waits forever.
+
+        Returns:
+            The sample.
+
+        Raises:
+            queue.Empty: If no sample arrived within the timeout.
+        """
+        with self._lock:
+            if not self._not_empty.wait_for(lambda: self._items, timeout):
+                raise Empty
+            enqueue_time, item = self._items.popleft()
+            self._record_get(enqueue_time)
+            self._not_full.notify()
+            return item
+
+    def get_batch(self, max_items, timeout=None):
+        """
+        Get every queued sample, up to max_items, waiting only for the first.
+        Under light load this returns single samples as soon as they arrive, and after a burst it drains a whole block at once.
+
+        Args:
+            max_items: Maximum number of samples to return.
+            timeout: Maximum time in seconds to wait for a sample, None waits forever.
+
+        Returns:
+            list: The samples, oldest first.
+
+        Raises:
+            queue.Empty: If no sample arrived within the timeout.
+        """
+        with self._lock:
+            if not self._not_empty.wait_for(lambda: self._items, timeout):
+                raise Empty
+            entries = [self._items.popleft() for _ in range(min(max_items, len(self._items)))]
+            self._record_get(entries[0][0], len(entries)) # staleness of the oldest sample in the block
+            self._not_full.notify(len(entries))
+            return [item for _, item in entries]
+
+    def _record_get(self, enqueue_time, count=1):
+        """Update the counters for samples leaving the queue, called with the lock held."""
+        self.get_count += count
+        self.last_staleness = time.monotonic() - enqueue_time
+        self.max_staleness = max(self.max_staleness, self.last_staleness)
+
+    def stats(self):
+        """
+        Take a snapshot of the counters.
+
+        Returns:
+            dict: Queue depth, maximum depth, samples put and taken, drops, coalesced samples and staleness in milliseconds.
+        """
+        with self._lock:
+            return {
+                "depth": len(self._items),
+                "max_depth": self.max_depth,
+                "put": self.put_count,
+                "get": self.get_count,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+                "last_staleness_ms": self.last_staleness * 1000,
+                "max_staleness_ms": self.max_staleness * 1000,
+            }
@@ -1,6 +1,32 @@
-import quaternion
+import importlib.util
+import math
+import sys
 import numpy as np
 
+def lazy_import(name):
+    """
+    Import a module on its first attribute access instead of right away.
+
+    Args:
+        name (str): Module name.
+
+    Returns:
+        The module, loaded once it is first used.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+# numpy-quaternion pulls in scipy, which takes longer to import than the rest of the consumer, while the fast filters
+# only need it to hand out quaternion objects, so a headless consumer using them never loads it
+quaternion = lazy_import("quaternion")
+
 def gyro_to_delta_rot(newGyro, dt):
     """
     Convert gyroscope data to delta step rotation.
@@ -49,6 +75,35 @@ def acc_mag_to_euler(accel, mag):
 
     return [roll, pitch, yaw]
 
+def gyro_to_delta_rot_batch(gyro, dt):
+    """
+    Vectorized gyro_to_delta_rot over many samples.
+
+    Args:
+        gyro: Array of gyroscope data, shape (N, 3), (mDeg/s)
+        dt: Array of timesteps, shape (N,), (s)
+
+    Returns:
+        Array of delta rotations in radians, shape (N, 3).
+    """
+    gyro = np.asarray(gyro, dtype=np.float64)
+    return np.column_stack(gyro_to_delta_rot(gyro.T, np.asarray(dt, dtype=np.float64)))
+
+def acc_mag_to_euler_batch(accel, mag):
+    """
+    Vectorized acc_mag_to_euler over many samples.
+
+    Args:
+        accel: Array of accelerometer data, shape (N, 3), (mg)
+        mag: Array of magnetometer data, shape (N, 3), (mGauss)
+
+    Returns:
+        Array of roll, pitch, and yaw in radians, shape (N, 3).
+    """
+    accel = np.asarray(accel, dtype=np.float64)
+    mag = np.asarray(mag, dtype=np.float64)
+    return np.column_stack(acc_mag_to_euler(accel.T, mag.T))
+
 class Extended_Kalman_Filter:
     """
     A class to handle the Extended Kalman Filter for sensor fusion.
@@ -56,12 +111,12 @@ class Extended_Kalman_Filter:
     Orientation inputs are converted to quaternions before processing.
     """
 
-    def __init__(self, q):
-        self.q = q # Quaternion representing the state
+    def __init__(self, q, p0=0.1, process_noise=0.01, measurement_noise=0.1):
+        self.q = quaternion.from_float_array(quaternion_components(q)) # Quaternion representing the state
 
-        self.P = np.eye(4) * 0.1                # State Covariance Matrix
-        self.Q = np.eye(4) * 0.01               # Process Noise Covariance Matrix
-        self.R = np.eye(4) * 0.1                # Measurement Noise Covariance Matrix
+        self.P = np.eye(4) * p0                 # State Covariance Matrix
+        self.Q = np.eye(4) * process_noise      # Process Noise Covariance Matrix
+        self.R = np.eye(4) * measurement_noise  # Measurement Noise Covariance Matrix
 
     def predict(self, delta_gyro):
         """
@@ -113,3 +168,437 @@ class Extended_Kalman_Filter:
 
         # Update the state covariance matrix
         self.P = (np.eye(4) - K) @ self.P
+
+    @property
+    def q_array(self):
+        """State quaternion components (w, x, y, z) as a float64 array."""
+        return quaternion.as_float_array(self.q)
+
+    def filter_batch(self, delta_gyros, accel_mag_fusions, is_update=None):
+        """
+        Run predict for every sample in a block, each followed by an update if it has a measurement.
+
+        Args:
+            delta_gyros: Delta rotations, shape (N, 3), (rad)
+            accel_mag_fusions: Accelerometer and magnetometer Euler angles of the samples with an update, shape (M, 3), (rad)
+            is_update: Which samples have an update, shape (N,), None updates every sample (M = N).
+
+        Returns:
+            Array of the fused quaternion (w, x, y, z) after each sample, shape (N, 4).
+        """
+        fused = np.empty((len(delta_gyros), 4))
+        is_update = [True] * len(delta_gyros) if is_update is None else is_update
+        measurements = iter(accel_mag_fusions)
+        for i, (delta_gyro, has_update) in enumerate(zip(delta_gyros, is_update)):
+            self.predict(delta_gyro)
+            if has_update:
+                self.update(next(measurements))
+            fused[i] = quaternion.as_float_array(self.q)
+        return fused
+
+# Basis for the predict Jacobian, F = delta_gyro @ F_BASIS reshaped to 4x4 (the right-multiplication matrix of a pure quaternion)
+F_BASIS = 0.5 * np.array([
+    [[0, -1, 0, 0], [1, 0, 0, 0], [0, 0, 0, 1], [0, 0, -1, 0]],     # x component
+    [[0, 0, -1, 0], [0, 0, 0, -1], [1, 0, 0, 0], [0, 1, 0, 0]],     # y component
+    [[0, 0, 0, -1], [0, 0, 1, 0], [0, -1, 0, 0], [1, 0, 0, 0]],     # z component
+], dtype=np.float64).reshape(3, 16)
+
+def euler_to_quaternion_array(euler):
+    """
+    Closed form of quaternion.from_euler_angles (z-y-z convention), normalized, without creating a quaternion object.
+
+    Args:
+        euler: Euler angles (alpha, beta, gamma) in radians, as produced by acc_mag_to_euler.
+
+    Returns:
+        Tuple of the quaternion components (w, x, y, z).
+    """
+    alpha, beta, gamma = euler
+    cos_b, sin_b = math.cos(beta / 2), math.sin(beta / 2)
+    sum_ag, diff_ag = (alpha + gamma) / 2, (alpha - gamma) / 2
+    return (cos_b * math.cos(sum_ag), -sin_b * math.sin(diff_ag), sin_b * math.cos(diff_ag), cos_b * math.sin(sum_ag))
+
+def euler_to_quaternion_batch(euler):
+    """
+    Vectorized euler_to_quaternion_array over many samples.
+
+    Args:
+        euler: Array of Euler angles (alpha, beta, gamma), shape (N, 3), (rad)
+
+    Returns:
+        Array of quaternion components (w, x, y, z), shape (N, 4).
+    """
+    alpha, beta, gamma = np.asarray(euler, dtype=np.float64).T
+    cos_b, sin_b = np.cos(beta / 2), np.sin(beta / 2)
+    sum_ag, diff_ag = (alpha + gamma) / 2, (alpha - gamma) / 2
+    return np.column_stack((cos_b * np.cos(sum_ag), -sin_b * np.sin(diff_ag), sin_b * np.cos(diff_ag), cos_b * np.sin(sum_ag)))
+
+def quaternion_angle_batch(a, b):
+    """
+    Rotation angle between two series of unit quaternions, either sign of a quaternion being the same rotation.
+    Uses the chord |a - b| = 2 * sin(angle / 4), which stays accurate for tiny angles unlike arccos of the dot product.
+
+    Args:
+        a: Array of quaternion components (w, x, y, z), shape (N, 4).
+        b: Array of quaternion components (w, x, y, z), shape (N, 4).
+
+    Returns:
+        Array of angles in degrees, shape (N,).
+    """
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    sign = np.where(np.sum(a * b, axis=-1) < 0, -1.0, 1.0)[..., None]
+    chord = np.linalg.norm(a - sign * b, axis=-1)
+    return np.degrees(4 * np.arcsin(np.minimum(chord / 2, 1)))
+
+def quaternion_components(q):
+    """
+    Get the components of a quaternion without loading numpy-quaternion for plain sequences.
+
+    Args:
+        q: quaternion object, or a sequence of its components (w, x, y, z).
+
+    Returns:
+        Array of the components (w, x, y, z), shape (4,).
+    """
+    return np.array(getattr(q, "components", q), dtype=np.float64).reshape(4)
+
+def _scalar_of_identity(matrix):
+    """Return s if the matrix is exactly s * I, otherwise None."""
+    scale = float(matrix[0, 0])
+    return scale if np.array_equal(matrix, np.eye(4) * scale) else None
+
+def _rotate_quaternion(w, x, y, z, dx, dy, dz):
+    """Return q + 0.5 * (q * delta_gyro), renormalized, from the components of q and delta_gyro."""
+    w, x, y, z = (w + 0.5 * (-x * dx - y * dy - z * dz), x + 0.5 * (w * dx + y * dz - z * dy),
+                  y + 0.5 * (w * dy - x * dz + z * dx), z + 0.5 * (w * dz + x * dy - y * dx))
+    norm = math.sqrt(w * w + x * x + y * y + z * z)
+    return w / norm, x / norm, y / norm, z / norm
+
+class Fast_Extended_Kalman_Filter:
+    """
+    An allocation-free version of Extended_Kalman_Filter with the same public API.
+    The state and covariances live in preallocated float64 buffers updated in place,
+    and the Kalman Gain uses a linear solve instead of an explicit inverse.
+    - While P, Q and R are all scalar multiples of identity (the default), F @ P @ F.T keeps P a
+      scalar multiple of identity, so the recursion reduces to closed-form scalar updates.
+    - The fused quaternion matches Extended_Kalman_Filter to within 1e-9 per component.
+    """
+
+    def __init__(self, q, p0=0.1, process_noise=0.01, measurement_noise=0.1):
+        self._q = quaternion_components(q)     # State quaternion (w, x, y, z)
+
+        # Preallocated work buffers
+        self._F = np.empty(16)          # Jacobian of the state transition function, viewed as 4x4 below
+        self._F44 = self._F.reshape(4, 4)
+        self._tmp4 = np.empty(4)
+        self._tmp44 = np.empty((4, 4))
+        self._S = np.empty((4, 4))      # Innovation covariance
+        self._K = np.empty((4, 4))      # Kalman Gain
+
+        self._P = np.eye(4) * p0                    # State Covariance Matrix
+        self._Q = np.eye(4) * process_noise         # Process Noise Covariance Matrix
+        self._R = np.eye(4) * measurement_noise     # Measurement Noise Covariance Matrix
+        self._check_scalar()
+
+    def _check_scalar(self):
+        """Use the scalar recursion if every covariance is a scalar multiple of identity."""
+        self._p = _scalar_of_identity(self._P)
+        self._q_noise = _scalar_of_identity(self._Q)
+        self._r = _scalar_of_identity(self._R)
+        self._is_scalar = None not in (self._p, self._q_noise, self._r)
+
+    # Keep the public attributes of Extended_Kalman_Filter
+    @property
+    def q(self):
+        return quaternion.from_float_array(self._q)
+
+    @q.setter
+    def q(self, value):
+        self._q[:] = quaternion_components(value)
+
+    @property
+    def q_array(self):
+        """State quaternion components (w, x, y, z) as a float64 array."""
+        return self._q.copy()
+
+    def _sync_P(self):
+        """Write the scalar covariance back into the P buffer."""
+        if self._is_scalar:
+            self._P[:] = 0
+            self._P.flat[::5] = self._p
+
+    @property
+    def P(self):
+        self._sync_P()
+        return self._P
+
+    @P.setter
+    def P(self, value):
+        self._P = np.array(value, dtype=np.float64)
+        self._check_scalar()
+
+    @property
+    def Q(self):
+        return self._Q
+
+    @Q.setter
+    def Q(self, value):
+        self._sync_P() # keep P before possibly leaving the scalar recursion
+        self._Q = np.array(value, dtype=np.float64)
+        self._check_scalar()
+
+    @property
+    def R(self):
+        return self._R
+
+    @R.setter
+    def R(self, value):
+        self._sync_P()
+        self._R = np.array(value, dtype=np.float64)
+        self._check_scalar()
+
+    def predict(self, delta_gyro):
+        """
+        Predict the next state using the gyroscope data.
+        Update the State Covariance Matrix
+
+        Args:
+            delta_gyro: The change in gyroscope data (delta rotation).
+        """
+        if self._is_scalar:
+            dx, dy, dz = delta_gyro
+            self._q[0], self._q[1], self._q[2], self._q[3] = _rotate_quaternion(*self._q.tolist(), dx, dy, dz)
+
+            # F @ F.T = 0.25 * |delta_gyro|^2 * I, so F @ (p * I) @ F.T + Q stays scalar
+            self._p = 0.25 * (dx * dx + dy * dy + dz * dz) * self._p + self._q_noise
+            return
+
+        # Compute the Jacobian, which also applies the delta rotation: q * delta_gyro = F @ q
+        np.dot(np.asarray(delta_gyro, dtype=np.float64), F_BASIS, out=self._F)
+        np.matmul(self._F44, self._q, out=self._tmp4)
+        self._q += self._tmp4
+        self._q /= math.sqrt(self._q @ self._q)
+
+        # Update the state covariance matrix in place
+        np.matmul(self._F44, self._P, out=self._tmp44)
+        np.matmul(self._tmp44, self._F44.T, out=self._P)
+        self._P += self._Q
+
+    def update(self, accel_mag_fusion):
+        """
+        Update the state (and covariance matrix) with the accelerometer and magnetometer data.
+        - The measurement Jacobian is assumed to be identity.
+
+        Args:
+            accel_mag_fusion: The accelerometer and magnetometer data (roll, pitch, yaw).
+        """
+        self._update_quaternion(*euler_to_quaternion_array(accel_mag_fusion))
+
+    def _update_quaternion(self, mw, mx, my, mz):
+        """Update step with the measurement already converted to a normalized quaternion."""
+        if self._is_scalar:
+            # K = p / (p + r) * I, so the update is a blend of the two quaternions
+            gain = self._p / (self._p + self._r)
+            w, x, y, z = self._q.tolist()
+            w, x, y, z = w + gain * (mw - w), x + gain * (mx - x), y + gain * (my - y), z + gain * (mz - z)
+            norm = math.sqrt(w * w + x * x + y * y + z * z)
+            self._q[0], self._q[1], self._q[2], self._q[3] = w / norm, x / norm, y / norm, z / norm
+            self._p = (1 - gain) * self._p
+            return
+
+        # Compute the Kalman Gain K = P @ inv(P + R) as the solution of (P + R).T @ K.T = P.T
+        np.add(self._P, self._R, out=self._S)
+        self._K[:] = np.linalg.solve(self._S.T, self._P.T).T
+
+        # Update the state with the measurement and normalize
+        self._tmp4[0], self._tmp4[1], self._tmp4[2], self._tmp4[3] = mw, mx, my, mz
+        self._tmp4 -= self._q
+        self._q += self._K @ self._tmp4
+        self._q /= math.sqrt(self._q @ self._q)
+
+        # Update the state covariance matrix, (I - K) @ P = P - K @ P
+        np.matmul(self._K, self._P, out=self._tmp44)
+        self._P -= self._tmp44
+
+    def filter_batch(self, delta_gyros, accel_mag_fusions, is_update=None):
+        """
+        Run predict for every sample in a block, each followed by an update if it has a measurement,
+        with the same result as calling them one sample at a time.
+        - Measurement quaternions are computed for the whole block at once.
+        - The scalar recursion runs in a tight loop on local floats.
+
+        Args:
+            delta_gyros: Delta rotations, shape (N, 3), (rad)
+            accel_mag_fusions: Accelerometer and magnetometer Euler angles of the samples with an update, shape (M, 3), (rad)
+            is_update: Which samples have an update, shape (N,), None updates every sample (M = N).
+
+        Returns:
+            Array of the fused quaternion (w, x, y, z) after each sample, shape (N, 4).
+        """
+        measurements = iter(euler_to_quaternion_batch(np.reshape(accel_mag_fusions, (-1, 3))).tolist())
+        delta_gyros = np.asarray(delta_gyros, dtype=np.float64).reshape(-1, 3).tolist()
+        is_update = [True] * len(delta_gyros) if is_update is None else np.asarray(is_update, dtype=bool).tolist()
+
+        if not self._is_scalar:
+            fused = np.empty((len(delta_gyros), 4))
+            for i, (delta_gyro, has_update) in enumerate(zip(delta_gyros, is_update)):
+                self.predict(delta_gyro)
+                if has_update:
+                    self._update_quaternion(*next(measurements))
+                fused[i] = self._q
+            return fused
+
+        # Same operations as the scalar paths of predict and update
+        fused = []
+        w, x, y, z = self._q.tolist()
+        p, q_noise, r = self._p, self._q_noise, self._r
+        for (dx, dy, dz), has_update in zip(delta_gyros, is_update):
+            w, x, y, z = _rotate_quaternion(w, x, y, z, dx, dy, dz)
+            p = 0.25 * (dx * dx + dy * dy + dz * dz) * p + q_noise
+
+            if has_update:
+                mw, mx, my, mz = next(measurements)
+                gain = p / (p + r)
+                w, x, y, z = w + gain * (mw - w), x + gain * (mx - x), y + gain * (my - y), z + gain * (mz - z)
+                norm = math.sqrt(w * w + x * x + y * y + z * z)
+                w, x, y, z = w / norm, x / norm, y / norm, z / norm
+                p = (1 - gain) * p
+            fused.append((w, x, y, z))
+
+        self._q[0], self._q[1], self._q[2], self._q[3] = w, x, y, z
+        self._p = p
+        return np.array(fused, dtype=np.float64).reshape(-1, 4)
+
+class Steady_State_Kalman_Filter(Fast_Extended_Kalman_Filter):
+    """
+    Fast_Extended_Kalman_Filter with an opt-in steady-state gain for non-scalar covariances.
+    With constant Q and R and a near-constant F, P and the Kalman Gain settle within a few hundred steps.
+    Once P changes by less than tolerance (relative) for settle_steps consecutive updates, the gain is frozen
+    and each step only rotates and blends the quaternion, skipping covariance propagation and the gain solve.
+    - While P, Q and R are all scalar multiples of identity, the scalar recursion of Fast_Extended_Kalman_Filter
+      already costs about as much as a frozen step, so the filter runs it unchanged and never freezes.
+    - F @ P @ F.T scales with |delta_gyro|^2, so a frozen gain is only valid near the delta rotation it
+      was frozen at. If |delta_gyro|^2 moves far enough from it to change the predicted P by more than
+      tolerance (a new gyro rate or dt), the filter falls back to full propagation until P settles again.
+    - The gain is also only valid for the number of predicts between updates it was frozen at (the cadence),
+      so an update arriving early or late falls back too. P is restored from the frozen cycle, so full
+      propagation continues from where the skipped steps would have left it.
+    - Changing P, Q or R also falls back, continuing from the current P.
+    """
+
+    def __init__(self, q, p0=0.1, process_noise=0.01, measurement_noise=0.1, tolerance=1e-6, settle_steps=10, max_cadence=64):
+        super().__init__(q, p0, process_noise, measurement_noise)
+        self.tolerance = tolerance          # Relative change of P below which it counts as settled
+        self.settle_steps = settle_steps    # Consecutive settled updates before the gain is frozen
+        self.max_cadence = max_cadence      # Most predicts between updates that the gain can be frozen for
+
+        self.is_frozen = False
+        self._settled = 0                   # Consecutive settled updates so far
+        self._last_P = None                 # Posterior covariance after the previous update
+        self._cycle = []                    # Prior covariance after each predict since the last update
+        self._cadence = None                # Predicts between the last two updates
+        self._frozen_cycle = []             # _cycle of the update the gain was frozen at
+        self._step = 0                      # Predicts since the last update while frozen
+        self._gyro_sq = 0.0                 # |delta_gyro|^2 of the last full predict
+        self._max_gyro_change = 0.0         # Largest change of |delta_gyro|^2 the frozen gain tolerates
+        self._gain = None                   # Frozen gain, as a 4x4 list
+
+        # Update counts, for reporting
+        self.full_steps = 0
+        self.frozen_steps = 0
+        self.fallbacks = 0
+
+    def _check_scalar(self):
+        """Leave the steady state whenever a covariance changes."""
+        super()._check_scalar()
+        self._unfreeze(restore=False)
+
+    def _unfreeze(self, restore=True):
+        """Go back to full propagation, restoring P to where the predicts skipped in this cycle would have left it."""
+        if getattr(self, "is_frozen", False):
+            self.fallbacks += 1
+            if restore and self._step:
+                self._P[:] = self._frozen_cycle[self._step - 1]
+            self._cycle = self._frozen_cycle[:self._step]
+        self.is_frozen = False
+        self._settled = 0
+        self._last_P = None
+
+    def predict(self, delta_gyro):
+        """
+        Predict the next state using the gyroscope data.
+        While frozen, only the quaternion is propagated.
+
+        Args:
+            delta_gyro: The change in gyroscope data (delta rotation).
+        """
+        if self._is_scalar:
+            super().predict(delta_gyro)
+            return
+
+        dx, dy, dz = delta_gyro
+        gyro_sq = dx * dx + dy * dy + dz * dz
+        if self.is_frozen:
+            if self._step < self._cadence and abs(gyro_sq - self._gyro_sq) <= self._max_gyro_change:
+                self._q[0], self._q[1], self._q[2], self._q[3] = _rotate_quaternion(*self._q.tolist(), dx, dy, dz)
+                self._step += 1
+                return
+            self._unfreeze()
+        self._gyro_sq = gyro_sq
+        super().predict(delta_gyro)
+        if len(self._cycle) <= self.max_cadence:
+            self._cycle.append(self._P.copy())
+
+    def _update_quaternion(self, mw, mx, my, mz):
+        """Update step with a fixed gain once frozen, otherwise a full update followed by the convergence check."""
+        if self._is_scalar:
+            super()._update_quaternion(mw, mx, my, mz)
+            return
+
+        if self.is_frozen:
+            if self._step == self._cadence:
+                self._q[:] = self._blend(self._q.tolist(), (mw, mx, my, mz), self._gain)
+                self._step = 0
+                self.frozen_steps += 1
+                return
+            self._unfreeze()
+
+        # The predicted P is needed to freeze the gain that was just applied
+        p_predicted = self._P.copy()
+        super()._update_quaternion(mw, mx, my, mz)
+        self.full_steps += 1
+        self._check_convergence(p_predicted)
+
+    def _check_convergence(self, p_predicted):
+        """Count settled updates and freeze the gain after settle_steps of them."""
+        p, scale, predicted_scale = self._P.copy(), np.abs(self._P).max(), np.abs(p_predicted).max()
+
+        # Settled means the same cadence as the previous cycle and almost the same posterior P
+        cadence = len(self._cycle)
+        is_settled = (self._last_P is not None and cadence == self._cadence and cadence <= self.max_cadence
+                      and np.abs(p - self._last_P).max() <= self.tolerance * scale)
+        self._settled = self._settled + 1 if is_settled else 0
+        self._last_P = p
+        self._cadence, self._frozen_cycle, self._cycle = cadence, self._cycle, []
+        if self._settled < self.settle_steps:
+            return
+
+        # Freeze the gain of the last update, and the range of |delta_gyro|^2 over which the
+        # predicted P = F @ P @ F.T + Q, with |F @ P @ F.T| <= 0.25 * |delta_gyro|^2 * |P|, stays within tolerance
+        self._gain = self._K.tolist()
+        self._max_gyro_change = self.tolerance * predicted_scale / (0.25 * scale) if scale > 0 else math.inf
+        self._step = 0
+        self.is_frozen = True
+
+    @staticmethod
+    def _blend(q, measurement, gain):
+        """q + K @ (measurement - q), renormalized, with K a 4x4 list."""
+        w, x, y, z = q
+        ew, ex, ey, ez = measurement[0] - w, measurement[1] - x, measurement[2] - y, measurement[3] - z
+        k0, k1, k2, k3 = gain
+        w += k0[0] * ew + k0[1] * ex + k0[2] * ey + k0[3] * ez
+        x += k1[0] * ew + k1[1] * ex + k1[2] * ey + k1[3] * ez
+        y += k2[0] * ew + k2[1] * ex + k2[2] * ey + k2[3] * ez
+        z += k3[0] * ew + k3[1] * ex + k3[2] * ey + k3[3] * ez
+        norm = math.sqrt(w * w + x * x + y * y + z * z)
+        return w / norm, x / norm, y / norm, z / norm
@@ -0,0 +1,215 @@
+import platform
+import time
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from payload_imu_class import STRUCT_SIZE, STRUCT_DTYPE
+
+# Ring header, one uint64 per field, followed by the frame slots
+HEAD, TAIL, CAPACITY, SLOT_SIZE, WRITER_STATE, READER_CLOSED = range(6)
+HEADER_SIZE = 64
+
+# Writer states
+WRITER_WAITING, WRITER_CONNECTED, WRITER_DISCONNECTED = range(3)
+
+# Rings publish data by storing the slots, then the index the reader polls, and Python has no memory barriers to
+# order the two. x86 keeps stores (and loads) in program order, so a reader never sees an index ahead of its slots,
+# but weakly ordered CPUs such as ARM can make the index visible first, so shared memory rings are only supported on x86.
+X86_MACHINES = ("x86_64", "amd64", "i386", "i486", "i586", "i686", "x86")
+
+def check_store_order():
+    """
+    Check that this CPU keeps stores in program order, as the shared memory rings rely on.
+
+    Raises:
+        RuntimeError: If the CPU is not x86.
+    """
+    machine = platform.machine()
+    if machine.lower() not in X86_MACHINES:
+        raise RuntimeError(f"Shared memory rings are only supported on x86, not {machine}, use the socket transport instead")
+
+def shm_name(socket_path):
+    """Derive the shared memory name from the socket path, so both sides only need the same --socket-path."""
+    return socket_path.strip("/").replace("/", "_")
+
+def _attach(name):
+    """Attach to existing shared memory without letting this process's resource tracker unlink it on exit."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 always tracks, so unregister by hand
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+class Shm_Ring:
+    """
+    A single-producer, single-consumer ring of fixed-size Payload_IMU frames in shared memory.
+    The writer only advances the head sequence and the reader only advances the tail sequence,
+    each after its frames are copied in or consumed, so no lock is needed between the two processes.
+    - The consumer creates the ring (like binding the socket) and the publisher attaches to it.
+    - When the ring is empty or full, the waiting side polls with a short sleep.
+    """
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner      # The creator unlinks the ring when closed
+        self.header = np.ndarray((HEADER_SIZE // 8,), dtype=np.uint64, buffer=shm.buf)
+        self.capacity = int(self.header[CAPACITY])
+        self.slots = np.ndarray((self.capacity,), dtype=STRUCT_DTYPE, buffer=shm.buf, offset=HEADER_SIZE)
+        self.raw = self.slots.view(np.uint8).reshape(self.capacity, STRUCT_SIZE)
+
+    @classmethod
+    def create(cls, name, capacity=4096):
+        """
+        Create a ring, replacing any ring left behind under the same name.
+
+        Args:
+            name (str): Shared memory name.
+            capacity (int): Number of frame slots.
+
+        Returns:
+            Shm_Ring: The ring, owned by the caller.
+
+        Raises:
+            RuntimeError: If the CPU can reorder stores, see check_store_order().
+        """
+        check_store_order()
+        try:
+            stale = _attach(name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + capacity * STRUCT_SIZE)
+        header = np.ndarray((HEADER_SIZE // 8,), dtype=np.uint64, buffer=shm.buf)
+        header[:] = 0
+        header[CAPACITY] = capacity
+        header[SLOT_SIZE] = STRUCT_SIZE
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Attach to a ring created by the other process as its writer.
+
+        Args:
+            name (str): Shared memory name.
+
+        Returns:
+            Shm_Ring: The ring.
+
+        Raises:
+            FileNotFoundError: If no ring exists under the name.
+            ConnectionRefusedError: If the ring is closed or its slot size does not match STRUCT_SIZE.
+        """
+        ring = cls(_attach(name), owner=False)
+        if ring.header[SLOT_SIZE] != STRUCT_SIZE or ring.header[READER_CLOSED]:
+            ring.close()
+            raise ConnectionRefusedError(f"Shared memory ring {name} is closed or has a different frame size")
+        ring.header[WRITER_STATE] = WRITER_CONNECTED
+        return ring
+
+    @property
+    def writer_state(self):
+        return int(self.header[WRITER_STATE])
+
+    def wait_for_writer(self, timeout=None, poll_interval=0.01):
+        """
+        Wait for a publisher to attach, like accepting a socket connection.
+
+        Args:
+            timeout (float): Maximum time in seconds to wait, None waits forever.
+            poll_interval (float): Sleep between checks.
+
+        Returns:
+            bool: True if a writer is connected, False if the timeout passed first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.writer_state != WRITER_CONNECTED:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(poll_interval)
+        return True
+
+    def sendall(self, data, timeout=None, poll_interval=0.0001):
+        """
+        Write whole frames, waiting for space while the ring is full.
+        Mirrors socket.sendall so the publisher's send loop works unchanged.
+
+        Args:
+            data (bytes): One or more packed frames.
+            timeout (float): Maximum time in seconds to wait for space, None waits forever.
+            poll_interval (float): Sleep between checks while the ring is full.
+
+        Raises:
+            BrokenPipeError: If the reader has closed the ring.
+            TimeoutError: If there was no space within the timeout.
+        """
+        frames = np.frombuffer(data, dtype=np.uint8).reshape(-1, STRUCT_SIZE)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        written = 0
+        while written < len(frames):
+            if self.header[READER_CLOSED]:
+                raise BrokenPipeError("Shared memory ring was closed by the reader")
+
+            head = int(self.header[HEAD])
+            space = self.capacity - (head - int(self.header[TAIL]))
+            if space == 0:
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError("Shared memory ring is full")
+                time.sleep(poll_interval)
+                continue
+
+            # Copy up to the end of the slots, then publish the new head, which relies on x86 store order
+            start = head % self.capacity
+            count = min(space, len(frames) - written, self.capacity - start)
+            self.raw[start:start + count] = frames[written:written + count]
+            self.header[HEAD] = head + count
+            written += count
+
+    def read(self, max_frames=None, timeout=None, poll_interval=0.0001):
+        """
+        Get a zero-copy view of the frames available to read, waiting while the ring is empty.
+        The frames stay valid until release() is called.
+
+        Args:
+            max_frames (int): Maximum number of frames to return, None returns all contiguous frames.
+            timeout (float): Maximum time in seconds to wait for frames, None waits forever.
+            poll_interval (float): Sleep between checks while the ring is empty.
+
+        Returns:
+            numpy.ndarray: Structured array view of STRUCT_DTYPE frames, empty if the timeout passed first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            tail = int(self.header[TAIL])
+            available = int(self.header[HEAD]) - tail
+            if available > 0:
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                return self.slots[:0]
+            time.sleep(poll_interval)
+
+        # Frames are contiguous up to the end of the slots
+        start = tail % self.capacity
+        count = min(available, self.capacity - start)
+        if max_frames is not None:
+            count = min(count, max_frames)
+        return self.slots[start:start + count]
+
+    def release(self, count):
+        """Hand the oldest count frames back to the writer, after they have been consumed."""
+        self.header[TAIL] = int(self.header[TAIL]) + count
+
+    def close(self):
+        """Close the ring, the owner also marks it closed for the writer and removes it. Closing again does nothing."""
+        if self.raw is None:
+            return
+        if self.owner:
+            self.header[READER_CLOSED] = 1
+        else:
+            self.header[WRITER_STATE] = WRITER_DISCONNECTED
+        self.header = self.slots = self.raw = None # release the views before closing the memory
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,191 @@
+import numpy as np
+from recording import records_to_arrays
+from sensor_processing import Fast_Extended_Kalman_Filter, gyro_to_delta_rot, gyro_to_delta_rot_batch, acc_mag_to_euler, acc_mag_to_euler_batch, euler_to_quaternion_array
+
+class Update_Scheduler:
+    """
+    A class to schedule the measurement updates of a multi-rate IMU stream.
+    Every sample carries a gyro reading, so predict runs for every sample, but the accelerometer and
+    magnetometer can run slower and repeat their last reading. A sample is only due an update when its
+    accelerometer or magnetometer timestamp differs from the previous sample's, and with a decimation of N
+    only every Nth fresh reading is used. The first sample of a stream is always due.
+    """
+
+    def __init__(self, decimation=1):
+        self.decimation = decimation
+        self.last_timestamps = None     # (timestampAcc, timestampMag) of the previous sample
+        self.fresh = 0                  # Number of fresh readings so far
+
+    def is_due(self, timestamp_acc, timestamp_mag):
+        """
+        Schedule one sample.
+
+        Args:
+            timestamp_acc: Accelerometer timestamp of the sample [ms].
+            timestamp_mag: Magnetometer timestamp of the sample [ms].
+
+        Returns:
+            bool: Whether the sample is due an update.
+        """
+        timestamps = (timestamp_acc, timestamp_mag)
+        is_fresh = timestamps != self.last_timestamps
+        self.last_timestamps = timestamps
+        if not is_fresh:
+            return False
+        self.fresh += 1
+        return (self.fresh - 1) % self.decimation == 0
+
+    def schedule(self, timestamps, n=None):
+        """
+        Vectorized is_due over a batch of samples.
+
+        Args:
+            timestamps: Accelerometer and magnetometer timestamps, shape (N, 2), (ms), None treats every reading as fresh.
+            n (int): Number of samples, only needed without timestamps.
+
+        Returns:
+            numpy.ndarray: Boolean array, True for the samples due an update, shape (N,).
+        """
+        if timestamps is None:
+            is_fresh = np.ones(n, dtype=bool)
+        else:
+            timestamps = np.asarray(timestamps).reshape(-1, 2)
+            if len(timestamps) == 0:
+                return np.zeros(0, dtype=bool)
+            is_fresh = np.empty(len(timestamps), dtype=bool)
+            is_fresh[0] = tuple(timestamps[0].tolist()) != self.last_timestamps
+            is_fresh[1:] = np.any(timestamps[1:] != timestamps[:-1], axis=1)
+            self.last_timestamps = tuple(timestamps[-1].tolist())
+
+        # Position of each fresh reading in the stream, counting from 1
+        positions = self.fresh + np.cumsum(is_fresh)
+        if len(positions):
+            self.fresh = int(positions[-1])
+        return is_fresh & ((positions - 1) % self.decimation == 0)
+
+class Stream_Fusion:
+    """
+    A class to hold the fusion state of one IMU stream and process its records a batch at a time.
+    Each batch gives the same result as processing its samples one at a time with predict_sample and update_sample,
+    which share the same state, so a stream can switch between the two at any sample.
+    """
+
+    def __init__(self, ekf_class=Fast_Extended_Kalman_Filter, update_decimation=1, ekf_options=None):
+        self.ekf_class = ekf_class      # Any filter class, they all have filter_batch
+        self.ekf_options = ekf_options or {}    # Keyword arguments for the filter, e.g. p0, process_noise, measurement_noise
+        self.ekf = None                 # Created from the first record
+        self.scheduler = Update_Scheduler(update_decimation)
+        self.gyro_state = None          # Integrated gyroscope orientation as Euler angles
+        self.euler_rotation = None      # Accelerometer and magnetometer orientation of the last update
+        self.updates = 0                # Number of measurement updates
+        self.prev_timestamp = None      # Gyro timestamp of the last record [ms]
+        self.count = 0                  # Number of records processed
+
+    def process(self, records):
+        """
+        Fuse a batch of records.
+        - Euler conversions and gyro deltas are computed for the whole batch in one vectorized pass.
+        - The EKF recursion then runs in a tight loop over the precomputed arrays.
+
+        Args:
+            records (numpy.ndarray): Structured array of STRUCT_DTYPE records.
+
+        Returns:
+            Tuple of (gyro_states (N, 3), euler_rotation (N, 3), fused (N, 4)), fused quaternions are (w, x, y, z).
+        """
+        if len(records) == 0:
+            return np.empty((0, 3)), np.empty((0, 3)), np.empty((0, 4))
+        accel, gyro, mag, dt = records_to_arrays(records, self.prev_timestamp)
+        timestamps = np.column_stack((records["timestampAcc"], records["timestampMag"]))
+        result = self.process_samples(accel, gyro, mag, dt, timestamps)
+        self.prev_timestamp = int(records["timestampGyro"][-1])
+        return result
+
+    def process_samples(self, accel, gyro, mag, dt, timestamps=None):
+        """
+        Fuse a batch of samples already split into arrays, e.g. a block drained from the consumer's queue.
+        Predict runs for every sample, the Euler conversion and update only for the samples the scheduler picks.
+
+        Args:
+            accel: Accelerometer readings, shape (N, 3).
+            gyro: Gyroscope readings, shape (N, 3).
+            mag: Magnetometer readings, shape (N, 3).
+            dt: Time since the previous sample, shape (N,), (s)
+            timestamps: Accelerometer and magnetometer timestamps, shape (N, 2), (ms), None treats every reading as fresh.
+
+        Returns:
+            Tuple of (gyro_states (N, 3), euler_rotation (N, 3), fused (N, 4)), fused quaternions are (w, x, y, z).
+            euler_rotation holds the orientation of the latest update at each sample.
+        """
+        accel, mag = np.asarray(accel, dtype=np.float64), np.asarray(mag, dtype=np.float64)
+        is_update = self.scheduler.schedule(timestamps, len(dt))
+        updates = np.flatnonzero(is_update)
+
+        # Vectorized conversions, Euler angles only for the samples with an update
+        delta_gyro = gyro_to_delta_rot_batch(gyro, dt)
+        measurements = acc_mag_to_euler_batch(accel[updates], mag[updates])
+
+        # Initialize the filter and gyro state with the first data, which is always due an update
+        if self.ekf is None:
+            self._start(measurements[0])
+
+        # Integrate every gyro delta, then run predict and update over the block
+        gyro_states = self.gyro_state + np.cumsum(delta_gyro, axis=0)
+        fused = self.ekf.filter_batch(delta_gyro, measurements, is_update)
+
+        # Carry the latest measurement forward to the samples without an update
+        latest = np.vstack((self.euler_rotation, measurements))
+        euler_rotation = latest[np.searchsorted(updates, np.arange(len(dt)), side="right")]
+
+        self.gyro_state = gyro_states[-1]
+        self.euler_rotation = euler_rotation[-1]
+        self.count += len(dt)
+        self.updates += len(updates)
+        return gyro_states, euler_rotation, fused
+
+    def predict_sample(self, accel, gyro, mag, dt):
+        """
+        Integrate one gyro reading and run predict, the per-sample counterpart of process_samples.
+        Building arrays for a block of one sample costs several times the scalar math, so single samples go through here.
+        The first sample initializes the filter from its accelerometer and magnetometer readings.
+
+        Args:
+            accel (list): Accelerometer reading (x, y, z).
+            gyro (list): Gyroscope reading (x, y, z).
+            mag (list): Magnetometer reading (x, y, z).
+            dt (float): Time since the previous sample (s).
+
+        Returns:
+            numpy.ndarray: Integrated gyroscope Euler angles.
+        """
+        if self.ekf is None:
+            self._start(np.array(acc_mag_to_euler(accel, mag)))
+        delta_gyro = gyro_to_delta_rot(gyro, dt)
+        self.gyro_state = self.gyro_state + np.array(delta_gyro)
+        self.ekf.predict(delta_gyro)
+        self.count += 1
+        return self.gyro_state
+
+    def update_sample(self, accel, mag, timestamps):
+        """
+        Run the measurement update for the sample just predicted, if the scheduler picks it.
+
+        Args:
+            accel (list): Accelerometer reading (x, y, z).
+            mag (list): Magnetometer reading (x, y, z).
+            timestamps (tuple): Accelerometer and magnetometer timestamps (ms).
+
+        Returns:
+            bool: Whether the update ran.
+        """
+        if not self.scheduler.is_due(*timestamps):
+            return False
+        self.euler_rotation = np.array(acc_mag_to_euler(accel, mag))
+        self.ekf.update(self.euler_rotation)
+        self.updates += 1
+        return True
+
+    def _start(self, measurement):
+        """Initialize the filter and gyro state with the first accelerometer and magnetometer orientation."""
+        self.gyro_state = self.euler_rotation = measurement
+        self.ekf = self.ekf_class(euler_to_quaternion_array(measurement), **self.ekf_options)
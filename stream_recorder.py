@@ -0,0 +1,263 @@
+import glob
+import logging
+import os
+import queue
+import re
+import threading
+import numpy as np
+from payload_imu_class import STRUCT_DTYPE, STRUCT_SIZE
+from recording import HEADER_SIZE, pack_header, open_recording
+
+# A log is a directory of numbered segments, each a binary recording (see recording.py) with a sparse index next to it
+SEGMENT_FORMAT = "segment_{:06d}.imu"
+SEGMENT_PATTERN = re.compile(r"segment_(\d{6})\.imu$")
+INDEX_SUFFIX = ".idx"
+INDEX_EVERY = 1024  # Records between index entries
+
+# Index entry: gyro timestamp [ms] of a record and its position in the segment
+INDEX_DTYPE = np.dtype([("timestamp", "<u8"), ("record", "<u8")])
+
+def segment_paths(directory):
+    """List the segments of a log in order."""
+    paths = glob.glob(os.path.join(directory, "segment_*.imu"))
+    return sorted(path for path in paths if SEGMENT_PATTERN.search(path))
+
+class Stream_Recorder:
+    """
+    A class to append received frames to a rotating log of segments, off the receive thread.
+    write() only queues the frames, and a writer thread appends them to the current segment in large
+    buffered writes, so a slow disk never stalls the receive loop. If the writer falls more than
+    max_pending_bytes behind, new frames are dropped and counted instead of queued.
+    - Each segment is a binary recording, its count is filled in when the segment is closed
+    - Every INDEX_EVERY records, the gyro timestamp and position are appended to the segment's index
+    - Segments rotate at segment_bytes, keeping the newest keep_segments (0 keeps all)
+    """
+
+    def __init__(self, directory, segment_bytes=64 << 20, keep_segments=0, index_every=INDEX_EVERY, max_pending_bytes=256 << 20):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_records = max(1, segment_bytes // STRUCT_SIZE)
+        self.keep_segments = keep_segments
+        self.index_every = index_every
+        self.max_pending_bytes = max_pending_bytes
+
+        # Continue numbering after any segments already in the directory
+        existing = [int(SEGMENT_PATTERN.search(path).group(1)) for path in segment_paths(directory)]
+        self.next_number = max(existing, default=0) + 1
+
+        self.file = None                # Current segment
+        self.index_file = None
+        self.path = None
+        self.count = 0                  # Records in the current segment
+
+        # Pending bytes are queued minus written, each counter is only updated by one thread
+        self.chunks = queue.SimpleQueue()
+        self.queued_bytes = 0
+        self.written_bytes = 0
+        self.dropped = 0
+
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def write(self, frames):
+        """
+        Queue frames to be appended, without blocking.
+
+        Args:
+            frames (bytes | numpy.ndarray): Packed frames or STRUCT_DTYPE records, not modified afterwards.
+
+        Returns:
+            bool: False if the frames were dropped because the writer is too far behind.
+        """
+        size = frames.nbytes if isinstance(frames, np.ndarray) else len(frames)
+        if self.queued_bytes - self.written_bytes + size > self.max_pending_bytes:
+            self.dropped += size // STRUCT_SIZE
+            return False
+        self.queued_bytes += size
+        self.chunks.put(frames)
+        return True
+
+    def close(self):
+        """Write everything queued, close the current segment and stop the writer."""
+        self.chunks.put(None)
+        self.thread.join()
+
+    def _write_loop(self):
+        """Append queued frames, draining the whole queue on each wake-up."""
+        is_stopping = False
+        while not is_stopping:
+            chunks = [self.chunks.get()]
+            while True:
+                try:
+                    chunks.append(self.chunks.get_nowait())
+                except queue.Empty:
+                    break
+
+            for chunk in chunks:
+                if chunk is None:
+                    is_stopping = True
+                    break
+                self._append(chunk)
+            if self.file is not None:
+                self.file.flush()
+                self.index_file.flush()
+        self._close_segment()
+
+    def _append(self, frames):
+        """Append frames to the log, rotating segments as they fill up."""
+        records = frames if isinstance(frames, np.ndarray) else np.frombuffer(frames, dtype=STRUCT_DTYPE)
+        while len(records):
+            if self.file is None:
+                self._open_segment()
+
+            part = records[:self.segment_records - self.count]
+            records = records[len(part):]
+
+            # Index the records whose position in the segment is a multiple of index_every
+            positions = np.arange(-self.count % self.index_every, len(part), self.index_every)
+            if len(positions):
+                entries = np.empty(len(positions), dtype=INDEX_DTYPE)
+                entries["timestamp"] = part["timestampGyro"][positions]
+                entries["record"] = self.count + positions
+                self.index_file.write(entries.tobytes())
+
+            self.file.write(np.ascontiguousarray(part).tobytes())
+            self.count += len(part)
+            self.written_bytes += part.nbytes
+            if self.count >= self.segment_records:
+                self._close_segment()
+
+    def _open_segment(self):
+        """Start a new segment with a placeholder header."""
+        self.path = os.path.join(self.directory, SEGMENT_FORMAT.format(self.next_number))
+        self.next_number += 1
+        self.file = open(self.path, "wb", buffering=1 << 20)
+        self.file.write(pack_header(0)) # the count is written when the segment is closed
+        self.index_file = open(self.path + INDEX_SUFFIX, "wb")
+        self.count = 0
+
+    def _close_segment(self):
+        """Fill in the record count of the current segment, close it and drop the oldest segments."""
+        if self.file is None:
+            return
+        self.file.seek(0)
+        self.file.write(pack_header(self.count))
+        self.file.close()
+        self.index_file.close()
+        logging.info(f"Recorded {self.count} records to {self.path}")
+        self.file = self.index_file = None
+
+        if self.keep_segments > 0:
+            for path in segment_paths(self.directory)[:-self.keep_segments]:
+                os.remove(path)
+                if os.path.exists(path + INDEX_SUFFIX):
+                    os.remove(path + INDEX_SUFFIX)
+
+def open_segment(path):
+    """
+    Open a segment as a memory map of records.
+    The count is taken from the file size, so a segment left open by a crash is still readable.
+
+    Args:
+        path (str): Path to the segment.
+
+    Returns:
+        numpy.memmap: Structured array of STRUCT_DTYPE records.
+    """
+    count = (os.path.getsize(path) - HEADER_SIZE) // STRUCT_SIZE
+    return open_recording(path, count=count)
+
+def load_index(path):
+    """
+    Load a segment's sparse index, ignoring a partially written last entry.
+
+    Args:
+        path (str): Path to the segment.
+
+    Returns:
+        numpy.ndarray: Structured array of INDEX_DTYPE entries.
+    """
+    index_path = path + INDEX_SUFFIX
+    if not os.path.exists(index_path):
+        return np.empty(0, dtype=INDEX_DTYPE)
+    with open(index_path, "rb") as f:
+        data = f.read()
+    return np.frombuffer(data, dtype=INDEX_DTYPE, count=len(data) // INDEX_DTYPE.itemsize)
+
+class Stream_Log:
+    """
+    A class to read a log written by Stream_Recorder, seeking by gyro timestamp with the sparse indexes.
+    Positions are (segment number, record) pairs, segment numbers counting from 0 in log order.
+    """
+
+    def __init__(self, directory):
+        self.paths = segment_paths(directory)
+        if not self.paths:
+            raise FileNotFoundError(f"No segments in {directory}")
+        self.segments = [open_segment(path) for path in self.paths]
+        self.indexes = [load_index(path) for path in self.paths]
+
+    def __len__(self):
+        return sum(len(records) for records in self.segments)
+
+    def seek(self, timestamp):
+        """
+        Find the first record at or after a timestamp.
+        The index narrows the search to one stretch of index_every records, which is the only part read from disk.
+
+        Args:
+            timestamp (int): Gyro timestamp [ms].
+
+        Returns:
+            tuple: (segment number, record) of the record, or (number of segments, 0) if every record is earlier.
+        """
+        for number, (records, index) in enumerate(zip(self.segments, self.indexes)):
+            if len(records) == 0:
+                continue
+            later = np.flatnonzero(index["timestamp"] >= timestamp)
+            if len(later):
+                # The record lies between the previous index entry and this one
+                start = int(index["record"][later[0] - 1]) if later[0] > 0 else 0
+                end = int(index["record"][later[0]]) + 1
+            else:
+                # Only records after the last index entry can still match
+                start = int(index["record"][-1]) if len(index) else 0
+                end = len(records)
+            match = np.flatnonzero(records["timestampGyro"][start:end] >= timestamp)
+            if len(match):
+                return number, start + int(match[0])
+        return len(self.segments), 0
+
+    def read(self, position=(0, 0), chunk=4096):
+        """
+        Read records in order from a position, across segments.
+
+        Args:
+            position (tuple): (segment number, record) to start from.
+            chunk (int): Maximum number of records per yielded array.
+
+        Yields:
+            numpy.ndarray: Structured arrays of STRUCT_DTYPE records, backed by the segment files.
+        """
+        number, start = position
+        for records in self.segments[number:]:
+            for i in range(start, len(records), chunk):
+                yield records[i:i + chunk]
+            start = 0
+
+    def summary(self):
+        """
+        Describe each segment.
+
+        Returns:
+            list: One dict per segment with its path, record count and first and last gyro timestamps [ms].
+        """
+        return [
+            {
+                "path": path,
+                "records": len(records),
+                "first_ms": int(records["timestampGyro"][0]) if len(records) else None,
+                "last_ms": int(records["timestampGyro"][-1]) if len(records) else None,
+            }
+            for path, records in zip(self.paths, self.segments)
+        ]
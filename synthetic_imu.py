@@ -0,0 +1,291 @@
+import argparse
+import logging
+import multiprocessing
+import socket
+import time
+import numpy as np
+from payload_imu_class import STRUCT_DTYPE
+from pacer import Pacer
+
+# Reference vectors in the world frame (x north, z up), matching sensor_data.csv at rest
+GRAVITY_MG = 1000.0             # [mg] the accelerometer reads +1 g on the up axis
+FIELD_MGAUSS = 435.0            # [mGauss] strength of the Earth's magnetic field
+FIELD_INCLINATION_DEG = 70.0    # [deg] the field points this far below the horizon
+
+def world_to_body(vector, roll, pitch, yaw):
+    """
+    Rotate a world frame vector into the body frame of z-y-x (yaw, pitch, roll) Euler angles,
+    the convention acc_mag_to_euler estimates roll and pitch in.
+
+    Args:
+        vector: World frame vector (x, y, z).
+        roll: Roll angles [rad], any shape.
+        pitch: Pitch angles [rad], same shape.
+        yaw: Yaw angles [rad], same shape.
+
+    Returns:
+        Tuple of the body frame (x, y, z) components, each with the shape of the angles.
+    """
+    x, y, z = vector
+    cos_r, sin_r = np.cos(roll), np.sin(roll)
+    cos_p, sin_p = np.cos(pitch), np.sin(pitch)
+    cos_y, sin_y = np.cos(yaw), np.sin(yaw)
+
+    # Undo yaw, then pitch, then roll
+    x, y = cos_y * x + sin_y * y, -sin_y * x + cos_y * y
+    x, z = cos_p * x - sin_p * z, sin_p * x + cos_p * z
+    y, z = cos_r * y + sin_r * z, -sin_r * y + cos_r * z
+    return x, y, z
+
+class Synthetic_IMU:
+    """
+    A class to generate IMU records for many simulated sensors at once, in vectorized blocks.
+    Each sensor follows its own smooth random orientation trajectory, with roll, pitch and yaw each a sum of a few sinusoids,
+    and its readings are consistent with it:
+    - The gyroscope reads the body angular velocity, from the Euler angle rates
+    - The accelerometer reads gravity, and the magnetometer the Earth's field, rotated into the body frame
+    - Every channel gets Gaussian noise, and each gyroscope a constant bias
+    The accelerometer and magnetometer can run slower than the gyroscope, holding each reading and its timestamp until the next.
+    """
+
+    def __init__(self, sensors=1, rate_hz=500, acc_rate_hz=None, mag_rate_hz=None, max_tilt_deg=30, max_yaw_deg=90,
+                 max_motion_hz=0.5, harmonics=3, gyro_noise=100, gyro_bias=30, acc_noise=2.5, mag_noise=3.5,
+                 block_size=1024, start_ms=None, seed=None):
+        self.sensors = sensors
+        self.rate_hz = int(rate_hz)                                     # Gyroscope rate, one record per gyroscope sample
+        self.acc_rate_hz = int(acc_rate_hz or rate_hz)
+        self.mag_rate_hz = int(mag_rate_hz or rate_hz)
+        self.gyro_noise = gyro_noise                                    # [mDeg/s] standard deviation
+        self.acc_noise = acc_noise                                      # [mg] standard deviation
+        self.mag_noise = mag_noise                                      # [mGauss] standard deviation
+        self.block_size = block_size                                    # Samples generated ahead by frames()
+        self.start_ms = int(time.time() * 1000) if start_ms is None else start_ms
+        self.rng = np.random.default_rng(seed)
+
+        # Trajectory of each sensor: angle = base + sum of amplitude * sin(2 pi frequency t + phase), shape (sensors, 3, harmonics)
+        max_amplitude = np.radians([max_tilt_deg, max_tilt_deg, max_yaw_deg])
+        weights = self.rng.uniform(size=(sensors, 3, harmonics))
+        total = self.rng.uniform(0.3, 1.0, size=(sensors, 3, 1)) * max_amplitude[:, None]
+        self.amplitudes = weights / weights.sum(axis=2, keepdims=True) * total
+        self.frequencies = self.rng.uniform(0.05, 1.0, size=(sensors, 3, harmonics)) * max_motion_hz
+        self.phases = self.rng.uniform(0, 2 * np.pi, size=(sensors, 3, harmonics))
+        self.bases = np.column_stack((np.zeros(sensors), np.zeros(sensors), self.rng.uniform(-np.pi, np.pi, sensors)))
+        self.gyro_biases = self.rng.normal(0, gyro_bias, size=(sensors, 1, 3))
+
+        self.count = 0          # Gyroscope samples generated so far
+        self._held = {}         # Last accelerometer and magnetometer reading of each sensor, by sensor name
+        self._pending = np.empty((sensors, 0), dtype=STRUCT_DTYPE)
+
+    def trajectory(self, t):
+        """
+        Evaluate the true orientation of every sensor.
+
+        Args:
+            t: Times since the start [s], shape (N,).
+
+        Returns:
+            Tuple of (Euler angles (sensors, N, 3), Euler angle rates (sensors, N, 3)), roll, pitch and yaw in [rad] and [rad/s].
+        """
+        angular = 2 * np.pi * self.frequencies
+        phase = angular[..., None] * np.asarray(t, dtype=np.float64) + self.phases[..., None]    # (sensors, 3, harmonics, N)
+        angles = self.bases[..., None] + np.einsum("sahn,sah->san", np.sin(phase), self.amplitudes)
+        rates = np.einsum("sahn,sah->san", np.cos(phase), self.amplitudes * angular)
+        return angles.transpose(0, 2, 1), rates.transpose(0, 2, 1)
+
+    def _held_readings(self, name, rate_hz, samples, angles, reading):
+        """
+        Sample a sensor at its own rate: its sample index at each gyroscope sample, and its reading held since that sample was taken.
+
+        Args:
+            name: Sensor name, to carry the held reading over from the previous block.
+            rate_hz: Sensor rate [Hz].
+            samples: Gyroscope sample indexes, shape (N,).
+            angles: Euler angles at the gyroscope samples, shape (sensors, N, 3), reused when the rates match.
+            reading: Function of Euler angles (sensors, M, 3) returning noisy readings, shape (sensors, M, 3).
+
+        Returns:
+            Tuple of (timestamps [ms] (N,), readings (sensors, N, 3)).
+        """
+        indexes = samples * rate_hz // self.rate_hz
+        timestamps = self.start_ms + indexes * 1000 // rate_hz
+        if rate_hz == self.rate_hz:
+            return timestamps, reading(angles)
+
+        # Only read the sensor when it takes a new sample, then forward-fill the readings
+        last_index, last_reading = self._held.get(name, (-1, None))
+        is_new = indexes != np.concatenate(([last_index], indexes[:-1]))
+        new = np.flatnonzero(is_new)
+        readings = reading(self.trajectory(indexes[new] / rate_hz)[0])
+        if last_reading is not None:
+            readings = np.concatenate((last_reading, readings), axis=1)
+            offset = 0
+        else:
+            offset = -1 # the first block always starts with a new sample
+        filled = np.searchsorted(new, np.arange(len(samples)), side="right") + offset
+        self._held[name] = (int(indexes[-1]), readings[:, -1:])
+        return timestamps, readings[:, filled]
+
+    def generate(self, n):
+        """
+        Generate the next n samples of every sensor.
+
+        Args:
+            n (int): Number of samples per sensor.
+
+        Returns:
+            numpy.ndarray: STRUCT_DTYPE records, shape (sensors, n), each row packed frames of one sensor.
+        """
+        samples = np.arange(self.count, self.count + n, dtype=np.int64)
+        self.count += n
+        records = np.empty((self.sensors, n), dtype=STRUCT_DTYPE)
+        if n == 0:
+            return records
+
+        # Gyroscope: body angular velocity from the z-y-x Euler angle rates
+        angles, rates = self.trajectory(samples / self.rate_hz)
+        (roll, pitch, _), (roll_rate, pitch_rate, yaw_rate) = np.moveaxis(angles, 2, 0), np.moveaxis(rates, 2, 0)
+        gyro = np.stack((
+            roll_rate - yaw_rate * np.sin(pitch),
+            pitch_rate * np.cos(roll) + yaw_rate * np.cos(pitch) * np.sin(roll),
+            -pitch_rate * np.sin(roll) + yaw_rate * np.cos(pitch) * np.cos(roll),
+        ), axis=2)
+        gyro = np.degrees(gyro) * 1000 + self.gyro_biases + self.rng.normal(0, self.gyro_noise, size=gyro.shape)
+        records["timestampGyro"] = self.start_ms + samples * 1000 // self.rate_hz
+        for i, axis in enumerate("xyz"):
+            records[f"{axis}Gyro"] = np.rint(gyro[..., i])
+
+        # Accelerometer and magnetometer: reference vectors rotated into the body frame, at their own rates
+        inclination = np.radians(FIELD_INCLINATION_DEG)
+        references = {
+            "Acc": ((0.0, 0.0, GRAVITY_MG), self.acc_rate_hz, self.acc_noise),
+            "Mag": ((FIELD_MGAUSS * np.cos(inclination), 0.0, -FIELD_MGAUSS * np.sin(inclination)), self.mag_rate_hz, self.mag_noise),
+        }
+        for name, (vector, rate_hz, noise) in references.items():
+            def reading(angles):
+                body = np.stack(world_to_body(vector, angles[..., 0], angles[..., 1], angles[..., 2]), axis=2)
+                return body + self.rng.normal(0, noise, size=body.shape)
+
+            timestamps, readings = self._held_readings(name, rate_hz, samples, angles, reading)
+            records[f"timestamp{name}"] = timestamps
+            for i, axis in enumerate("xyz"):
+                records[f"{axis}{name}"] = readings[..., i]
+        return records
+
+    def frames(self, n):
+        """
+        Take the next n samples of every sensor, generated ahead in blocks of block_size samples.
+
+        Args:
+            n (int): Number of samples per sensor.
+
+        Returns:
+            numpy.ndarray: STRUCT_DTYPE records, shape (sensors, n), row i holds sensor i's packed frames.
+        """
+        if self._pending.shape[1] < n:
+            self._pending = np.concatenate((self._pending, self.generate(max(n - self._pending.shape[1], self.block_size))), axis=1)
+        records, self._pending = self._pending[:, :n], self._pending[:, n:]
+        return records
+
+def publish_fleet(sensor_ids, args, seed):
+    """
+    Process to simulate a group of sensors, each with its own connection to the consumer.
+    All the sensors of the group share one pacer and are generated together, then each sensor's frames are sent on its connection.
+
+    Args:
+        sensor_ids: Ids of the simulated sensors, for logging.
+        args: Parsed arguments.
+        seed: Seed of the group's trajectories and noise, None for a random one.
+    """
+    logging.basicConfig(level=args.log_level.upper())
+    name = f"Sensors {sensor_ids[0]}-{sensor_ids[-1]}"
+    source = Synthetic_IMU(
+        len(sensor_ids), args.freq_hz, args.acc_rate_hz, args.mag_rate_hz, args.max_tilt_deg, args.max_yaw_deg,
+        args.max_motion_hz, gyro_noise=args.gyro_noise, gyro_bias=args.gyro_bias, acc_noise=args.acc_noise,
+        mag_noise=args.mag_noise, block_size=args.block_size, seed=seed,
+    )
+
+    pacer = Pacer(args.freq_hz, min_tick=args.tick_us / 1e6, max_burst=args.max_burst)
+    socks = []
+    try:
+        for _ in sensor_ids:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(args.socket_path)
+            socks.append(sock)
+        logging.info(f"{name} connected")
+
+        end = time.monotonic() + args.duration if args.duration > 0 else None
+        next_report = time.monotonic() + args.report_interval
+        while end is None or time.monotonic() < end:
+            due = pacer.wait()
+            records = source.frames(due)
+            for sock, frames in zip(socks, records):
+                sock.sendall(frames.tobytes())
+            pacer.record(due)
+
+            if args.report_interval > 0 and time.monotonic() >= next_report:
+                log_fleet_rate(name, pacer, len(socks))
+                next_report += args.report_interval
+        log_fleet_rate(name, pacer, len(socks))
+
+    except KeyboardInterrupt:
+        log_fleet_rate(name, pacer, len(socks))
+    except socket.error as e:
+        logging.error(f"{name}: Socket error: {e}")
+    finally:
+        for sock in socks:
+            sock.close()
+
+def log_fleet_rate(name, pacer, sensors):
+    """Log the achieved per-sensor and total send rate of a group of sensors."""
+    stats = pacer.stats()
+    logging.info(f"{name}: {stats['sent']} samples per sensor in {stats['elapsed']:.2f}s, {stats['achieved_hz']:.1f} Hz per sensor of {stats['target_hz']} Hz target "
+                 f"({stats['achieved_percent']:.1f}%), {stats['achieved_hz'] * sensors:.0f} samples/s in total, max lag {stats['max_lag_ms']:.2f}ms")
+
+
+if __name__ == "__main__":
+    # Initalize argument parser and define the arguments
+    parser = argparse.ArgumentParser(description="Simulate a fleet of moving IMUs, each publishing on its own connection, from a few processes")
+    parser.add_argument("--socket-path", dest="socket_path", type=str, default="/tmp/imu_sensor_socket", help="set socket path, match with the consumer socket path (multi_consumer.py for more than one sensor)")
+    parser.add_argument("--sensors", dest="sensors", type=int, default=16, help="number of simulated sensors")
+    parser.add_argument("--processes", dest="processes", type=int, default=2, help="number of processes the sensors are split across")
+    parser.add_argument("--frequency-hz", dest="freq_hz", type=int, default=500, help="gyroscope rate of each sensor, one frame per gyroscope sample")
+    parser.add_argument("--acc-rate-hz", dest="acc_rate_hz", type=int, default=None, help="accelerometer rate, readings are held between samples, default is the gyroscope rate")
+    parser.add_argument("--mag-rate-hz", dest="mag_rate_hz", type=int, default=None, help="magnetometer rate, default is the gyroscope rate")
+    parser.add_argument("--duration", dest="duration", type=float, default=0, help="seconds to publish for, 0 publishes until interrupted")
+    parser.add_argument("--max-tilt-deg", dest="max_tilt_deg", type=float, default=30, help="largest roll and pitch excursion")
+    parser.add_argument("--max-yaw-deg", dest="max_yaw_deg", type=float, default=90, help="largest yaw excursion")
+    parser.add_argument("--max-motion-hz", dest="max_motion_hz", type=float, default=0.5, help="highest frequency of the motion")
+    parser.add_argument("--gyro-noise", dest="gyro_noise", type=float, default=100, help="gyroscope noise standard deviation [mDeg/s]")
+    parser.add_argument("--gyro-bias", dest="gyro_bias", type=float, default=30, help="standard deviation of each gyroscope's constant bias [mDeg/s]")
+    parser.add_argument("--acc-noise", dest="acc_noise", type=float, default=2.5, help="accelerometer noise standard deviation [mg]")
+    parser.add_argument("--mag-noise", dest="mag_noise", type=float, default=3.5, help="magnetometer noise standard deviation [mGauss]")
+    parser.add_argument("--block-size", dest="block_size", type=int, default=1024, help="samples per sensor generated ahead in one vectorized block")
+    parser.add_argument("--seed", dest="seed", type=int, default=None, help="seed of the trajectories and noise, default is random")
+    parser.add_argument("--max-burst", dest="max_burst", type=int, default=1024, help="maximum number of frames sent per sensor in one call")
+    parser.add_argument("--tick-us", dest="tick_us", type=int, default=1000, help="minimum time between sends [us]")
+    parser.add_argument("--report-interval", dest="report_interval", type=float, default=5, help="seconds between achieved rate reports, 0 only reports at exit")
+    parser.add_argument("--log-level", dest="log_level", type=str, default="INFO", choices=["INFO", "WARNING", "ERROR", "CRITICAL"])
+    args = parser.parse_args()
+
+    # Set up logger, defining minimum logging level
+    logging.basicConfig(level=args.log_level.upper())
+
+    # Split the sensors across the processes, each generating and pacing its group together
+    groups = [group.tolist() for group in np.array_split(np.arange(args.sensors), max(1, min(args.processes, args.sensors)))]
+    processes = [
+        multiprocessing.Process(target=publish_fleet, args=(group, args, None if args.seed is None else args.seed + i))
+        for i, group in enumerate(groups)
+    ]
+    logging.info(f"Simulating {args.sensors} sensors at {args.freq_hz} Hz from {len(processes)} processes")
+    for process in processes:
+        process.start()
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # The processes get the interrupt too, and report before exiting
+        for process in processes:
+            process.join()
+        print()
+        logging.critical("Keyboard interrupt detected, forcing exiting")
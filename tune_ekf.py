@@ -0,0 +1,234 @@
+import argparse
+import csv
+import logging
+import os
+import time
+import numpy as np
+from multiprocessing import Pool, shared_memory
+from recording import load_recording, records_to_arrays
+from sensor_processing import F_BASIS, gyro_to_delta_rot_batch, acc_mag_to_euler_batch, euler_to_quaternion_batch
+from stream_fusion import Update_Scheduler
+
+# Noise setting of the filters when none is given: initial state covariance, process noise, measurement noise
+DEFAULT_SETTING = (0.1, 0.01, 0.1)
+
+# Columns of the filter inputs: delta rotation, accel/mag measurement quaternion, update flag
+DELTA, MEASUREMENT, UPDATE = slice(0, 3), slice(3, 7), 7
+N_COLUMNS = 8
+
+def prepare_inputs(records, update_decimation=1):
+    """
+    Precompute everything the filter reads from a recording, with the same conversions and update schedule as Stream_Fusion.
+
+    Args:
+        records (numpy.ndarray): Structured array of STRUCT_DTYPE records.
+        update_decimation (int): Apply a measurement update on every Nth fresh accelerometer or magnetometer reading.
+
+    Returns:
+        numpy.ndarray: Filter inputs, shape (N, N_COLUMNS).
+    """
+    accel, gyro, mag, dt = records_to_arrays(records)
+    timestamps = np.column_stack((records["timestampAcc"], records["timestampMag"]))
+    inputs = np.empty((len(dt), N_COLUMNS))
+    inputs[:, DELTA] = gyro_to_delta_rot_batch(gyro, dt)
+    inputs[:, MEASUREMENT] = euler_to_quaternion_batch(acc_mag_to_euler_batch(accel, mag))
+    inputs[:, UPDATE] = Update_Scheduler(update_decimation).schedule(timestamps, len(dt))
+    return inputs
+
+def evaluate_settings(inputs, settings):
+    """
+    Fuse a recording with many noise settings side by side and score each one.
+    Every setting keeps P, Q and R scalar multiples of identity, so each follows the scalar recursion of
+    Fast_Extended_Kalman_Filter. Stepping all of them together as arrays costs a few vectorized operations
+    per sample, instead of one Python loop over the recording per setting.
+
+    Args:
+        inputs (numpy.ndarray): Filter inputs from prepare_inputs, shape (N, N_COLUMNS).
+        settings: (p0, process noise, measurement noise) of each setting, shape (C, 3).
+
+    Returns:
+        numpy.ndarray: RMS angles in degrees of each setting, shape (C, 2).
+            Column 0, agreement: between the fused and accel/mag orientations, on the samples with an update.
+            Column 1, smoothness: between consecutive fused orientations.
+    """
+    settings = np.asarray(settings, dtype=np.float64).reshape(-1, 3)
+    p, process_noise, measurement_noise = settings.T.copy()
+    deltas, measurements = inputs[:, DELTA], inputs[:, MEASUREMENT]
+
+    # Predict as one product per sample, q @ (I + F).T is q + 0.5 * (q * delta_gyro) for row vectors
+    transitions = np.eye(4) + (deltas @ F_BASIS).reshape(-1, 4, 4).transpose(0, 2, 1)
+    # F @ F.T = 0.25 * |delta_gyro|^2 * I, so the covariance recursion is scalar
+    scales = (0.25 * np.einsum("ij,ij->i", deltas, deltas)).tolist()
+    is_update = (inputs[:, UPDATE] != 0).tolist()
+
+    # Every setting starts from the first measurement, like Stream_Fusion
+    q = np.tile(measurements[0], (len(settings), 1))
+    agreement = np.zeros(len(settings))     # Sums of squared angles [rad^2]
+    smoothness = np.zeros(len(settings))
+    for transition, scale, measurement, has_update in zip(transitions, scales, measurements, is_update):
+        previous = q
+        q = q @ transition
+        q /= np.sqrt(np.einsum("ij,ij->i", q, q))[:, None]
+        p = scale * p + process_noise
+
+        if has_update:
+            # K = p / (p + r) * I, so the update is a blend of the two quaternions
+            gain = p / (p + measurement_noise)
+            q += gain[:, None] * (measurement - q)
+            q /= np.sqrt(np.einsum("ij,ij->i", q, q))[:, None]
+            p = (1 - gain) * p
+
+            # |q - m|^2 = 2 - 2 |q . m| for the closer sign of m, then angle = 4 * arcsin(chord / 2)
+            chord = np.sqrt(np.maximum(2 - 2 * np.abs(q @ measurement), 0))
+            agreement += np.square(4 * np.arcsin(np.minimum(chord / 2, 1)))
+
+        # Consecutive steps are small, so take the chord from the difference to keep it accurate,
+        # |q + previous|^2 = 4 - |q - previous|^2 covers a sign flip of the quaternion
+        step = q - previous
+        chord_sq = np.einsum("ij,ij->i", step, step)
+        chord = np.sqrt(np.minimum(chord_sq, 4 - chord_sq))
+        smoothness += np.square(4 * np.arcsin(np.minimum(chord / 2, 1)))
+
+    n_updates = max(sum(is_update), 1)
+    return np.degrees(np.column_stack((np.sqrt(agreement / n_updates), np.sqrt(smoothness / max(len(scales), 1)))))
+
+def grid_settings(p0_range, q_range, r_range, points):
+    """Every combination of points log-spaced values in each (low, high) range, shape (points^3, 3)."""
+    axes = [np.geomspace(low, high, points) for low, high in (p0_range, q_range, r_range)]
+    return np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3)
+
+def random_settings(p0_range, q_range, r_range, samples, seed=None):
+    """Settings drawn log-uniformly from each (low, high) range, shape (samples, 3)."""
+    rng = np.random.default_rng(seed)
+    low = np.log([p0_range[0], q_range[0], r_range[0]])
+    high = np.log([p0_range[1], q_range[1], r_range[1]])
+    return np.exp(rng.uniform(low, high, size=(samples, 3)))
+
+# Filter inputs of the sweep, attached read-only by each worker process
+_shm = None
+_inputs = None
+
+def _attach_inputs(name, shape):
+    """Pool initializer, map the shared filter inputs without copying them."""
+    global _shm, _inputs
+    # Workers share the parent's resource tracker, so attaching normally leaves the unlink to the parent
+    _shm = shared_memory.SharedMemory(name=name)
+    _inputs = np.ndarray(shape, dtype=np.float64, buffer=_shm.buf)
+    _inputs.flags.writeable = False
+
+def _evaluate_chunk(job):
+    """Score one chunk of settings in a worker, keeping its position so results can arrive in any order."""
+    start, settings = job
+    return start, evaluate_settings(_inputs, settings)
+
+def sweep(inputs, settings, jobs=None, chunk_size=256):
+    """
+    Score noise settings across a pool of worker processes.
+    The inputs are copied once into shared memory and every worker maps them read-only, so
+    starting a worker or sending it a chunk never copies the recording.
+
+    Args:
+        inputs (numpy.ndarray): Filter inputs from prepare_inputs, shape (N, N_COLUMNS).
+        settings (numpy.ndarray): (p0, process noise, measurement noise) of each setting, shape (C, 3).
+        jobs (int): Number of worker processes, None uses every core.
+        chunk_size (int): Number of settings each worker fuses side by side per task.
+
+    Returns:
+        numpy.ndarray: (agreement, smoothness) RMS angles in degrees of each setting, shape (C, 2).
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(inputs.nbytes, 1))
+    try:
+        np.ndarray(inputs.shape, dtype=np.float64, buffer=shm.buf)[:] = inputs
+        scores = np.empty((len(settings), 2))
+        chunks = [(start, settings[start:start + chunk_size]) for start in range(0, len(settings), chunk_size)]
+
+        done = 0
+        last_report = time.monotonic()
+        with Pool(jobs or os.cpu_count(), initializer=_attach_inputs, initargs=(shm.name, inputs.shape)) as pool:
+            for start, chunk_scores in pool.imap_unordered(_evaluate_chunk, chunks):
+                scores[start:start + len(chunk_scores)] = chunk_scores
+                done += len(chunk_scores)
+                if time.monotonic() - last_report > 5:
+                    logging.info(f"Evaluated {done}/{len(settings)} settings")
+                    last_report = time.monotonic()
+        return scores
+    finally:
+        shm.close()
+        shm.unlink()
+
+def rank(scores, smoothness_weight=0.5):
+    """
+    Combine agreement and smoothness into one score, relative to the default setting (the first row).
+
+    Args:
+        scores (numpy.ndarray): (agreement, smoothness) of each setting, shape (C, 2), the default setting first.
+        smoothness_weight (float): Weight of smoothness against agreement, from 0 to 1.
+
+    Returns:
+        Tuple of (combined score (C,), order of the settings from best to worst (C,)), a score of 1 matches the default.
+    """
+    relative = scores / np.maximum(scores[0], np.finfo(np.float64).tiny)
+    combined = (1 - smoothness_weight) * relative[:, 0] + smoothness_weight * relative[:, 1]
+    return combined, np.argsort(combined, kind="stable")
+
+def write_report(path, settings, scores, combined, order):
+    """Write every setting from best to worst as CSV."""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["rank", "p0", "process_noise", "measurement_noise", "agreement_deg", "smoothness_deg", "score"])
+        for position, index in enumerate(order, 1):
+            writer.writerow([position, *(f"{value:.6g}" for value in settings[index]), f"{scores[index, 0]:.6g}", f"{scores[index, 1]:.6g}", f"{combined[index]:.6g}"])
+
+
+if __name__ == "__main__":
+    # Initalize argument parser and define the arguments
+    parser = argparse.ArgumentParser(description="Search EKF noise settings over a recording, in parallel, and rank them")
+    parser.add_argument("--input", dest="input_path", type=str, default="sensor_data.csv", help="recording to fuse, binary or CSV")
+    parser.add_argument("--search", dest="search", type=str, default="grid", choices=["grid", "random"], help="evaluate a log-spaced grid, or log-uniform random settings")
+    parser.add_argument("--grid-points", dest="grid_points", type=int, default=15, help="values per parameter in grid search")
+    parser.add_argument("--samples", dest="samples", type=int, default=2000, help="number of settings in random search")
+    parser.add_argument("--seed", dest="seed", type=int, default=None, help="random search seed")
+    parser.add_argument("--p0-range", dest="p0_range", type=float, nargs=2, default=[1e-4, 10], help="range of the initial state covariance")
+    parser.add_argument("--q-range", dest="q_range", type=float, nargs=2, default=[1e-6, 1], help="range of the process noise covariance")
+    parser.add_argument("--r-range", dest="r_range", type=float, nargs=2, default=[1e-4, 10], help="range of the measurement noise covariance")
+    parser.add_argument("--update-decimation", dest="update_decimation", type=int, default=1, help="apply a measurement update on every Nth fresh accelerometer or magnetometer reading, match the consumer")
+    parser.add_argument("--smoothness-weight", dest="smoothness_weight", type=float, default=0.5, help="weight of smoothness against agreement with the accel/mag orientation, from 0 to 1")
+    parser.add_argument("--jobs", dest="jobs", type=int, default=None, help="number of worker processes, default is every core")
+    parser.add_argument("--chunk-size", dest="chunk_size", type=int, default=256, help="settings fused side by side per worker task")
+    parser.add_argument("--top", dest="top", type=int, default=10, help="number of settings to print")
+    parser.add_argument("--output", dest="output_path", type=str, default=None, help="write every setting, ranked, to this CSV file")
+    parser.add_argument("--log-level", dest="log_level", type=str, default="INFO", choices=["INFO", "WARNING", "ERROR", "CRITICAL"])
+    args = parser.parse_args()
+
+    # Set up logger, defining minimum logging level
+    logging.basicConfig(level=args.log_level.upper())
+
+    records = load_recording(args.input_path)
+    inputs = prepare_inputs(records, args.update_decimation)
+    if args.search == "grid":
+        candidates = grid_settings(args.p0_range, args.q_range, args.r_range, args.grid_points)
+    else:
+        candidates = random_settings(args.p0_range, args.q_range, args.r_range, args.samples, args.seed)
+    settings = np.vstack(([DEFAULT_SETTING], candidates)) # the default first, as the reference of the score
+
+    jobs = args.jobs or os.cpu_count()
+    logging.info(f"Evaluating {len(settings)} settings over {len(inputs)} samples from {args.input_path} with {jobs} workers")
+    start = time.perf_counter()
+    scores = sweep(inputs, settings, jobs, args.chunk_size)
+    elapsed = time.perf_counter() - start
+    logging.info(f"Evaluated {len(settings)} settings in {elapsed:.1f} s ({len(settings) / elapsed:.1f} settings/s)")
+
+    combined, order = rank(scores, args.smoothness_weight)
+    print(f"{'rank':>5} {'p0':>10} {'Q':>10} {'R':>10} {'agreement':>10} {'smoothness':>11} {'score':>7}")
+    for position, index in enumerate(order[:args.top], 1):
+        p0, q, r = settings[index]
+        print(f"{position:>5} {p0:>10.3g} {q:>10.3g} {r:>10.3g} {scores[index, 0]:>9.4f}° {scores[index, 1]:>10.5f}° {combined[index]:>7.3f}")
+    default_rank = int(np.flatnonzero(order == 0)[0]) + 1
+    print(f"default (p0={DEFAULT_SETTING[0]:g} Q={DEFAULT_SETTING[1]:g} R={DEFAULT_SETTING[2]:g}) ranks {default_rank} of {len(settings)}: "
+          f"agreement {scores[0, 0]:.4f}°, smoothness {scores[0, 1]:.5f}°")
+    p0, q, r = settings[order[0]]
+    print(f"best setting: --ekf-p0 {p0:.3g} --ekf-q {q:.3g} --ekf-r {r:.3g}")
+
+    if args.output_path:
+        write_report(args.output_path, settings, scores, combined, order)
+        logging.info(f"Ranked settings written to {args.output_path}")
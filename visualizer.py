@@ -2,6 +2,7 @@ from mpl_toolkits.mplot3d import Axes3D
 import matplotlib.pyplot as plt
 import numpy as np
 import quaternion
+import time
 import warnings
 
 warnings.filterwarnings("ignore", category=UserWarning)
@@ -9,50 +10,94 @@ warnings.filterwarnings("ignore", category=UserWarning)
 class Visualizer:
     """
     A class to visualize the sensor data in 3D space.
+    The arrows are created once and their data is updated in place, and the plot is
+    rendered at a fixed frame rate with the latest data, so plotting does not throttle fusion.
+    Blitting is used where the backend supports it.
     """
 
-    def __init__(self):
-        # Set up figure and 3D axis
+    def __init__(self, fps=30):
+        self.frame_interval = 1.0 / fps     # Minimum time between rendered frames
+        self.last_render = 0.0
+        self.latest = None                  # Latest data received, rendered on the next frame
+        self.background = None              # Saved axes without the arrows, for blitting
+
+        # Set up figure and 3D axis once, the limits never change
         self.fig = plt.figure()
-        self.fig.legend("Gyro, Accel/Mag, Fused Result", loc="upper right")
         self.ax = self.fig.add_subplot(111, projection='3d')
+        self.ax.set_xlim(-1, 1)
+        self.ax.set_ylim(-1, 1)
+        self.ax.set_zlim(-1, 1)
+
+        # Blit only on backends that can save and restore a region of the canvas
+        self.use_blit = self.fig.canvas.supports_blit
+
+        # Persistent arrows from the origin, drawn as lines with a marker at the tip
+        # Full draws skip animated artists, so the arrows are only animated when blitting draws them separately
+        self.lines = [
+            self.ax.plot([0, 1], [0, 0], [0, 0], color=color, label=label, marker='o', markevery=[1], animated=self.use_blit)[0]
+            for color, label in (('r', 'Gyro'), ('g', 'Accel/Mag'), ('b', 'Fused Result'))
+        ]
+        self.ax.legend(loc="upper right")
+        self.fig.canvas.mpl_connect('draw_event', self._on_draw)
+        plt.show(block=False)
+        plt.pause(0.001)
+
+    def _on_draw(self, event):
+        """Save the background after a full draw (first frame, resize or view rotation) and redraw the arrows on it."""
+        if self.use_blit:
+            self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+            self._draw_lines()
+
+    def _draw_lines(self):
+        """Draw the animated arrows on top of the current canvas."""
+        for line in self.lines:
+            self.ax.draw_artist(line)
 
     def update_plot(self, raw_gyro, raw_accel_mag, fused_result):
         """
         Update the plot with new data.
-        
+        Data is only stored here, and rendered once the frame interval has passed.
+
         Args:
             raw_gyro (list): Raw gyroscope data (x, y, z).
             raw_accel_mag (list): Raw accelerometer and magnetometer data (x, y, z).
             fused_result (quaternion): Fused quaternion result from EKF.
         """
+        self.latest = (raw_gyro, raw_accel_mag, fused_result)
+        now = time.monotonic()
+        if now - self.last_render >= self.frame_interval:
+            self.last_render = now
+            self.render()
+
+    def render(self):
+        """Render the latest data."""
+        if self.latest is None:
+            return
+        raw_gyro, raw_accel_mag, fused_result = self.latest
 
-        # Convert quaternions into vectors for plotting, quiver requires 3D vectors
+        # Convert quaternions into vectors for plotting
         vec = np.array([1, 0, 0])
-        raw_gyro = quaternion.rotate_vectors(quaternion.from_euler_angles(raw_gyro).normalized(), vec)
-        raw_accel_mag = quaternion.rotate_vectors(quaternion.from_euler_angles(raw_accel_mag).normalized(), vec)
-        fused_result = quaternion.rotate_vectors(fused_result.normalized(), vec)
-
-        # Extract the components of the vectors
-        u_gyro, v_gyro, w_gyro = raw_gyro
-        u_am, v_am, w_am = raw_accel_mag
-        u_fused, v_fused, w_fused = fused_result
-        
-        # Clear the axes and re-draw the quivers with new data
-        self.ax.cla()  # Removes old quivers
-        self.ax.set_xlim(-1, 1)
-        self.ax.set_ylim(-1, 1)
-        self.ax.set_zlim(-1, 1)
-        
-        # Create new quivers with updated data
-        self.ax.quiver(0, 0, 0, u_gyro, v_gyro, w_gyro, color='r', label='Gyro')
-        self.ax.quiver(0, 0, 0, u_am, v_am, w_am, color='g', label='Accel/Mag')
-        self.ax.quiver(0, 0, 0, u_fused, v_fused, w_fused, color='b', label='Fused Result')
-        
-        plt.draw()  # Redraw the updated plot
-        plt.pause(0.001)
+        vectors = (
+            quaternion.rotate_vectors(quaternion.from_euler_angles(raw_gyro).normalized(), vec),
+            quaternion.rotate_vectors(quaternion.from_euler_angles(raw_accel_mag).normalized(), vec),
+            quaternion.rotate_vectors(fused_result.normalized(), vec),
+        )
+
+        # Update the existing arrows in place
+        for line, (u, v, w) in zip(self.lines, vectors):
+            line.set_data_3d([0, u], [0, v], [0, w])
+
+        if self.use_blit and self.background is not None:
+            # Restore the saved background, draw only the arrows and push the changed region
+            self.fig.canvas.restore_region(self.background)
+            self._draw_lines()
+            self.fig.canvas.blit(self.fig.bbox)
+        else:
+            self.fig.canvas.draw_idle()
+        self.fig.canvas.flush_events()
 
     def close(self):
         """Close the plot."""
+        self.render() # show the final data
         plt.pause(1)
         plt.gcf().canvas.manager.window.after(1, plt.close)